@@ -0,0 +1,102 @@
+"""
+Benchmark of typin tracing an asyncio echo server and its clients talking over
+a local socket, the sort of workload an aiohttp service has.
+
+This runs the same workload bare and under
+``TypeInferencer(asyncio_aware=True)`` for increasing numbers of messages and
+reports the overhead ratio. The ratio should stay roughly constant as the
+number of messages grows i.e. the overhead is bounded per message.
+
+Only the loopback interface is used. Usage::
+
+    python benchmarks/bench_asyncio_echo.py --clients 4 --messages 50 100 200
+
+Created on 19 Oct 2026
+
+@author: paulross
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+from typin import type_inferencer
+
+MESSAGE = b'Hello, world!\n'
+
+async def handle_echo(reader, writer):
+    """Echo each line back to the client until EOF."""
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        writer.write(line)
+        await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+
+async def echo_client(port, num_messages):
+    """Send num_messages lines to the server and check each echo."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    for _i in range(num_messages):
+        writer.write(MESSAGE)
+        await writer.drain()
+        echo = await reader.readline()
+        assert echo == MESSAGE, echo
+    writer.close()
+    await writer.wait_closed()
+    return num_messages
+
+async def echo_workload(num_clients, num_messages):
+    """Run a server and num_clients concurrent clients. Returns the total
+    number of messages echoed."""
+    server = await asyncio.start_server(handle_echo, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        counts = await asyncio.gather(
+            *[echo_client(port, num_messages) for _i in range(num_clients)]
+        )
+    return sum(counts)
+
+def run_bare(num_clients, num_messages):
+    """Returns the wall clock time to run the workload without tracing."""
+    start = time.perf_counter()
+    asyncio.run(echo_workload(num_clients, num_messages))
+    return time.perf_counter() - start
+
+def run_traced(num_clients, num_messages):
+    """Returns (time, TypeInferencer) to run the workload under typin."""
+    start = time.perf_counter()
+    with type_inferencer.TypeInferencer(asyncio_aware=True) as ti:
+        asyncio.run(echo_workload(num_clients, num_messages))
+    return time.perf_counter() - start, ti
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=4,
+                        help='Number of concurrent clients. [default: %(default)s]')
+    parser.add_argument('--messages', type=int, nargs='+', default=[50, 100, 200],
+                        help='Messages per client for each run. [default: %(default)s]')
+    args = parser.parse_args()
+    # typin warns about every method whose class it can not find.
+    logging.basicConfig(level=logging.ERROR)
+    # Warm up asyncio and the socket machinery so the first bare run is not
+    # penalised. Each traced run has a new TypeInferencer so every one of
+    # them resolves each function afresh.
+    run_bare(args.clients, args.messages[0])
+    print('{:>8s} {:>10s} {:>10s} {:>8s} {:>10s} {:>12s}'.format(
+        'Messages', 'Bare (s)', 'Traced (s)', 'Ratio', 'Events', 'us/message'))
+    for num_messages in args.messages:
+        total = args.clients * num_messages
+        bare = run_bare(args.clients, num_messages)
+        traced, ti = run_traced(args.clients, num_messages)
+        print('{:8d} {:10.3f} {:10.3f} {:8.1f} {:10d} {:12.1f}'.format(
+            total, bare, traced, traced / bare, ti.eventno,
+            1e6 * (traced - bare) / total))
+        assert ti.exceptions_in_progress == {}
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
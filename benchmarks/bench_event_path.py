@@ -0,0 +1,76 @@
+"""
+Benchmark of the rate at which ``TypeInferencer`` handles trace events once
+each function has been seen. Every code object is bound to its record on its
+first event, later events look up that binding and record. By default this
+runs the method heavy workload of ``bench_overhead.py``.
+
+For each recording mode this reports the events per second and the hit rate
+of the code bindings. Usage::
+
+    python benchmarks/bench_event_path.py
+    python benchmarks/bench_event_path.py --workloads methods recursion --repeat 5
+
+Created on 19 Oct 2026
+
+@author: paulross
+"""
+import argparse
+import collections
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bench_overhead
+
+from typin import type_inferencer
+
+#: dict of {name : TypeInferencer keyword arguments, ...} in reporting order.
+MODES = collections.OrderedDict((
+    ('fast', {}),
+    ('columnar', {'columnar' : True}),
+    ('deferred', {'deferred' : True}),
+))
+
+def run_mode(function, size, kwargs, repeat):
+    """Returns (best events per second, TypeInferencer) of running the
+    workload in a recording mode."""
+    best = None
+    for _i in range(repeat):
+        ti = type_inferencer.TypeInferencer(**kwargs)
+        start = time.perf_counter()
+        with ti:
+            function(size)
+        elapsed = time.perf_counter() - start
+        rate = ti.eventno / elapsed
+        if best is None or rate > best:
+            best = rate
+    return best, ti
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-w', '--workloads', nargs='+', default=['methods'],
+                        choices=list(bench_overhead.WORKLOADS),
+                        help='Workloads to run. [default: %(default)s]')
+    parser.add_argument('-m', '--modes', nargs='+', default=list(MODES), choices=list(MODES),
+                        help='Recording modes. [default: all]')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Take the best rate of this many runs. [default: %(default)s]')
+    args = parser.parse_args()
+    # typin warns about every method whose class it can not find.
+    logging.basicConfig(level=logging.ERROR)
+    print('{:<12s} {:<10s} {:>10s} {:>12s} {:>10s}'.format(
+        'Workload', 'Mode', 'Events', 'Events/s', 'Hit rate'))
+    for name in args.workloads:
+        function, size = bench_overhead.WORKLOADS[name]
+        for mode in args.modes:
+            rate, ti = run_mode(function, size, MODES[mode], args.repeat)
+            print('{:<12s} {:<10s} {:10d} {:12.0f} {:10.1%}'.format(
+                name, mode, ti.eventno, rate, ti.stats()['code_resolution']['hit_rate']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
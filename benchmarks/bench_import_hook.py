@@ -0,0 +1,89 @@
+"""
+Benchmark comparing the two ways typin can record types on the same
+workloads, those of ``bench_overhead.py``:
+
+* ``settrace`` - ``TypeInferencer`` traces every function.
+* ``import-hook`` - The workload module is imported with
+  ``typin.import_hook`` so only its functions are wrapped and there is no
+  trace function.
+
+For each workload this reports the overhead ratio of each mode over the bare
+run and whether both modes produce the same stubs. Usage::
+
+    python benchmarks/bench_import_hook.py
+    python benchmarks/bench_import_hook.py --workloads recursion methods --repeat 5
+
+Created on 19 Oct 2026
+
+@author: paulross
+"""
+import argparse
+import importlib
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bench_overhead
+
+from typin import import_hook
+from typin import type_inferencer
+
+WORKLOAD_MODULE = 'bench_overhead'
+
+def import_instrumented(ti):
+    """Returns a fresh copy of the workload module imported with the hook so
+    that its functions record into ti."""
+    saved = sys.modules.pop(WORKLOAD_MODULE)
+    try:
+        with import_hook.instrumented_imports([WORKLOAD_MODULE], ti, instrument_imported=False):
+            return importlib.import_module(WORKLOAD_MODULE)
+    finally:
+        sys.modules[WORKLOAD_MODULE] = saved
+
+def run_import_hook(name, repeat):
+    """Returns (best time, TypeInferencer) of running the workload with the
+    import hook, the import is not timed."""
+    best = None
+    for _i in range(repeat):
+        ti = type_inferencer.TypeInferencer()
+        module = import_instrumented(ti)
+        function = getattr(module, bench_overhead.WORKLOADS[name][0].__name__)
+        size = bench_overhead.WORKLOADS[name][1]
+        start = time.perf_counter()
+        function(size)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, ti
+
+def stubs(ti):
+    return ti.pretty_format(bench_overhead.__file__)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-w', '--workloads', nargs='+', default=list(bench_overhead.WORKLOADS),
+                        choices=list(bench_overhead.WORKLOADS),
+                        help='Workloads to run. [default: all]')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Take the best time of this many runs. [default: %(default)s]')
+    args = parser.parse_args()
+    # typin warns about every method whose class it can not find.
+    logging.basicConfig(level=logging.ERROR)
+    print('{:<12s} {:>10s} {:>12s} {:>12s} {:>10s} {:>12s} {:>6s}'.format(
+        'Workload', 'Bare (s)', 'settrace (s)', 'Hook (s)', 'settrace', 'Hook', 'Same'))
+    for name in args.workloads:
+        function, size = bench_overhead.WORKLOADS[name]
+        bare = bench_overhead.run_bare(function, size, args.repeat)
+        settrace, settrace_ti = bench_overhead.run_traced(function, size, args.repeat)
+        hook, hook_ti = run_import_hook(name, args.repeat)
+        print('{:<12s} {:10.4f} {:12.4f} {:12.4f} {:10.1f} {:12.1f} {:>6s}'.format(
+            name, bare, settrace, hook, settrace / bare, hook / bare,
+            'yes' if stubs(settrace_ti) == stubs(hook_ti) else 'no'))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""
+Benchmark of the overhead of typin on representative workloads:
+
+* ``recursion`` - Tight recursive calls of a small function.
+* ``methods`` - Method heavy object oriented code with inheritance.
+* ``exceptions`` - Functions that raise, propagate and catch exceptions.
+* ``generators`` - Generators and generator pipelines.
+* ``containers`` - Functions called with large container arguments.
+
+Each workload is run bare and under ``TypeInferencer``. For each this
+reports the overhead ratio, events per second, peak memory of the traced run
+and the time taken by ``pretty_format()``. The results can be written as
+JSON and compared with a previous set of results, such as the checked in
+``benchmarks/baseline.json``, any workload whose overhead ratio has grown by
+more than the threshold is reported as a regression. Usage::
+
+    python benchmarks/bench_overhead.py
+    python benchmarks/bench_overhead.py --output results.json
+    python benchmarks/bench_overhead.py --compare benchmarks/baseline.json --threshold 1.5
+
+With ``--compare`` the exit code is 1 if there are any regressions.
+
+Overhead ratios are used for comparison rather than times as they are less
+dependent on the machine.
+
+Created on 19 Oct 2026
+
+@author: paulross
+"""
+import argparse
+import collections
+import json
+import logging
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+
+from typin import type_inferencer
+
+RESULTS_VERSION = 1
+#: Default factor by which an overhead ratio may grow before it is regarded
+#: as a regression.
+DEFAULT_THRESHOLD = 1.5
+
+#---- Workloads ----
+def fibonacci(n):
+    if n < 2:
+        return n
+    return fibonacci(n - 1) + fibonacci(n - 2)
+
+def workload_recursion(size):
+    return fibonacci(size)
+
+class Shape:
+    def __init__(self, name):
+        self.name = name
+
+    def area(self):
+        raise NotImplementedError()
+
+    def describe(self):
+        return '{:s}: {:.3f}'.format(self.name, self.area())
+
+class Rectangle(Shape):
+    def __init__(self, width, height):
+        super().__init__('rectangle')
+        self.width = width
+        self.height = height
+
+    def area(self):
+        return self.width * self.height
+
+class Square(Rectangle):
+    def __init__(self, side):
+        super().__init__(side, side)
+
+class Circle(Shape):
+    def __init__(self, radius):
+        super().__init__('circle')
+        self.radius = radius
+
+    def area(self):
+        return 3.14159 * self.radius * self.radius
+
+def workload_methods(size):
+    shapes = []
+    for i in range(size):
+        shapes.append(Rectangle(i, i + 1))
+        shapes.append(Square(i))
+        shapes.append(Circle(i * 0.5))
+    return [s.describe() for s in shapes]
+
+def check_positive(value):
+    if value < 0:
+        raise ValueError('Negative: {!r:s}'.format(value))
+    return value
+
+def propagate(value):
+    return check_positive(value) * 2
+
+def workload_exceptions(size):
+    caught = 0
+    for i in range(size):
+        try:
+            propagate(i if i % 2 else -i)
+        except ValueError:
+            caught += 1
+    return caught
+
+def count_up(n):
+    for i in range(n):
+        yield i
+
+def squares(iterable):
+    for value in iterable:
+        yield value * value
+
+def workload_generators(size):
+    return sum(squares(count_up(size)))
+
+def total_of_list(values):
+    return sum(values)
+
+def keys_of_dict(mapping):
+    return len(mapping)
+
+def workload_containers(size):
+    values = list(range(size))
+    mapping = {str(i) : i for i in range(size)}
+    total = 0
+    for _i in range(10):
+        total += total_of_list(values)
+        total += keys_of_dict(mapping)
+    return total
+
+#: dict of {name : (function, size), ...} in reporting order.
+WORKLOADS = collections.OrderedDict((
+    ('recursion', (workload_recursion, 16)),
+    ('methods', (workload_methods, 300)),
+    ('exceptions', (workload_exceptions, 1000)),
+    ('generators', (workload_generators, 3000)),
+    ('containers', (workload_containers, 20000)),
+))
+#---- END: Workloads ----
+
+def run_bare(function, size, repeat):
+    """Returns the best wall clock time of running the workload. Untraced
+    workloads are quick so each time is the average of enough runs to take
+    at least 0.2 seconds."""
+    timer = timeit.Timer(lambda: function(size))
+    number, _elapsed = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+def run_traced(function, size, repeat):
+    """Returns (best time, TypeInferencer) of running the workload under typin."""
+    best = None
+    for _i in range(repeat):
+        start = time.perf_counter()
+        with type_inferencer.TypeInferencer() as ti:
+            function(size)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, ti
+
+def peak_memory(function, size):
+    """Returns the peak memory in bytes allocated while tracing the workload.
+    This is a separate run as tracemalloc slows down execution."""
+    tracemalloc.start()
+    try:
+        with type_inferencer.TypeInferencer():
+            function(size)
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+def run_workload(name, repeat):
+    """Runs one workload and returns a dict of its results."""
+    function, size = WORKLOADS[name]
+    bare = run_bare(function, size, repeat)
+    traced, ti = run_traced(function, size, repeat)
+    start = time.perf_counter()
+    ti.pretty_format()
+    pretty_format_time = time.perf_counter() - start
+    return {
+        'size' : size,
+        'bare_s' : bare,
+        'traced_s' : traced,
+        'ratio' : traced / bare,
+        'events' : ti.eventno,
+        'events_per_s' : ti.eventno / traced,
+        'peak_memory_bytes' : peak_memory(function, size),
+        'pretty_format_s' : pretty_format_time,
+    }
+
+def run(names, repeat):
+    """Returns the results of running the named workloads."""
+    return {
+        'version' : RESULTS_VERSION,
+        'python' : platform.python_version(),
+        'workloads' : collections.OrderedDict(
+            (name, run_workload(name, repeat)) for name in names
+        ),
+    }
+
+def compare(baseline, results, threshold=DEFAULT_THRESHOLD):
+    """Returns a list of (name, baseline_ratio, ratio) for each workload where
+    the overhead ratio has grown by more than threshold times the baseline.
+    Workloads not in both are ignored."""
+    regressions = []
+    for name, result in results['workloads'].items():
+        if name in baseline['workloads']:
+            baseline_ratio = baseline['workloads'][name]['ratio']
+            if result['ratio'] > baseline_ratio * threshold:
+                regressions.append((name, baseline_ratio, result['ratio']))
+    return regressions
+
+def write_report(results, stream=sys.stdout):
+    """Writes a table of the results."""
+    stream.write('{:<12s} {:>10s} {:>10s} {:>8s} {:>10s} {:>12s} {:>10s} {:>10s}\n'.format(
+        'Workload', 'Bare (s)', 'Traced (s)', 'Ratio', 'Events', 'Events/s',
+        'Peak (kB)', 'Format (s)'))
+    for name, result in results['workloads'].items():
+        stream.write('{:<12s} {:10.4f} {:10.4f} {:8.1f} {:10d} {:12.0f} {:10.0f} {:10.4f}\n'.format(
+            name, result['bare_s'], result['traced_s'], result['ratio'], result['events'],
+            result['events_per_s'], result['peak_memory_bytes'] / 1024,
+            result['pretty_format_s']))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-w', '--workloads', nargs='+', default=list(WORKLOADS),
+                        choices=list(WORKLOADS),
+                        help='Workloads to run. [default: all]')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Take the best time of this many runs. [default: %(default)s]')
+    parser.add_argument('-o', '--output', type=str, default='',
+                        help='Write the results as JSON to this file. [default: %(default)s]')
+    parser.add_argument('-c', '--compare', type=str, default='',
+                        help='Compare the results with JSON results from a previous run.'
+                        ' [default: %(default)s]')
+    parser.add_argument('-t', '--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Report a regression if an overhead ratio exceeds the'
+                        ' compared one by this factor. [default: %(default)s]')
+    args = parser.parse_args()
+    # typin warns about every method whose class it can not find.
+    logging.basicConfig(level=logging.ERROR)
+    results = run(args.workloads, args.repeat)
+    write_report(results)
+    if args.output:
+        with open(args.output, 'w') as stream:
+            json.dump(results, stream, indent=4)
+    if args.compare:
+        with open(args.compare) as stream:
+            baseline = json.load(stream)
+        regressions = compare(baseline, results, args.threshold)
+        for name, baseline_ratio, ratio in regressions:
+            print('REGRESSION: {:s} overhead ratio {:.1f} was {:.1f}'.format(
+                name, ratio, baseline_ratio))
+        if regressions:
+            return 1
+        print('No regressions against {:s}'.format(args.compare))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
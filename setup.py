@@ -38,7 +38,8 @@ setup(
     package_dir={'':'src'},
     entry_points={
         'console_scripts': [
-            'typin_cli=typin.typin_cli:main'
+            'typin_cli=typin.typin_cli:main',
+            'typin_diff=typin.snapshot:main',
         ]
     },
     include_package_data=True,
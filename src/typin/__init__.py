@@ -5,3 +5,5 @@
 __author__ = """Paul Ross"""
 __email__ = 'apaulross@gmail.com'
 __version__ = '0.1.0'
+
+from typin.recording import record, instrument_module, recorder
@@ -0,0 +1,241 @@
+'''
+Writes the types seen when tracing directly into the function signatures of
+the source code as PEP 484 annotations.
+
+Each source file is parsed once and all of its edits are applied in a single
+pass so formatting and comments are preserved. Only missing annotations are
+added, existing ones are never changed. The annotations use PEP 585 generics
+and PEP 604 unions so ``from __future__ import annotations`` is added to
+modules that are annotated.
+
+Types are named by their fully qualified names. The names of the module being
+annotated are made local and any other module named is imported.
+'''
+import ast
+import collections
+import os
+import sys
+
+from typin import function_index
+from typin import source_edits
+from typin import stub_merge
+
+#: text - The annotated source.
+#: added - Number of annotations added.
+#: skipped - Number of functions whose signature no longer matches the source.
+AnnotationResult = collections.namedtuple('AnnotationResult', 'text, added, skipped')
+
+FUTURE_IMPORT = 'from __future__ import annotations\n'
+#: Names of the first argument of methods that are not annotated.
+IMPLICIT_FIRST_ARGUMENTS = frozenset(('self', 'cls'))
+
+class AnnotationWriterException(Exception):
+    """Exception thrown when a source file can not be annotated."""
+    pass
+
+def _parameter_names(node):
+    args = node.args
+    names = [a.arg for a in args.posonlyargs + args.args]
+    if args.vararg is not None:
+        names.append(args.vararg.arg)
+    names.extend(a.arg for a in args.kwonlyargs)
+    if args.kwarg is not None:
+        names.append(args.kwarg.arg)
+    return names
+
+def _has_future_annotations(tree):
+    for node in tree.body:
+        if isinstance(node, ast.ImportFrom) and node.module == '__future__' \
+                and any(alias.name == 'annotations' for alias in node.names):
+            return True
+    return False
+
+def _imports_module(tree, module_name):
+    for node in tree.body:
+        if isinstance(node, ast.Import) and any(alias.name == module_name and alias.asname is None
+                                                for alias in node.names):
+            return True
+    return False
+
+def module_name_of(file_path):
+    """Returns the name of the imported module whose source is file_path,
+    None if there is none."""
+    file_path = os.path.abspath(file_path)
+    for name, module in list(sys.modules.items()):
+        module_file = getattr(module, '__file__', None)
+        if module_file is not None and os.path.abspath(module_file) == file_path:
+            return name
+    return None
+
+def _module_of(dotted_name):
+    """Returns the module of the qualified name of a class, this is the
+    longest prefix that is an imported module otherwise all but the last
+    name."""
+    parts = dotted_name.split('.')
+    for i in range(len(parts) - 1, 0, -1):
+        prefix = '.'.join(parts[:i])
+        if prefix in sys.modules:
+            return prefix
+    return '.'.join(parts[:-1])
+
+def _dotted_name(node):
+    """Returns the dotted name of an ast.Attribute such as ``a.b.C``, None if
+    it is not just names."""
+    names = []
+    while isinstance(node, ast.Attribute):
+        names.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    names.append(node.id)
+    return '.'.join(reversed(names))
+
+def localise_annotation(annotation, module_name):
+    """Returns ``(annotation, modules)`` where the qualified names in the
+    annotation of module_name are made local and modules is the set of the
+    names of the other modules that need to be imported. For example, with
+    module_name ``'pkg.m'``, ``'pkg.m.Foo | decimal.Decimal'`` becomes
+    ``('Foo | decimal.Decimal', {'decimal'})``."""
+    try:
+        tree = ast.parse(annotation, mode='eval')
+    except SyntaxError:
+        return annotation, set()
+    inner = set()
+    edits = []
+    modules = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Attribute):
+            continue
+        # Only the outermost attribute of a.b.C is the name.
+        inner.add(node.value)
+        if node in inner:
+            continue
+        dotted_name = _dotted_name(node)
+        if dotted_name is None:
+            continue
+        if module_name and dotted_name.startswith(module_name + '.'):
+            edits.append((node.col_offset, node.end_col_offset, dotted_name[len(module_name) + 1:]))
+        else:
+            module = _module_of(dotted_name)
+            if module != 'builtins':
+                modules.add(module)
+    return source_edits.apply_edits(annotation, edits), modules
+
+def _future_import_offset(tree, source, offsets):
+    """Returns the offset where ``from __future__ import annotations`` goes,
+    this is after any module docstring and existing __future__ imports."""
+    lineno = 0
+    for i, node in enumerate(tree.body):
+        if i == 0 and isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) \
+                and isinstance(node.value.value, str):
+            lineno = node.end_lineno
+        elif isinstance(node, ast.ImportFrom) and node.module == '__future__':
+            lineno = node.end_lineno
+        else:
+            break
+    if lineno == 0:
+        # Keep any shebang, encoding declaration or leading comments at the top.
+        while lineno < len(offsets) and offsets.line(lineno + 1).lstrip().startswith('#'):
+            lineno += 1
+    if lineno >= len(offsets):
+        return len(source)
+    return offsets.offset(lineno + 1, 0)
+
+class _SourceAnnotator:
+    """Annotates one source file, this accumulates the edits and counts."""
+    def __init__(self, source, module_name=None):
+        try:
+            self.tree = ast.parse(source)
+        except SyntaxError as err:
+            raise AnnotationWriterException('Can not parse source: {:s}'.format(str(err)))
+        self.source = source
+        self.offsets = source_edits.LineOffsets(source)
+        self.colons = function_index.colon_positions(source)
+        self.edits = []
+        self.added = 0
+        self.skipped = 0
+        self.module_name = module_name
+        # Names of the modules that the annotations need imported.
+        self.modules = set()
+        # dict of {line_number : ast.FunctionDef, ...} by the first decorator
+        # and by the def line as the traced line number can be either.
+        self.functions = {}
+        for node in ast.walk(self.tree):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                self.functions[node.lineno] = node
+                if node.decorator_list:
+                    self.functions[node.decorator_list[0].lineno] = node
+
+    def _annotate_function(self, node, fts):
+        names = _parameter_names(node)
+        if fts.signature is not None and list(fts.signature.parameters) != names:
+            # The source has changed since it was traced.
+            self.skipped += 1
+            return
+        args = node.args.posonlyargs + node.args.args + node.args.kwonlyargs
+        for i, arg in enumerate(args):
+            if arg.annotation is not None or arg.arg not in fts.arguments:
+                continue
+            if i == 0 and arg.arg in IMPLICIT_FIRST_ARGUMENTS:
+                continue
+            self.edits.append(stub_merge.argument_annotation_edit(
+                self.source, self.offsets, arg, self._localise(fts.annotation_str(fts.arguments[arg.arg]))
+            ))
+            self.added += 1
+        if node.returns is None and not fts.return_unknown:
+            # An unknown return type is left unannotated.
+            self.edits.append(stub_merge.return_annotation_edit(
+                self.source, self.offsets, self.colons, node, self._localise(fts.return_annotation_str())
+            ))
+            self.added += 1
+
+    def _localise(self, annotation):
+        annotation, modules = localise_annotation(annotation, self.module_name)
+        self.modules |= modules
+        return annotation
+
+    def annotate(self, file_map):
+        for namespace in file_map:
+            for fts in file_map[namespace].values():
+                if fts.num_entry_points == 0:
+                    continue
+                node = self.functions.get(fts.line_decl)
+                if node is not None:
+                    self._annotate_function(node, fts)
+        if self.added:
+            imports = []
+            if not _has_future_annotations(self.tree):
+                imports.append(FUTURE_IMPORT)
+            for module in sorted(self.modules):
+                if module != self.module_name and not _imports_module(self.tree, module):
+                    imports.append('import {:s}\n'.format(module))
+            if imports:
+                offset = _future_import_offset(self.tree, self.source, self.offsets)
+                if offset and self.source[offset - 1] != '\n':
+                    imports.insert(0, '\n')
+                self.edits.append((offset, offset, ''.join(imports)))
+        return AnnotationResult(
+            source_edits.apply_edits(self.source, self.edits), self.added, self.skipped
+        )
+
+def annotate_source(source, file_map, module_name=None):
+    """Adds the observed types as annotations to the source code.
+
+    :param source: The source code that was traced.
+    :type source: ``str``
+
+    :param file_map: The types observed for the source file, this is a value
+        of ``TypeInferencer.function_map`` i.e.
+        ``{ namespace : { function_name : FunctionTypes, ...}, ...}``
+    :type file_map: ``dict``
+
+    :param module_name: The name of the module of the source, see
+        module_name_of(). The qualified names of its classes are made local.
+    :type module_name: ``str, NoneType``
+
+    :return: The annotated source and the number of annotations added.
+    :rtype: ``AnnotationResult``
+
+    :raises: ``AnnotationWriterException`` If the source can not be parsed.
+    """
+    return _SourceAnnotator(source, module_name).annotate(file_map)
@@ -0,0 +1,244 @@
+'''
+Deferred type decomposition. Creating a ``types.Type`` examines every element
+of a container and that can add a lot of latency to each traced call. With a
+DeferredRecorder the trace function only takes a cheap shallow snapshot of
+each value, see ``types.shallow_snapshot()``, and puts that in a ring buffer.
+A background thread takes the snapshots from the ring buffer, creates the
+interned ``types.Type`` objects and updates the ``types.FunctionTypes``.
+
+If the ring buffer is full observations are dropped, and counted, rather than
+blocking the traced code. Calls, yields and resumptions are dropped when the
+buffer is half full so that there is room for the returns of the calls
+already recorded. If a return or exception still has to be dropped the
+background thread is told so that it is not paired with another call and the
+return type of the function is shown as unknown rather than None.
+
+The trace function is the only producer and the background thread is the
+only consumer so the ring buffer needs no lock. This relies on the GIL: the
+work is moved off the traced call, it does not run in parallel with it.
+
+This is used by ``TypeInferencer(deferred=True)``.
+'''
+import collections
+import logging
+import threading
+
+from typin import types
+
+class RingBuffer:
+    """A fixed size, single producer, single consumer, FIFO queue.
+    The producer calls put() and the consumer calls get(). Neither blocks.
+
+    head and tail only ever increase, the slot is the index modulo capacity.
+    Only the producer writes tail and only the consumer writes head and
+    each writes the slot before moving its index."""
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError('Capacity must be positive not {:d}'.format(capacity))
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        # Index of the next item to get.
+        self.head = 0
+        # Index of the next item to put.
+        self.tail = 0
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def put(self, item):
+        """Adds an item, which must not be None, and returns True.
+        Returns False if the buffer is full."""
+        tail = self.tail
+        if tail - self.head >= self.capacity:
+            return False
+        self._slots[tail % self.capacity] = item
+        self.tail = tail + 1
+        return True
+
+    def get(self):
+        """Removes and returns the oldest item, None if the buffer is empty."""
+        head = self.head
+        if head == self.tail:
+            return None
+        index = head % self.capacity
+        item = self._slots[index]
+        self._slots[index] = None
+        self.head = head + 1
+        return item
+
+class DeferredRecorder:
+    """Records observations of values into ``types.FunctionTypes`` objects on
+    a background thread. The submit_...() methods are called by the trace
+    function and return False if the observation was dropped."""
+    DEFAULT_CAPACITY = 1 << 16
+    # Seconds that the background thread waits when the buffer is empty.
+    POLL_INTERVAL = 0.001
+    # Observation kinds, the first element of each item in the buffer.
+    OBSERVE_CALL = 0
+    OBSERVE_RETURN = 1
+    OBSERVE_EXCEPTION = 2
+    OBSERVE_YIELD = 3
+    OBSERVE_RESUME = 4
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, sample_size=types.SNAPSHOT_SAMPLE_SIZE,
+                 depth=types.SNAPSHOT_DEPTH):
+        """Constructor.
+
+        :param capacity: The number of observations in the ring buffer.
+        :type capacity: ``int``
+
+        :param sample_size: The maximum number of elements of each container
+            that are examined, see ``types.shallow_snapshot()``.
+        :type sample_size: ``int``
+
+        :param depth: The maximum depth of nested containers that are examined.
+        :type depth: ``int``
+        """
+        self.buffer = RingBuffer(capacity)
+        self.sample_size = sample_size
+        self.depth = depth
+        # Calls, yields and resumptions are dropped once the buffer has this
+        # many observations.
+        self._call_high_water = max(1, capacity // 2)
+        # Returns and exceptions that have been dropped, the background
+        # thread calls drop_return() on each once it has processed the
+        # observations that were in the buffer beforehand.
+        # deque of (buffer.tail, types.FunctionTypes), ...
+        self._dropped_returns = collections.deque()
+        # Number of observations dropped and processed.
+        self.dropped = 0
+        self.processed = 0
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def _snapshot(self, value):
+        return types.shallow_snapshot(value, self.sample_size, self.depth)
+
+    def _put(self, item):
+        if self.buffer.put(item):
+            return True
+        self.dropped += 1
+        return False
+
+    #---- Producer, called by the trace function. ----
+    def _above_high_water(self):
+        """Returns True, counting the observation as dropped, if the buffer
+        has no room for anything but returns and exceptions."""
+        if len(self.buffer) >= self._call_high_water:
+            self.dropped += 1
+            return True
+        return False
+
+    def submit_call(self, func_types, arg_names, arg_values, file_path, line_number):
+        """Submits a call with the argument names and their values."""
+        if self._above_high_water():
+            return False
+        return self._put((self.OBSERVE_CALL, func_types, arg_names,
+                          tuple(self._snapshot(v) for v in arg_values), file_path, line_number))
+
+    def submit_return(self, func_types, return_value, line_number):
+        """Submits a return value."""
+        if self._put((self.OBSERVE_RETURN, func_types, self._snapshot(return_value), line_number)):
+            return True
+        self._dropped_returns.append((self.buffer.tail, func_types))
+        return False
+
+    def submit_exception(self, func_types, exception, line_number):
+        """Submits an exception raised or propagated by the function."""
+        if self._put((self.OBSERVE_EXCEPTION, func_types, self._snapshot(exception), line_number)):
+            return True
+        self._dropped_returns.append((self.buffer.tail, func_types))
+        return False
+
+    def submit_yield(self, func_types, yield_value, line_number):
+        """Submits a value yielded by a generator. Values that are not
+        sampled by ``FunctionTypes.sample_yield()`` just record the line."""
+        if self._above_high_water():
+            return False
+        if func_types.sample_yield(type(yield_value)):
+            return self._put((self.OBSERVE_YIELD, func_types, self._snapshot(yield_value), line_number))
+        return self.submit_resume(func_types, line_number)
+
+    def submit_resume(self, func_types, line_number):
+        """Submits the resumption of a generator or coroutine."""
+        if self._above_high_water():
+            return False
+        return self._put((self.OBSERVE_RESUME, func_types, None, line_number))
+
+    def drop(self):
+        """Counts an observation that the caller has dropped, for example the
+        return from a call that was dropped."""
+        self.dropped += 1
+    #---- END: Producer. ----
+
+    #---- Consumer, the background thread. ----
+    def _skip_dropped_returns(self, position):
+        """Calls drop_return() for the dropped returns that were submitted
+        before the observation at position in the buffer."""
+        dropped_returns = self._dropped_returns
+        while len(dropped_returns) and dropped_returns[0][0] <= position:
+            dropped_returns.popleft()[1].drop_return()
+
+    def _process(self, item):
+        kind, func_types = item[0], item[1]
+        if kind == self.OBSERVE_CALL:
+            _kind, _func_types, arg_names, snaps, file_path, line_number = item
+            fingerprint = tuple(snap[0] for snap in snaps) if func_types.settled else None
+            func_types.add_call_types(arg_names, [types.Type.from_snapshot(s) for s in snaps],
+                                      file_path, line_number, fingerprint)
+        elif kind == self.OBSERVE_RETURN:
+            func_types.add_return_type(types.Type.from_snapshot(item[2]), item[3], item[2][0])
+        elif kind == self.OBSERVE_EXCEPTION:
+            func_types.add_exception_type(types.Type.from_snapshot(item[2]), item[3])
+        elif kind == self.OBSERVE_YIELD:
+            func_types.add_resume(item[3])
+            func_types.add_yield_type(types.Type.from_snapshot(item[2]), item[3])
+        else:
+            assert kind == self.OBSERVE_RESUME
+            func_types.add_resume(item[3])
+
+    def drain(self):
+        """Processes every observation in the buffer, returns the number
+        processed. This is called by the background thread."""
+        count = 0
+        buffer = self.buffer
+        while True:
+            position = buffer.head
+            item = buffer.get()
+            self._skip_dropped_returns(position)
+            if item is None:
+                break
+            try:
+                self._process(item)
+            except Exception as err:
+                logging.error('DeferredRecorder: could not process {!r:s}: {!r:s}'.format(item, err))
+            count += 1
+        self.processed += count
+        return count
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            if not self.drain():
+                self._stop_event.wait(self.POLL_INTERVAL)
+        self.drain()
+    #---- END: Consumer. ----
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        """Starts the background thread, this does nothing if it is running."""
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='typin-deferred', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops the background thread once it has processed every
+        observation in the buffer."""
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        self.drain()
@@ -0,0 +1,395 @@
+'''
+An event log for recording first and analysing later. With
+``TypeInferencer(event_log=...)`` the trace function does nothing but append a
+fixed size binary record for each event to a memory mapped file. After tracing
+``TypeInferencer.process_event_log()`` scans the log, in parallel by chunk,
+and rebuilds the function types, the base classes and the decisions whether
+each exception was caught or propagated.
+
+Each record is RECORD_FORMAT::
+
+    kind, code_id, line, fingerprint_id, activation_id
+
+* kind - One of the KIND_... constants.
+* code_id - Index into ``EventLog.codes``, a CodeEntry for each code object.
+* line - The line number of the event.
+* fingerprint_id - Index into ``EventLog.fingerprints``. For a call this is a
+  tuple of the shallow snapshots of the arguments, for a return, yield or
+  exception this is the shallow snapshot of the value, see
+  ``types.shallow_snapshot()``. 0 for none.
+* activation_id - A number unique to each activation of a frame, from its
+  first event to its final return, used to pair calls with returns and
+  exceptions with the events that follow. Unlike ``id()`` of the frame this
+  is never reused so records either side of a chunk boundary are not paired
+  with those of an unrelated frame.
+
+The tables of codes and fingerprints contain Python objects, such as classes,
+so they are held in memory by the EventLog. The log must be processed by the
+process that recorded it, the scan of the records is done by worker processes
+that only need the file.
+
+Only 'line' events that follow an exception in the same frame are logged,
+these decide whether the exception was caught.
+'''
+import collections
+import logging
+import mmap
+import multiprocessing
+import os
+import struct
+
+from typin import types
+
+#: Each record is: kind, code_id, line, fingerprint_id, activation_id
+RECORD_FORMAT = '<BxxxIIIQ'
+RECORD = struct.Struct(RECORD_FORMAT)
+
+KIND_CALL = 1
+KIND_RESUME = 2
+KIND_RETURN = 3
+KIND_YIELD = 4
+KIND_EXCEPTION = 5
+KIND_LINE = 6
+
+NO_FINGERPRINT = 0
+#: Records are scanned in chunks of at least this many.
+MIN_CHUNK_RECORDS = 4096
+
+#: Everything the post-processor needs to know about a code object.
+CodeEntry = collections.namedtuple(
+    'CodeEntry', 'file_path qualified_name bases signature generator_kind arg_names first_line'
+)
+
+class EventLog:
+    """A file of fixed size event records that is memory mapped while it is
+    written. The file grows by doubling as needed."""
+    # Initial capacity in records.
+    DEFAULT_CAPACITY = 1 << 16
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY, sample_size=types.SNAPSHOT_SAMPLE_SIZE,
+                 depth=types.SNAPSHOT_DEPTH):
+        """Constructor, this creates, or truncates, the file.
+
+        :param path: The path to the log file.
+        :type path: ``str``
+
+        :param capacity: The initial number of records in the file.
+        :type capacity: ``int``
+
+        :param sample_size: The maximum number of elements of each container
+            that are examined, see ``types.shallow_snapshot()``.
+        :type sample_size: ``int``
+
+        :param depth: The maximum depth of nested containers that are examined.
+        :type depth: ``int``
+        """
+        self.path = path
+        self.sample_size = sample_size
+        self.depth = depth
+        # Number of records written.
+        self.count = 0
+        # list of CodeEntry, the index is the code_id.
+        self.codes = []
+        # list of fingerprints, the index is the fingerprint_id, 0 is none.
+        self.fingerprints = [None]
+        # dict of {fingerprint : fingerprint_id, ...}
+        self._fingerprint_ids = {}
+        self._file = open(path, 'w+b')
+        self._file.truncate(max(1, capacity) * RECORD.size)
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    def _grow(self):
+        size = len(self._mmap) * 2
+        self._mmap.close()
+        self._file.truncate(size)
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+
+    def append(self, kind, code_id, line, fingerprint_id, activation_id):
+        """Appends a record."""
+        offset = self.count * RECORD.size
+        if offset + RECORD.size > len(self._mmap):
+            self._grow()
+        RECORD.pack_into(self._mmap, offset, kind, code_id, line, fingerprint_id, activation_id)
+        self.count += 1
+
+    def add_code(self, code_entry):
+        """Adds a CodeEntry and returns its code_id."""
+        self.codes.append(code_entry)
+        return len(self.codes) - 1
+
+    def snapshot(self, value):
+        """Returns the shallow snapshot of a value."""
+        return types.shallow_snapshot(value, self.sample_size, self.depth)
+
+    def fingerprint_id(self, fingerprint):
+        """Returns the fingerprint_id of the fingerprint, added if necessary."""
+        try:
+            return self._fingerprint_ids[fingerprint]
+        except KeyError:
+            pass
+        self.fingerprints.append(fingerprint)
+        fingerprint_id = self._fingerprint_ids[fingerprint] = len(self.fingerprints) - 1
+        return fingerprint_id
+
+    def flush(self):
+        if self._mmap is not None:
+            self._mmap.flush()
+
+    def close(self):
+        """Closes the file, truncated to the records written. The tables are
+        kept for process()."""
+        if self._file is not None:
+            self._mmap.flush()
+            self._mmap.close()
+            self._mmap = None
+            self._file.truncate(self.count * RECORD.size)
+            self._file.close()
+            self._file = None
+
+    def records(self, start=0, stop=None):
+        """Yields the records from start to stop as tuples, see RECORD_FORMAT."""
+        self.flush()
+        if stop is None:
+            stop = self.count
+        with open(self.path, 'rb') as stream:
+            stream.seek(start * RECORD.size)
+            data = stream.read((stop - start) * RECORD.size)
+        yield from RECORD.iter_unpack(data)
+
+    def chunks(self, jobs):
+        """Returns a list of (start, stop) record ranges for jobs processes."""
+        size = max(MIN_CHUNK_RECORDS, -(-self.count // max(jobs, 1)))
+        return [(start, min(start + size, self.count)) for start in range(0, self.count, size)]
+
+    def process(self, ti, jobs=None):
+        """Scans the log and records the types it finds into the
+        TypeInferencer ti. The scan is done in a pool of jobs processes
+        where fork is available, otherwise in this process.
+
+        :param ti: The TypeInferencer to record into.
+        :type ti: ``typin.type_inferencer.TypeInferencer``
+
+        :param jobs: Number of worker processes, None for the number of CPUs.
+        :type jobs: ``int, NoneType``
+
+        :return: ``int`` -- The number of records scanned.
+        """
+        self.flush()
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        generator_codes = frozenset(
+            code_id for code_id, entry in enumerate(self.codes) if entry.generator_kind is not None
+        )
+        exit_fingerprints = frozenset(
+            i for i, fp in enumerate(self.fingerprints) if fp and fp[0] is GeneratorExit
+        )
+        ignored_fingerprints = frozenset(
+            i for i, fp in enumerate(self.fingerprints) if fp and fp[0] is StopIteration
+        )
+        tasks = [
+            (self.path, start, stop, ti.asyncio_aware, generator_codes,
+             exit_fingerprints, ignored_fingerprints)
+            for start, stop in self.chunks(jobs)
+        ]
+        jobs = max(min(jobs, len(tasks)), 1)
+        if jobs > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            with multiprocessing.get_context('fork').Pool(jobs) as pool:
+                results = pool.map(scan_chunk, tasks)
+        else:
+            results = [scan_chunk(task) for task in tasks]
+        self._record(ti, merge_chunks(results))
+        return self.count
+
+    def _types_of(self, fingerprint_id):
+        return [types.Type.from_snapshot(s) for s in self.fingerprints[fingerprint_id]]
+
+    def _record(self, ti, merged):
+        """Records the merged results of scan_chunk() into ti."""
+        func_types = {}
+        for code_id, entry in enumerate(self.codes):
+            ti._set_bases(entry.file_path, entry.first_line, entry.qualified_name, entry.bases)
+            func_types[code_id] = ti._get_func_data(entry.file_path, entry.qualified_name,
+                                                    entry.signature, entry.generator_kind)
+        # Calls first in the order first seen so the entry points are in order.
+        for (code_id, fingerprint_id, line), _value in _in_order(merged[KIND_CALL]):
+            func_types[code_id].add_call_types(self.codes[code_id].arg_names,
+                                               self._types_of(fingerprint_id),
+                                               self.codes[code_id].file_path, line)
+        for fts in func_types.values():
+            # Returns are paired with calls by merge_chunks().
+            fts.clear_call_stack()
+        for (code_id, line), _value in _in_order(merged[KIND_RESUME]):
+            func_types[code_id].add_resume(line)
+        for (code_id, fingerprint_id, line), _value in _in_order(merged[KIND_YIELD]):
+            func_types[code_id].add_resume(line)
+            func_types[code_id].add_yield_type(
+                types.Type.from_snapshot(self.fingerprints[fingerprint_id]), line
+            )
+        # Returns before exceptions as returns are never phantoms here.
+        for (code_id, fingerprint_id, line), _value in _in_order(merged[KIND_RETURN]):
+            snap = self.fingerprints[fingerprint_id]
+            func_types[code_id].add_return_type(types.Type.from_snapshot(snap), line, snap[0])
+        for (code_id, fingerprint_id, line), _value in _in_order(merged[KIND_EXCEPTION]):
+            func_types[code_id].add_exception_type(
+                types.Type.from_snapshot(self.fingerprints[fingerprint_id]), line
+            )
+        for (code_id, call_id, kind, result_id), count in merged['rows'].items():
+            func_types[code_id].add_call_return_row(
+                self._types_of(call_id), kind,
+                types.Type.from_snapshot(self.fingerprints[result_id]), count
+            )
+
+def _in_order(observations):
+    """Sorts a dict of {key : [first_index, count], ...} by first_index."""
+    return sorted(observations.items(), key=lambda item: item[1][0])
+
+def _observe(observations, key, index):
+    try:
+        observations[key][1] += 1
+    except KeyError:
+        observations[key] = [index, 1]
+
+def _previous_exception(data, index, activation_id, asyncio_aware, exit_fingerprints,
+                        ignored_fingerprints):
+    """Looks back from the record at index for an exception in flight in the
+    activation activation_id of a frame. This is for frames whose earlier records are in a
+    previous chunk. Returns the exception record or None, a GeneratorExit
+    is in flight whatever follows it."""
+    lines = []
+    offset = index * RECORD.size
+    while offset > 0:
+        offset -= RECORD.size
+        kind, _code_id, line, _fingerprint_id, record_activation_id = RECORD.unpack_from(data, offset)
+        if record_activation_id != activation_id:
+            continue
+        if kind == KIND_LINE:
+            lines.append(line)
+            continue
+        if kind == KIND_EXCEPTION:
+            record = RECORD.unpack_from(data, offset)
+            if record[3] in exit_fingerprints:
+                return record
+            if record[3] not in ignored_fingerprints \
+                    and (not lines or (asyncio_aware and max(lines) <= line)):
+                return record
+        return None
+    return None
+
+def scan_chunk(task):
+    """Scans the records start to stop of the log file. This is a pool entry
+    point so task is a tuple::
+
+        (path, start, stop, asyncio_aware, generator_codes,
+         exit_fingerprints, ignored_fingerprints)
+
+    Where generator_codes is the set of code_ids of generators and coroutines,
+    exit_fingerprints and ignored_fingerprints are the fingerprint_ids of
+    GeneratorExit and StopIteration.
+
+    Returns a dict of the observations, see merge_chunks(). Returns and
+    exceptions are paired with the calls in this chunk, those that are not
+    are given in order as 'orphans' and calls without a return as 'open_calls'.
+    """
+    path, start, stop, asyncio_aware, generator_codes, exit_fingerprints, ignored_fingerprints = task
+    result = {
+        KIND_CALL : {}, KIND_RESUME : {}, KIND_RETURN : {}, KIND_YIELD : {}, KIND_EXCEPTION : {},
+        'rows' : collections.Counter(),
+        'open_calls' : {},
+        'orphans' : [],
+    }
+    if stop <= start:
+        return result
+    calls = result[KIND_CALL]
+    open_calls = result['open_calls']
+    rows = result['rows']
+    # dict of {activation_id : exception record, ...} for exceptions in flight.
+    in_flight = {}
+    # Frames closed with GeneratorExit.
+    exiting = set()
+    # Frames that have a record, other than a line, in this chunk.
+    seen = set()
+    with open(path, 'rb') as stream:
+        with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            index = start
+            for record in RECORD.iter_unpack(data[start * RECORD.size:stop * RECORD.size]):
+                kind, code_id, line, fingerprint_id, activation_id = record
+                if kind == KIND_CALL:
+                    _observe(calls, (code_id, fingerprint_id, line), index)
+                    if code_id not in generator_codes:
+                        open_calls[activation_id] = fingerprint_id
+                elif kind == KIND_RESUME:
+                    _observe(result[KIND_RESUME], (code_id, line), index)
+                elif kind == KIND_YIELD:
+                    _observe(result[KIND_YIELD], (code_id, fingerprint_id, line), index)
+                elif kind == KIND_EXCEPTION:
+                    if fingerprint_id in exit_fingerprints:
+                        exiting.add(activation_id)
+                    elif fingerprint_id not in ignored_fingerprints:
+                        in_flight[activation_id] = record
+                elif kind == KIND_LINE:
+                    exception = in_flight.get(activation_id)
+                    if exception is not None and (not asyncio_aware or line > exception[2]):
+                        # Caught.
+                        del in_flight[activation_id]
+                    index += 1
+                    continue
+                else:
+                    assert kind == KIND_RETURN
+                    if activation_id in exiting:
+                        exiting.discard(activation_id)
+                        exception = None
+                        kind = None
+                    elif activation_id in seen:
+                        exception = in_flight.pop(activation_id, None)
+                    else:
+                        exception = _previous_exception(data, index, activation_id, asyncio_aware,
+                                                        exit_fingerprints, ignored_fingerprints)
+                        if exception is not None and exception[3] in exit_fingerprints:
+                            exception = None
+                            kind = None
+                    if exception is not None:
+                        kind = types.FunctionTypes.CALL_RETURN_KIND_EXCEPTION
+                        _observe(result[KIND_EXCEPTION], (code_id, exception[3], exception[2]), index)
+                        fingerprint_id = exception[3]
+                    elif kind is not None:
+                        kind = types.FunctionTypes.CALL_RETURN_KIND_RETURN
+                        _observe(result[KIND_RETURN], (code_id, fingerprint_id, line), index)
+                    if kind is not None and code_id not in generator_codes:
+                        if activation_id in open_calls:
+                            rows[(code_id, open_calls.pop(activation_id), kind, fingerprint_id)] += 1
+                        else:
+                            result['orphans'].append((activation_id, code_id, kind, fingerprint_id))
+                seen.add(activation_id)
+                index += 1
+    return result
+
+def merge_chunks(results):
+    """Merges the results of scan_chunk() in chunk order. Returns and
+    exceptions that are orphans in one chunk are paired with calls still
+    open from earlier chunks."""
+    merged = {
+        KIND_CALL : {}, KIND_RESUME : {}, KIND_RETURN : {}, KIND_YIELD : {}, KIND_EXCEPTION : {},
+        'rows' : collections.Counter(),
+    }
+    open_calls = {}
+    for result in results:
+        for key in (KIND_CALL, KIND_RESUME, KIND_RETURN, KIND_YIELD, KIND_EXCEPTION):
+            observations = merged[key]
+            for k, (first, count) in result[key].items():
+                if k in observations:
+                    observations[k][1] += count
+                else:
+                    observations[k] = [first, count]
+        merged['rows'].update(result['rows'])
+        for activation_id, code_id, kind, fingerprint_id in result['orphans']:
+            call_id = open_calls.pop(activation_id, None)
+            if call_id is not None:
+                merged['rows'][(code_id, call_id, kind, fingerprint_id)] += 1
+            else:
+                logging.debug('event_log: return without a call in code {:d}'.format(code_id))
+        open_calls.update(result['open_calls'])
+    return merged
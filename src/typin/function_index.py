@@ -0,0 +1,163 @@
+'''
+An index of the functions and classes in a source file built once from the
+AST so that the line numbers seen when tracing can be related to the source.
+
+This is used for finding where to insert docstrings, unlike scanning the
+source lines with regular expressions it copes with decorators, annotations,
+defaults that contain ``'):'`` and ``async def``.
+'''
+import ast
+import bisect
+import collections
+import io
+import logging
+import os
+import tokenize
+
+#: Location of a function in the source, all line numbers start at 1.
+#: start_lineno - The first line of the declaration including decorators.
+#: def_lineno - The line of the ``def`` or ``async def``.
+#: colon_lineno - The line with the colon that ends the signature, a docstring
+#: is inserted after this. This is 0 if the body is on the same line.
+#: has_docstring - True if the function already has a docstring.
+#: indent - The indentation of the body as a string.
+#: end_lineno - The last line of the function.
+FunctionLocation = collections.namedtuple(
+    'FunctionLocation',
+    'name, start_lineno, def_lineno, colon_lineno, has_docstring, indent, end_lineno',
+)
+
+OPEN_BRACKETS = frozenset('([{')
+CLOSE_BRACKETS = frozenset(')]}')
+
+def colon_positions(source):
+    """Returns a sorted list of the (line, column) of every colon token that
+    is not within brackets. The first of these after a ``def`` ends its
+    signature. Columns are character offsets."""
+    result = []
+    depth = 0
+    for token in tokenize.generate_tokens(io.StringIO(source).readline):
+        if token.type == tokenize.OP:
+            if token.string in OPEN_BRACKETS:
+                depth += 1
+            elif token.string in CLOSE_BRACKETS:
+                depth -= 1
+            elif token.string == ':' and depth == 0:
+                result.append(token.start)
+    return result
+
+class FunctionIndex:
+    """An index of functions and classes in Python source. Lookups by line
+    number take O(log n) time."""
+    FUNCTION_NODES = (ast.FunctionDef, ast.AsyncFunctionDef)
+
+    def __init__(self, source):
+        """Constructor with the source code as a string.
+
+        :raises: ``SyntaxError`` If the source can not be parsed.
+        """
+        src_lines = source.splitlines(True)
+        tree = ast.parse(source)
+        colons = colon_positions(source)
+        functions = []
+        # Sorted list of line numbers of class declarations.
+        self._class_linenos = []
+        for node in ast.walk(tree):
+            if isinstance(node, self.FUNCTION_NODES):
+                functions.append(self._location(node, src_lines, colons))
+            elif isinstance(node, ast.ClassDef):
+                self._class_linenos.append(self._start_lineno(node))
+                self._class_linenos.append(node.lineno)
+        self._class_linenos.sort()
+        # Two sorted lists of (lineno, FunctionLocation) so a lookup can be
+        # made by the decorator or the def line.
+        self._by_start = sorted((f.start_lineno, f) for f in functions)
+        self._by_def = sorted((f.def_lineno, f) for f in functions)
+        self._start_keys = [k for k, _f in self._by_start]
+        self._def_keys = [k for k, _f in self._by_def]
+
+    @classmethod
+    def from_lines(cls, src_lines):
+        """Returns an index from a list of source lines, these may or may not
+        have line endings."""
+        return cls(''.join(
+            aline if aline.endswith('\n') else aline + '\n' for aline in src_lines
+        ))
+
+    def __len__(self):
+        return len(self._by_start)
+
+    @staticmethod
+    def _start_lineno(node):
+        if node.decorator_list:
+            return min(node.lineno, node.decorator_list[0].lineno)
+        return node.lineno
+
+    def _location(self, node, src_lines, colons):
+        index = bisect.bisect_left(colons, (node.lineno, node.col_offset))
+        colon_lineno = colons[index][0]
+        body_lineno = node.body[0].lineno
+        if body_lineno == colon_lineno:
+            # def f(): pass
+            colon_lineno = 0
+            indent = ''
+        else:
+            body_line = src_lines[body_lineno - 1]
+            indent = body_line[:len(body_line) - len(body_line.lstrip())]
+        return FunctionLocation(
+            node.name,
+            self._start_lineno(node),
+            node.lineno,
+            colon_lineno,
+            ast.get_docstring(node, clean=False) is not None,
+            indent,
+            node.end_lineno,
+        )
+
+    @staticmethod
+    def _find(keys, values, lineno):
+        index = bisect.bisect_left(keys, lineno)
+        if index < len(keys) and keys[index] == lineno:
+            return values[index][1]
+        return None
+
+    def function_at(self, lineno):
+        """Returns the FunctionLocation for a function whose declaration starts
+        on lineno, either the first decorator or the ``def``. Returns None if
+        there is no function there."""
+        location = self._find(self._start_keys, self._by_start, lineno)
+        if location is None:
+            location = self._find(self._def_keys, self._by_def, lineno)
+        return location
+
+    def is_class(self, lineno):
+        """Returns True if lineno is the declaration of a class."""
+        index = bisect.bisect_left(self._class_linenos, lineno)
+        return index < len(self._class_linenos) and self._class_linenos[index] == lineno
+
+# dict of {file_path : (mtime_ns, size, FunctionIndex or None), ...}
+_FUNCTION_INDEX_CACHE = {}
+
+def function_index(file_path):
+    """Returns the FunctionIndex for the file, this is cached and only rebuilt
+    when the modification time or size of the file changes.
+    Returns None if the file can not be read or parsed."""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    try:
+        mtime_ns, size, index = _FUNCTION_INDEX_CACHE[file_path]
+    except KeyError:
+        pass
+    else:
+        if (mtime_ns, size) == (stat.st_mtime_ns, stat.st_size):
+            return index
+    try:
+        with tokenize.open(file_path) as f:
+            index = FunctionIndex(f.read())
+    except (OSError, SyntaxError, UnicodeDecodeError, ValueError, tokenize.TokenError) as err:
+        logging.warning('Can not index functions in {:s}: {!r:s}: {:s}'.format(file_path, type(err), str(err)))
+        index = None
+    _FUNCTION_INDEX_CACHE[file_path] = (stat.st_mtime_ns, stat.st_size, index)
+    return index
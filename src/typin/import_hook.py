@@ -0,0 +1,124 @@
+'''
+An import hook that records the types of every function and method in
+chosen packages by wrapping them as their modules are imported, see
+``typin.recording``.
+
+Only the functions of those packages pay any overhead, the rest of the
+interpreter runs at full speed as no trace function is set. For example::
+
+    from typin import import_hook
+    from typin import type_inferencer
+
+    ti = type_inferencer.TypeInferencer()
+    with import_hook.instrumented_imports(['mypackage'], ti):
+        import mypackage
+        mypackage.main()
+    print(ti.pretty_format())
+
+A pattern matches a module of that name and its submodules, so ``'mypackage'``
+matches ``mypackage`` and ``mypackage.sub``. Patterns can also be shell style
+wildcards as used by ``fnmatch`` such as ``'mypackage.*.api'``.
+'''
+import contextlib
+import fnmatch
+import importlib.abc
+import importlib.machinery
+import logging
+import sys
+
+from typin import recording
+
+def matches(fullname, patterns):
+    """Returns True if the module name matches any of the patterns."""
+    for pattern in patterns:
+        if fullname == pattern or fullname.startswith(pattern + '.') \
+                or fnmatch.fnmatchcase(fullname, pattern):
+            return True
+    return False
+
+class InstrumentingLoader(importlib.abc.Loader):
+    """Wraps the loader of a module so that the functions in the module are
+    recorded once it has been executed. Everything else is delegated to
+    the original loader."""
+    def __init__(self, loader, ti):
+        self.loader = loader
+        self.ti = ti
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.loader.exec_module(module)
+        count = recording.instrument_module(module, self.ti)
+        logging.debug('import_hook: instrumented {:d} functions in {:s}'.format(count, module.__name__))
+
+    def __getattr__(self, name):
+        # For example get_source(), get_code(), is_package().
+        return getattr(self.loader, name)
+
+class InstrumentingFinder(importlib.abc.MetaPathFinder):
+    """A ``sys.meta_path`` finder for modules that match the patterns, these
+    are found on ``sys.path`` as usual and loaded with an InstrumentingLoader."""
+    def __init__(self, patterns, ti=None):
+        """Constructor.
+
+        :param patterns: Patterns of module names to instrument.
+        :type patterns: ``list([str])``
+
+        :param ti: The TypeInferencer to record into, None for
+            ``typin.recording.recorder()``.
+        :type ti: ``typin.type_inferencer.TypeInferencer, NoneType``
+        """
+        self.patterns = tuple(patterns)
+        if ti is None:
+            ti = recording.recorder()
+        self.ti = ti
+
+    def find_spec(self, fullname, path, target=None):
+        if not matches(fullname, self.patterns):
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path)
+        if spec is None or spec.loader is None or not hasattr(spec.loader, 'exec_module'):
+            return None
+        spec.loader = InstrumentingLoader(spec.loader, self.ti)
+        return spec
+
+def install(patterns, ti=None, instrument_imported=True):
+    """Installs an InstrumentingFinder at the start of ``sys.meta_path``.
+
+    :param patterns: Patterns of module names to instrument.
+    :type patterns: ``list([str])``
+
+    :param ti: The TypeInferencer to record into, None for
+        ``typin.recording.recorder()``.
+    :type ti: ``typin.type_inferencer.TypeInferencer, NoneType``
+
+    :param instrument_imported: If True then modules that match and have
+        already been imported are instrumented now.
+    :type instrument_imported: ``bool``
+
+    :return: ``InstrumentingFinder`` -- The finder, for uninstall().
+    """
+    finder = InstrumentingFinder(patterns, ti)
+    sys.meta_path.insert(0, finder)
+    if instrument_imported:
+        for fullname, module in list(sys.modules.items()):
+            if module is not None and matches(fullname, finder.patterns):
+                recording.instrument_module(module, finder.ti)
+    return finder
+
+def uninstall(finder):
+    """Removes a finder installed with install(). Modules that have been
+    imported remain instrumented."""
+    if finder in sys.meta_path:
+        sys.meta_path.remove(finder)
+
+@contextlib.contextmanager
+def instrumented_imports(patterns, ti=None, instrument_imported=True):
+    """Context manager that installs the import hook for its duration, the
+    arguments are as install(). This yields the finder."""
+    finder = install(patterns, ti, instrument_imported)
+    try:
+        yield finder
+    finally:
+        uninstall(finder)
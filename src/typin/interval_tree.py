@@ -0,0 +1,55 @@
+'''
+A static interval tree for finding which traced functions span a line.
+'''
+
+class IntervalTree:
+    """A static tree of closed intervals ``[begin, end]`` each with a value.
+    This is an implicit balanced binary tree over the intervals sorted by
+    begin where each node records the maximum end in its subtree.
+    Point and range queries take O(log n + k) time for k results."""
+    def __init__(self, intervals):
+        """Constructor with an iterable of ``(begin, end, value)``."""
+        self._intervals = sorted(intervals, key=lambda i: (i[0], i[1]))
+        self._max_end = [0] * len(self._intervals)
+        self._build(0, len(self._intervals))
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def _build(self, lo, hi):
+        """Fills in _max_end for the subtree of _intervals[lo:hi] and returns
+        the maximum end of that subtree."""
+        if lo >= hi:
+            return float('-inf')
+        mid = (lo + hi) // 2
+        max_end = max(self._intervals[mid][1], self._build(lo, mid), self._build(mid + 1, hi))
+        self._max_end[mid] = max_end
+        return max_end
+
+    def _query(self, lo, hi, begin, end, result):
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        if self._max_end[mid] < begin:
+            # Everything in this subtree finishes before begin.
+            return
+        self._query(lo, mid, begin, end, result)
+        interval = self._intervals[mid]
+        if interval[0] > end:
+            # This and everything to the right starts after end.
+            return
+        if interval[1] >= begin:
+            result.append(interval)
+        self._query(mid + 1, hi, begin, end, result)
+
+    def overlapping(self, begin, end):
+        """Returns a list of ``(begin, end, value)`` that overlap the closed
+        range ``[begin, end]`` sorted by begin then end."""
+        result = []
+        self._query(0, len(self._intervals), begin, end, result)
+        return result
+
+    def at(self, point):
+        """Returns a list of ``(begin, end, value)`` that contain point sorted
+        by begin then end."""
+        return self.overlapping(point, point)
@@ -0,0 +1,524 @@
+'''
+A columnar store of the types observed for each function. This is an
+alternative to a ``types.FunctionTypes`` per function holding sets of types.
+Each distinct observation is one row of parallel ``array.array`` columns::
+
+    function_id, slot_kind, slot_index, line, type_id, count
+
+* function_id - The function, see ObservationStore.add_function().
+* slot_kind - One of the SLOT_... constants.
+* slot_index - For SLOT_ARGUMENT the position of the argument name in the
+  names seen for the function, for SLOT_ROW one of the ROW_... constants,
+  otherwise 0.
+* line - The line number of the call, return, exception or yield. For
+  SLOT_ROW this is the index into ``ObservationStore.argument_types`` of the
+  argument types of the call.
+* type_id - Index into ``ObservationStore.types``, NO_TYPE for calls,
+  resumptions and returns that were dropped without their value being seen.
+* count - The number of times this has been observed.
+
+A SLOT_ROW row pairs the argument types of a call with the type that it
+returned or raised, this is for ``@overload`` variants as the
+``call_return_rows`` of ``types.FunctionTypes``. As there a function has at
+most ``types.FunctionTypes.MAX_CALL_RETURN_ROWS`` of these, beyond that the
+least frequently seen is evicted and its row reused.
+
+A hash index finds the row of an observation so repeated observations only
+increment the count. Memory scales with the number of distinct observations.
+
+The columns can be exported as NumPy arrays with to_numpy() if NumPy is
+installed. For compatibility function_types() builds a ``types.FunctionTypes``
+from the rows of a function.
+
+With ``TypeInferencer(columnar=True)`` each function is recorded with a
+ColumnarFunctionTypes that writes into the store.
+'''
+import array
+import collections
+
+from typin import str_id_cache
+from typin import types
+
+SLOT_CALL = 0
+SLOT_ARGUMENT = 1
+SLOT_RETURN = 2
+SLOT_EXCEPTION = 3
+SLOT_YIELD = 4
+SLOT_RESUME = 5
+SLOT_SEND = 6
+SLOT_ROW = 7
+
+#: The slot_index of a SLOT_ROW.
+ROW_RETURN = 0
+ROW_EXCEPTION = 1
+#: dict of {slot_index : types.FunctionTypes.CALL_RETURN_KIND_..., ...}
+ROW_KINDS = {
+    ROW_RETURN : types.FunctionTypes.CALL_RETURN_KIND_RETURN,
+    ROW_EXCEPTION : types.FunctionTypes.CALL_RETURN_KIND_EXCEPTION,
+}
+
+NO_TYPE = 0
+
+def _pack(function_id, slot_kind, slot_index, line, type_id):
+    """Returns the key of an observation in the hash index."""
+    return ((((function_id << 3 | slot_kind) << 16 | slot_index) << 32 | line) << 32) | type_id
+
+#: Column names and their ``array`` typecodes in order.
+COLUMNS = (
+    ('function_id', 'I'),
+    ('slot_kind', 'B'),
+    ('slot_index', 'H'),
+    ('line', 'I'),
+    ('type_id', 'I'),
+    ('count', 'Q'),
+)
+
+#: What the store knows about each function. The IDs are of names in
+#: ObservationStore.names.
+FunctionInfo = collections.namedtuple(
+    'FunctionInfo', 'file_id namespace_id function_name_id signature generator_kind argument_names'
+)
+
+class ObservationStore:
+    """Parallel array columns of observations with a hash index."""
+    def __init__(self, widen_threshold=None, names=None):
+        """Constructor.
+
+        :param widen_threshold: Passed to each ``types.FunctionTypes`` built
+            by function_types().
+        :type widen_threshold: ``int, NoneType``
+
+        :param names: The cache that interns file paths, namespaces, function
+            names and type names. This is shared with the TypeInferencer, if
+            None a new one is created.
+        :type names: ``typin.str_id_cache.StringIdCache, NoneType``
+        """
+        self.widen_threshold = widen_threshold
+        for name, typecode in COLUMNS:
+            setattr(self, name, array.array(typecode))
+        # dict of {packed observation : row, ...}
+        self._index = {}
+        # dict of {function_id : array of rows, ...}
+        self._function_rows = {}
+        # Interned file paths, namespaces, function names and type names.
+        self.names = str_id_cache.StringIdCache() if names is None else names
+        # list of FunctionInfo, the index is the function_id.
+        self.functions = []
+        # dict of {(file_id, namespace_id, function_name_id) : function_id, ...}
+        self._function_ids = {}
+        # list of types.Type, the index is the type_id.
+        self.types = [None]
+        # The ID in self.names of str() of each of self.types, the index is
+        # the type_id. NO_TYPE has no name, this is 0 for that.
+        self.type_name_ids = array.array('I', [0])
+        # dict of {types.Type : type_id, ...}
+        self._type_ids = {}
+        # list of tuples of type_id of the arguments of calls in order, the
+        # index is the line of a SLOT_ROW. An entry no longer used by any
+        # SLOT_ROW is None and its index is reused.
+        self.argument_types = []
+        # dict of {tuple(type_id, ...) : index, ...}
+        self._argument_types_ids = {}
+        # Number of SLOT_ROW rows using each of self.argument_types.
+        self._argument_types_refs = []
+        # Indexes of self.argument_types that are free.
+        self._free_argument_types = []
+        # dict of {function_id : list of SLOT_ROW rows, ...}
+        self._call_return_rows = collections.defaultdict(list)
+        # SLOT_ROW rows evicted and rows evicted from the call_return_rows of
+        # FunctionTypes added with add_function_types().
+        # Counter of {function_id : count, ...}
+        self.call_return_rows_evicted = collections.Counter()
+        # Cache of function_types(), an entry is removed when its function is
+        # observed. dict of {function_id : types.FunctionTypes, ...}
+        self._built = {}
+
+    def __len__(self):
+        """The number of rows."""
+        return len(self.count)
+
+    def add_function(self, file_path, namespace, function_name, signature=None, generator_kind=None):
+        """Returns the ID of the function, added if necessary."""
+        key = tuple(self.names.intern_many((file_path, namespace, function_name)))
+        try:
+            return self._function_ids[key]
+        except KeyError:
+            pass
+        self.functions.append(FunctionInfo(*key, signature, generator_kind, []))
+        function_id = self._function_ids[key] = len(self.functions) - 1
+        self._function_rows[function_id] = array.array('I')
+        return function_id
+
+    def intern_type(self, t):
+        """Returns the ID of the types.Type t, added if necessary."""
+        try:
+            return self._type_ids[t]
+        except KeyError:
+            pass
+        self.types.append(t)
+        self.type_name_ids.append(self.names.id(str(t)))
+        type_id = self._type_ids[t] = len(self.types) - 1
+        return type_id
+
+    def type_name(self, type_id):
+        """Returns str() of the types.Type with the ID, this is interned in
+        self.names. May raise a KeyError."""
+        if type_id == NO_TYPE:
+            raise KeyError(type_id)
+        return self.names.name(self.type_name_ids[type_id])
+
+    def argument_type_ids(self, arg_types):
+        """Returns the tuple of type IDs of the sequence of types.Type of the
+        arguments of a call, see add_row()."""
+        return tuple(self.intern_type(t) for t in arg_types)
+
+    def _acquire_argument_types(self, arg_type_ids):
+        """Returns the index in self.argument_types of the tuple of type IDs
+        for a new SLOT_ROW row, added if necessary."""
+        try:
+            index = self._argument_types_ids[arg_type_ids]
+        except KeyError:
+            if self._free_argument_types:
+                index = self._free_argument_types.pop()
+                self.argument_types[index] = arg_type_ids
+            else:
+                index = len(self.argument_types)
+                self.argument_types.append(arg_type_ids)
+                self._argument_types_refs.append(0)
+            self._argument_types_ids[arg_type_ids] = index
+        self._argument_types_refs[index] += 1
+        return index
+
+    def _release_argument_types(self, index):
+        """Notes that an evicted SLOT_ROW row no longer uses the argument
+        types at index, these are freed if no other row uses them."""
+        self._argument_types_refs[index] -= 1
+        if self._argument_types_refs[index] == 0:
+            del self._argument_types_ids[self.argument_types[index]]
+            self.argument_types[index] = None
+            self._free_argument_types.append(index)
+
+    def observe(self, function_id, slot_kind, slot_index, line, type_id, count=1):
+        """Counts an observation and returns its row."""
+        key = _pack(function_id, slot_kind, slot_index, line, type_id)
+        self._built.pop(function_id, None)
+        try:
+            row = self._index[key]
+        except KeyError:
+            pass
+        else:
+            self.count[row] += count
+            return row
+        row = self._index[key] = len(self.count)
+        self.function_id.append(function_id)
+        self.slot_kind.append(slot_kind)
+        self.slot_index.append(slot_index)
+        self.line.append(line)
+        self.type_id.append(type_id)
+        self.count.append(count)
+        self._function_rows[function_id].append(row)
+        return row
+
+    #---- Recording, these take types.Type objects. ----
+    def add_call(self, function_id, arg_names, arg_types, line):
+        """Records a call with the argument names and their types."""
+        self.observe(function_id, SLOT_CALL, 0, line, NO_TYPE)
+        for name, t in zip(arg_names, arg_types):
+            self._add_argument(function_id, name, t, line)
+
+    def _add_argument(self, function_id, name, t, line):
+        argument_names = self.functions[function_id].argument_names
+        try:
+            slot_index = argument_names.index(name)
+        except ValueError:
+            slot_index = len(argument_names)
+            argument_names.append(name)
+        self.observe(function_id, SLOT_ARGUMENT, slot_index, line, self.intern_type(t))
+
+    def add_return(self, function_id, t, line):
+        self.observe(function_id, SLOT_RETURN, 0, line, self.intern_type(t))
+
+    def drop_return(self, function_id):
+        """Records a return or exception whose value was not seen."""
+        self.observe(function_id, SLOT_RETURN, 0, 0, NO_TYPE)
+
+    def add_row(self, function_id, arg_type_ids, row_kind, t, count=1):
+        """Counts a call with the argument types arg_type_ids, see
+        argument_type_ids(), that returned or raised the types.Type t.
+        row_kind is ROW_RETURN or ROW_EXCEPTION. If the function has
+        MAX_CALL_RETURN_ROWS of these the least frequently seen is evicted
+        and its row reused. Returns the row."""
+        type_id = self.intern_type(t)
+        try:
+            key = _pack(function_id, SLOT_ROW, row_kind, self._argument_types_ids[arg_type_ids], type_id)
+            row = self._index[key]
+        except KeyError:
+            pass
+        else:
+            self._built.pop(function_id, None)
+            self.count[row] += count
+            return row
+        rows = self._call_return_rows[function_id]
+        if len(rows) < types.FunctionTypes.MAX_CALL_RETURN_ROWS:
+            row = self.observe(function_id, SLOT_ROW, row_kind,
+                               self._acquire_argument_types(arg_type_ids), type_id, count)
+            rows.append(row)
+            return row
+        row = min(rows, key=self.count.__getitem__)
+        del self._index[_pack(function_id, SLOT_ROW, self.slot_index[row], self.line[row], self.type_id[row])]
+        self._release_argument_types(self.line[row])
+        self.call_return_rows_evicted[function_id] += 1
+        self._built.pop(function_id, None)
+        line = self._acquire_argument_types(arg_type_ids)
+        self._index[_pack(function_id, SLOT_ROW, row_kind, line, type_id)] = row
+        self.slot_index[row] = row_kind
+        self.line[row] = line
+        self.type_id[row] = type_id
+        self.count[row] = count
+        return row
+
+    def add_exception(self, function_id, t, line):
+        self.observe(function_id, SLOT_EXCEPTION, 0, line, self.intern_type(t))
+
+    def add_yield(self, function_id, t, line):
+        self.observe(function_id, SLOT_YIELD, 0, line, self.intern_type(t))
+
+    def add_resume(self, function_id, line):
+        self.observe(function_id, SLOT_RESUME, 0, line, NO_TYPE)
+
+    def add_send(self, function_id, t):
+        self.observe(function_id, SLOT_SEND, 0, 0, self.intern_type(t))
+
+    def add_function_types(self, file_path, namespace, function_name, fts):
+        """Adds the observations of a types.FunctionTypes. Argument types
+        are given the line of the first call."""
+        function_id = self.add_function(file_path, namespace, function_name,
+                                        fts.signature, fts.generator_kind)
+        for line in fts.call_line_numbers:
+            self.observe(function_id, SLOT_CALL, 0, line, NO_TYPE)
+        line = fts.call_line_numbers[0] if fts.call_line_numbers else 0
+        for name, type_set in fts.arguments.items():
+            for t in type_set:
+                self._add_argument(function_id, name, t, line)
+        for slot_kind, type_map in ((SLOT_RETURN, fts.return_types),
+                                    (SLOT_EXCEPTION, fts._exception_types),
+                                    (SLOT_YIELD, fts.yield_types)):
+            for line, type_set in type_map.items():
+                for t in type_set:
+                    self.observe(function_id, slot_kind, 0, line, self.intern_type(t))
+        for t in fts.send_types:
+            self.add_send(function_id, t)
+        row_kinds = {v : k for k, v in ROW_KINDS.items()}
+        for (arg_types, kind, t), count in fts.call_return_rows.items():
+            self.add_row(function_id, self.argument_type_ids(arg_types), row_kinds[kind], t, count)
+        self.call_return_rows_evicted[function_id] += fts.call_return_rows_evicted
+        return function_id
+    #---- END: Recording. ----
+
+    def columns(self):
+        """Returns an ``OrderedDict`` of ``{column_name : array.array, ...}``."""
+        return collections.OrderedDict((name, getattr(self, name)) for name, _typecode in COLUMNS)
+
+    def to_numpy(self):
+        """Returns an ``OrderedDict`` of ``{column_name : numpy.ndarray, ...}``
+        with a copy of each column.
+
+        :raises: ``ImportError`` If NumPy is not installed.
+        """
+        import numpy
+        return collections.OrderedDict(
+            (name, numpy.frombuffer(column, dtype=column.typecode).copy())
+            for name, column in self.columns().items()
+        )
+
+    #---- Compatibility with TypeInferencer. ----
+    def file_paths(self):
+        """Returns the file paths seen in ID order."""
+        return [self.names.name(file_id) for file_id in sorted(set(f.file_id for f in self.functions))]
+
+    def namespaces(self, file_path):
+        file_id = self.names.get(file_path)
+        return sorted(set(self.names.name(f.namespace_id) for f in self.functions if f.file_id == file_id))
+
+    def function_names(self, file_path, namespace):
+        file_id = self.names.get(file_path)
+        namespace_id = self.names.get(namespace)
+        return [self.names.name(f.function_name_id) for f in self.functions
+                if f.file_id == file_id and f.namespace_id == namespace_id]
+
+    def function_types(self, file_path, namespace, function_name):
+        """Returns a ``types.FunctionTypes`` built from the rows of the
+        function. This is cached until the function is next observed.
+        May raise a KeyError."""
+        key = tuple(self.names.get(name) for name in (file_path, namespace, function_name))
+        return self.function_types_of(self._function_ids[key])
+
+    def function_types_of(self, function_id):
+        """As function_types() with the function ID."""
+        try:
+            return self._built[function_id]
+        except KeyError:
+            pass
+        info = self.functions[function_id]
+        fts = types.FunctionTypes(info.signature, self.widen_threshold, info.generator_kind)
+        file_path = self.names.name(info.file_id)
+        by_kind = collections.defaultdict(list)
+        for row in self._function_rows[function_id]:
+            slot_kind = self.slot_kind[row]
+            if slot_kind in (SLOT_CALL, SLOT_ARGUMENT):
+                slot_kind = SLOT_CALL
+            by_kind[slot_kind].append(row)
+        for row in by_kind[SLOT_CALL]:
+            if self.slot_kind[row] == SLOT_CALL:
+                fts.add_call_types([], [], file_path, self.line[row])
+            else:
+                fts.add_call_types([info.argument_names[self.slot_index[row]]],
+                                   [self.types[self.type_id[row]]], file_path, self.line[row])
+        fts.clear_call_stack()
+        for row in by_kind[SLOT_RESUME]:
+            fts.add_resume(self.line[row])
+        for row in by_kind[SLOT_YIELD]:
+            fts.add_resume(self.line[row])
+            fts.add_yield_type(self.types[self.type_id[row]], self.line[row])
+        for row in by_kind[SLOT_SEND]:
+            fts.add_send_type(self.types[self.type_id[row]])
+        # Returns before exceptions as returns are never phantoms here.
+        for row in by_kind[SLOT_RETURN]:
+            if self.type_id[row] == NO_TYPE:
+                fts.returns_dropped += self.count[row]
+            else:
+                t = self.types[self.type_id[row]]
+                fts.add_return_type(t, self.line[row], t.base_class())
+        for row in by_kind[SLOT_EXCEPTION]:
+            fts.add_exception_type(self.types[self.type_id[row]], self.line[row])
+        # The calls have not been paired above, these are the pairs.
+        for row in by_kind[SLOT_ROW]:
+            fts.add_call_return_row(
+                [self.types[type_id] for type_id in self.argument_types[self.line[row]]],
+                ROW_KINDS[self.slot_index[row]], self.types[self.type_id[row]], self.count[row]
+            )
+        fts.call_return_rows_evicted += self.call_return_rows_evicted[function_id]
+        self._built[function_id] = fts
+        return fts
+    #---- END: Compatibility with TypeInferencer. ----
+
+class ColumnarFunctionTypes:
+    """Records the calls of one function into an ObservationStore. This has
+    the data acquisition methods of ``types.FunctionTypes``, any other
+    attribute is that of the ``types.FunctionTypes`` built from the store."""
+    # Not used, the store keeps counts rather than fingerprints.
+    settled = False
+
+    def __init__(self, store, function_id):
+        self.store = store
+        self.function_id = function_id
+        self.generator_kind = store.functions[function_id].generator_kind
+        self._yield_count = 0
+        self._yield_classes = set()
+        # Stack of the tuples of argument type IDs of calls that have not yet
+        # returned or raised, None for a skipped call. As types.FunctionTypes.
+        self._call_stack = []
+
+    @property
+    def signature(self):
+        return self.store.functions[self.function_id].signature
+
+    @signature.setter
+    def signature(self, value):
+        info = self.store.functions[self.function_id]
+        self.store.functions[self.function_id] = info._replace(signature=value)
+
+    def __getattr__(self, name):
+        return getattr(self.store.function_types_of(self.function_id), name)
+
+    def __repr__(self):
+        return repr(self.store.function_types_of(self.function_id))
+
+    def __str__(self):
+        return str(self.store.function_types_of(self.function_id))
+
+    #---- Data acquisition as types.FunctionTypes. ----
+    def add_call(self, arg_info, file_path, line_number):
+        self.add_call_types(arg_info.args, [types.Type(arg_info.locals[arg]) for arg in arg_info.args],
+                            file_path, line_number)
+
+    def add_call_types(self, arg_names, arg_types, file_path, line_number, fingerprint=None):
+        self.store.add_call(self.function_id, arg_names, arg_types, line_number)
+        if self.generator_kind is None:
+            # Call/return pairs are not tracked for generators.
+            self._call_stack.append(self.store.argument_type_ids(arg_types))
+
+    def _add_row(self, row_kind, t):
+        """Pairs t with the innermost call in flight."""
+        if len(self._call_stack):
+            arg_type_ids = self._call_stack.pop()
+            if arg_type_ids is not None:
+                self.store.add_row(self.function_id, arg_type_ids, row_kind, t)
+
+    def add_return(self, return_value, line_number):
+        self.add_return_type(types.Type(return_value), line_number, type(return_value))
+
+    def add_return_type(self, t, line_number, cls):
+        self._add_row(ROW_RETURN, t)
+        self.store.add_return(self.function_id, t, line_number)
+
+    def add_exception(self, exception, line_number):
+        self.add_exception_type(types.Type(exception), line_number)
+
+    def add_exception_type(self, t, line_number):
+        self._add_row(ROW_EXCEPTION, t)
+        self.store.add_exception(self.function_id, t, line_number)
+
+    def add_resume(self, line_number):
+        self.store.add_resume(self.function_id, line_number)
+
+    def add_yield(self, yield_value, line_number):
+        if self.sample_yield(type(yield_value)):
+            self.add_yield_type(types.Type(yield_value), line_number)
+        else:
+            self.add_resume(line_number)
+
+    def sample_yield(self, cls):
+        """As ``types.FunctionTypes.sample_yield()``."""
+        self._yield_count += 1
+        if self._yield_count > types.FunctionTypes.YIELD_SAMPLE_FULL \
+        and cls in self._yield_classes \
+        and self._yield_count % types.FunctionTypes.YIELD_SAMPLE_INTERVAL:
+            return False
+        self._yield_classes.add(cls)
+        return True
+
+    def add_yield_type(self, t, line_number):
+        self.store.add_yield(self.function_id, t, line_number)
+
+    def add_send(self, send_value):
+        self.store.add_send(self.function_id, types.Type(send_value))
+
+    def add_send_type(self, t):
+        self.store.add_send(self.function_id, t)
+
+    def skip_known_call(self, fingerprint):
+        return False
+
+    def skip_known_return(self, return_value, line_number):
+        return False
+
+    def skip_call(self):
+        if self.generator_kind is None:
+            self._call_stack.append(None)
+
+    def skip_return(self):
+        if len(self._call_stack):
+            self._call_stack.pop()
+
+    def drop_return(self):
+        self.skip_return()
+        self.store.drop_return(self.function_id)
+
+    def add_call_return_row(self, arg_types, kind, t, count=1):
+        row_kind = ROW_RETURN if kind == types.FunctionTypes.CALL_RETURN_KIND_RETURN else ROW_EXCEPTION
+        self.store.add_row(self.function_id, self.store.argument_type_ids(arg_types), row_kind, t, count)
+
+    def clear_call_stack(self):
+        del self._call_stack[:]
+    #---- END: Data acquisition. ----
@@ -0,0 +1,355 @@
+'''
+Recording the types of chosen functions without tracing.
+
+``TypeInferencer`` as a context manager traces every function that the
+interpreter executes. When only a few functions are of interest, such as the
+public API of a package, they can instead be wrapped so that only they pay any
+overhead and ``sys.settrace()`` is not used at all::
+
+    import typin
+
+    @typin.record
+    def add(a, b):
+        return a + b
+
+    # Or wrap every function and method in a module:
+    typin.instrument_module(some_module)
+
+    # ... run the code ...
+
+    print(typin.recorder().pretty_format())
+
+The types are recorded in the same ``FunctionTypes`` objects of a
+``TypeInferencer``, by default the one returned by recorder(), so
+``pretty_format()``, the stub writers and snapshots work unchanged.
+
+Once a call with the same classes of arguments has been recorded then the
+call is only counted, apart from every SAMPLE_INTERVAL'th one, which makes
+repeated calls cheap.
+
+Return values are recorded at the line of the declaration as the wrapper can
+not see which line returned. The yields of async generators are not recorded.
+
+Recording never changes what a call does. If the arguments do not bind to the
+signature, or the types can not be recorded, the call is not recorded and the
+function is called as it would be without the wrapper.
+'''
+import functools
+import inspect
+import logging
+
+from typin import type_inferencer
+
+#: Every SAMPLE_INTERVAL'th call with argument classes that have been seen
+#: before is still recorded in full.
+SAMPLE_INTERVAL = 64
+#: Attribute set on the wrapper to mark it as recorded.
+RECORDED_ATTRIBUTE = '__typin_recorded__'
+
+_RECORDER = None
+
+def recorder():
+    """Returns the default TypeInferencer that record() and
+    instrument_module() record into, this is created on first use. It is
+    never used as a context manager so does not trace."""
+    global _RECORDER
+    if _RECORDER is None:
+        _RECORDER = type_inferencer.TypeInferencer()
+    return _RECORDER
+
+def is_recorded(function):
+    """Returns True if the function is already wrapped by record()."""
+    return getattr(function, RECORDED_ATTRIBUTE, False)
+
+class _FunctionRecorder:
+    """Records the calls of one function into its FunctionTypes."""
+    def __init__(self, function, ti, bases):
+        self.function = function
+        self.ti = ti
+        self.bases = bases
+        # The FunctionTypes is created on the first call so that functions
+        # that are never called do not appear in the results.
+        self.fts = None
+        self.file_path = function.__code__.co_filename
+        self.line_number = function.__code__.co_firstlineno
+        self.signature = inspect.signature(function)
+        # Names of the arguments in the order of inspect.getargvalues().
+        self.arg_names = []
+        self.varargs = None
+        self.keywords = None
+        for parameter in self.signature.parameters.values():
+            if parameter.kind == parameter.VAR_POSITIONAL:
+                self.varargs = parameter.name
+            elif parameter.kind == parameter.VAR_KEYWORD:
+                self.keywords = parameter.name
+            else:
+                self.arg_names.append(parameter.name)
+        # For a method the class is found on the first call from self.
+        self.find_bases = bases is None and '.' in self.function.__qualname__
+        # set of argument classes, and kwargs classes, of calls recorded.
+        self.call_fingerprints = set()
+        # set of classes of returned values.
+        self.return_fingerprints = set()
+        self.count = 0
+
+    def _find_bases(self, args):
+        """Find the class of a method from the first argument, if that is
+        found then the class bases are recorded."""
+        self.find_bases = False
+        if len(args) == 0:
+            return
+        namespace = self.function.__qualname__.rsplit('.', 1)[0]
+        first = args[0]
+        for cls in type(first).__mro__ + ((first,) if isinstance(first, type) else ()):
+            if cls.__qualname__ == namespace and cls.__module__ == self.function.__module__:
+                self.bases = cls.__bases__
+                break
+
+    def _safely(self, method, *args):
+        """Returns method(*args) where method records something. A failure
+        is logged and None returned so that the call of the function is not
+        affected."""
+        try:
+            return method(*args)
+        except Exception as err:
+            logging.debug('typin.record: Could not record {:s}: {!r:s}'.format(
+                self.function.__qualname__, err))
+            return None
+
+    def call(self, args, kwargs):
+        """Records a call, returns True if it was recorded in full, False if
+        it was only counted and None if it could not be recorded, for example
+        if the arguments do not bind to the signature."""
+        return self._safely(self._call, args, kwargs)
+
+    def _call(self, args, kwargs):
+        if self.fts is None:
+            if self.find_bases:
+                self._find_bases(args)
+            self.fts = self.ti.function_types_of(self.function, self.bases)
+        if kwargs:
+            fingerprint = (tuple(type(a) for a in args),
+                           tuple((k, type(v)) for k, v in kwargs.items()))
+        else:
+            fingerprint = tuple(type(a) for a in args)
+        self.count += 1
+        if fingerprint in self.call_fingerprints and self.count % SAMPLE_INTERVAL:
+            self.fts.skip_call()
+            return False
+        bound = self.signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arg_info = inspect.ArgInfo(self.arg_names, self.varargs, self.keywords, bound.arguments)
+        self.fts.add_call(arg_info, self.file_path, self.line_number)
+        self.call_fingerprints.add(fingerprint)
+        return True
+
+    def returned(self, value, recorded_call):
+        """Records a returned value. recorded_call is the result of call(),
+        if that is None nothing is recorded."""
+        if recorded_call is not None:
+            self._safely(self._returned, value, recorded_call)
+
+    def _returned(self, value, recorded_call):
+        if not recorded_call and type(value) in self.return_fingerprints:
+            self.fts.skip_return()
+        else:
+            self.fts.add_return(value, self.line_number)
+            self.return_fingerprints.add(type(value))
+
+    def raised(self, exception, recorded_call):
+        """Records an exception raised or propagated by the function.
+        recorded_call is the result of call(), if that is None nothing is
+        recorded."""
+        if recorded_call is not None:
+            self._safely(self._raised, exception)
+
+    def _raised(self, exception):
+        self.fts.add_exception(exception, self.exception_line_number(exception))
+
+    def exception_line_number(self, exception):
+        """Returns the line in the function that the exception passed through."""
+        code = self.function.__code__
+        tb = exception.__traceback__
+        line_number = self.line_number
+        while tb is not None:
+            if tb.tb_frame.f_code is code:
+                line_number = tb.tb_lineno
+            tb = tb.tb_next
+        return line_number
+
+def _wrap_function(function_recorder):
+    function = function_recorder.function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        recorded_call = function_recorder.call(args, kwargs)
+        try:
+            result = function(*args, **kwargs)
+        except Exception as err:
+            function_recorder.raised(err, recorded_call)
+            raise
+        function_recorder.returned(result, recorded_call)
+        return result
+    return wrapper
+
+def _wrap_coroutine_function(function_recorder):
+    function = function_recorder.function
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        recorded_call = function_recorder.call(args, kwargs)
+        try:
+            result = await function(*args, **kwargs)
+        except Exception as err:
+            function_recorder.raised(err, recorded_call)
+            raise
+        function_recorder.returned(result, recorded_call)
+        return result
+    return wrapper
+
+def _wrap_generator_function(function_recorder):
+    function = function_recorder.function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        recorded_call = function_recorder.call(args, kwargs)
+        generator = function(*args, **kwargs)
+        if recorded_call is None:
+            return (yield from generator)
+        fts = function_recorder.fts
+        safely = function_recorder._safely
+        sent = None
+        thrown = None
+        while True:
+            try:
+                if thrown is None:
+                    value = generator.send(sent)
+                else:
+                    value = generator.throw(thrown)
+            except StopIteration as stop:
+                safely(fts.add_return, stop.value, function_recorder.line_number)
+                return stop.value
+            except Exception as err:
+                function_recorder.raised(err, recorded_call)
+                raise
+            safely(fts.add_yield, value, generator.gi_frame.f_lineno)
+            thrown = None
+            try:
+                sent = yield value
+            except GeneratorExit:
+                generator.close()
+                raise
+            except BaseException as err:
+                thrown = err
+            else:
+                if sent is not None:
+                    safely(fts.add_send, sent)
+    return wrapper
+
+def _wrap_async_generator_function(function_recorder):
+    function = function_recorder.function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        function_recorder.call(args, kwargs)
+        return function(*args, **kwargs)
+    return wrapper
+
+def record(function=None, *, ti=None, bases=None):
+    """Decorator that records the types of the arguments, return values and
+    exceptions of each call of the function. For example::
+
+        @typin.record
+        def f(a):
+            ...
+
+        @typin.record(ti=my_type_inferencer)
+        def g(b):
+            ...
+
+    :param function: The function to wrap.
+    :type function: ``function``
+
+    :param ti: The TypeInferencer to record into, None for recorder().
+    :type ti: ``typin.type_inferencer.TypeInferencer, NoneType``
+
+    :param bases: For a method the ``__bases__`` of its class. If None then
+        this is found on the first call.
+    :type bases: ``tuple, NoneType``
+
+    :return: ``function`` -- The wrapper.
+    """
+    if function is None:
+        return functools.partial(record, ti=ti, bases=bases)
+    if is_recorded(function):
+        return function
+    if ti is None:
+        ti = recorder()
+    function_recorder = _FunctionRecorder(function, ti, bases)
+    if inspect.isgeneratorfunction(function):
+        wrapper = _wrap_generator_function(function_recorder)
+    elif inspect.iscoroutinefunction(function):
+        wrapper = _wrap_coroutine_function(function_recorder)
+    elif inspect.isasyncgenfunction(function):
+        wrapper = _wrap_async_generator_function(function_recorder)
+    else:
+        wrapper = _wrap_function(function_recorder)
+    setattr(wrapper, RECORDED_ATTRIBUTE, True)
+    return wrapper
+
+def _instrument_class(cls, module_name, ti):
+    """Wraps the methods of the class and its nested classes, returns the
+    number wrapped."""
+    count = 0
+    for name, attribute in list(vars(cls).items()):
+        if isinstance(attribute, (staticmethod, classmethod)):
+            function = attribute.__func__
+            if inspect.isfunction(function) and not is_recorded(function):
+                setattr(cls, name, type(attribute)(record(function, ti=ti, bases=cls.__bases__)))
+                count += 1
+        elif isinstance(attribute, property):
+            accessors = [attribute.fget, attribute.fset, attribute.fdel]
+            wrapped = [
+                record(f, ti=ti, bases=cls.__bases__)
+                if inspect.isfunction(f) and not is_recorded(f) else f
+                for f in accessors
+            ]
+            if wrapped != accessors:
+                setattr(cls, name, property(*wrapped, doc=attribute.__doc__))
+                count += sum(1 for a, w in zip(accessors, wrapped) if a is not w)
+        elif inspect.isfunction(attribute):
+            if not is_recorded(attribute):
+                setattr(cls, name, record(attribute, ti=ti, bases=cls.__bases__))
+                count += 1
+        elif inspect.isclass(attribute) and attribute.__module__ == module_name \
+                and attribute.__qualname__ == '{:s}.{:s}'.format(cls.__qualname__, name):
+            count += _instrument_class(attribute, module_name, ti)
+    return count
+
+def instrument_module(module, ti=None):
+    """Wraps every function and method defined in the module with record().
+    Functions and classes imported from other modules are left alone.
+    Functions that are already wrapped are not wrapped again.
+
+    :param module: The module.
+    :type module: ``module``
+
+    :param ti: The TypeInferencer to record into, None for recorder().
+    :type ti: ``typin.type_inferencer.TypeInferencer, NoneType``
+
+    :return: ``int`` -- The number of functions wrapped.
+    """
+    if ti is None:
+        ti = recorder()
+    module_name = module.__name__
+    count = 0
+    for name, attribute in list(vars(module).items()):
+        if getattr(attribute, '__module__', None) != module_name:
+            continue
+        if inspect.isfunction(attribute):
+            if not is_recorded(attribute):
+                setattr(module, name, record(attribute, ti=ti))
+                count += 1
+        elif inspect.isclass(attribute) and attribute.__qualname__ == name:
+            count += _instrument_class(attribute, module_name, ti)
+    return count
@@ -0,0 +1,224 @@
+'''
+Snapshots of the types seen by a TypeInferencer and a structural diff of two
+snapshots. This is intended for continuous integration where a change in the
+types seen by a function should be reported.
+
+A snapshot is plain data that can be saved as JSON::
+
+    {
+        file_path : {
+            namespace : {
+                function_name : {
+                    'line' : 12,
+                    'arguments' : {argument_name : [type, ...], ...},
+                    'returns' : [type, ...],
+                    'exceptions' : [type, ...],
+                    'yields' : [type, ...], # Only for generators.
+                    'kind' : 'generator', # Only for generators.
+                }, ...
+            }, ...
+        }, ...
+    }
+
+Where each type is a string and each list of types is sorted.
+
+A snapshot of a previous run can be loaded as a baseline for a new one, see
+``TypeInferencer.load_baseline()``.
+
+The diff is a sequence of dicts, one per difference, and is written as JSON
+lines. Each has the keys 'change' ('added', 'removed' or 'changed'), 'file',
+'namespace' and 'function'. A 'changed' record also has 'field' (one of
+'arguments', 'returns', 'exceptions', 'yields'), 'argument' for arguments
+and 'added' and 'removed' lists of types.
+'''
+import argparse
+import json
+import sys
+
+from typin import types
+
+SNAPSHOT_VERSION = 1
+
+#: Fields of a function that are lists of types.
+TYPE_LIST_FIELDS = ('returns', 'exceptions', 'yields')
+
+class SnapshotException(Exception):
+    """Exception thrown when a snapshot can not be read."""
+    pass
+
+def _union_of(dict_of_set):
+    result = set()
+    for v in dict_of_set.values():
+        result |= v
+    return sorted(result)
+
+def function_snapshot(fts):
+    """Returns the snapshot of a types.FunctionTypes as a dict."""
+    try:
+        line = fts.line_decl
+    except types.FunctionTypesExceptionNoData:
+        line = 0
+    ret = {
+        'line' : line,
+        'arguments' : {k : sorted(v) for k, v in fts.argument_type_strings.items()},
+        'returns' : _union_of(fts.return_type_strings),
+        'exceptions' : _union_of(fts.exception_type_strings),
+    }
+    if fts.generator_kind is not None:
+        ret['yields'] = _union_of(fts.yield_type_strings)
+        ret['kind'] = fts.generator_kind
+    return ret
+
+def function_types(function_snap, widen_threshold=None):
+    """Returns a settled types.FunctionTypes from the snapshot of a function,
+    the reverse of function_snapshot(). The snapshot does not record the line
+    numbers of returns, exceptions and yields so they are all given the line
+    of the declaration. The types are created with ``types.Type.from_str()``."""
+    kind = function_snap.get('kind')
+    if kind is None and 'yields' in function_snap:
+        kind = types.FunctionTypes.KIND_GENERATOR
+    fts = types.FunctionTypes(None, widen_threshold, kind)
+    line = function_snap.get('line', 0)
+    if line:
+        fts.call_line_numbers.append(line)
+        fts.min_line_number = fts.max_line_number = line
+    for name, type_strs in function_snap.get('arguments', {}).items():
+        fts.arguments[name] = set(types.Type.from_str(s) for s in type_strs)
+    for field, type_map in (('returns', fts.return_types),
+                            ('exceptions', fts._exception_types),
+                            ('yields', fts.yield_types)):
+        type_strs = function_snap.get(field, [])
+        if type_strs:
+            type_map[line] = set(types.Type.from_str(s) for s in type_strs)
+    fts.settled = True
+    return fts
+
+def snapshot(ti):
+    """Returns the snapshot of a TypeInferencer, see the module documentation."""
+    # {file_path : { namespace : { function_name : FunctionTypes, ...}, ...}
+    return {
+        file_path : {
+            namespace : {
+                function_name : function_snapshot(fts)
+                for function_name, fts in ti.function_map[file_path][namespace].items()
+            } for namespace in ti.function_map[file_path]
+        } for file_path in ti.function_map
+    }
+
+def save(snap, path):
+    """Saves a snapshot, or a TypeInferencer, as JSON."""
+    if not isinstance(snap, dict):
+        snap = snapshot(snap)
+    with open(path, 'w') as stream:
+        json.dump({'version' : SNAPSHOT_VERSION, 'snapshot' : snap}, stream, sort_keys=True)
+
+def load(path):
+    """Loads a snapshot saved with save().
+
+    :raises: ``SnapshotException`` If the file is not a snapshot.
+    """
+    with open(path) as stream:
+        try:
+            data = json.load(stream)
+        except ValueError as err:
+            raise SnapshotException('{:s} is not JSON: {:s}'.format(path, str(err)))
+    if not isinstance(data, dict) or data.get('version') != SNAPSHOT_VERSION:
+        raise SnapshotException('{:s} is not a version {:d} snapshot'.format(path, SNAPSHOT_VERSION))
+    return data['snapshot']
+
+def _sorted_functions(snap):
+    """Returns a sorted list of ((file_path, namespace, function_name), function_snapshot)."""
+    return sorted(
+        ((file_path, namespace, function_name), snap[file_path][namespace][function_name])
+        for file_path in snap
+        for namespace in snap[file_path]
+        for function_name in snap[file_path][namespace]
+    )
+
+def _record(change, key, **kwargs):
+    ret = {'change' : change, 'file' : key[0], 'namespace' : key[1], 'function' : key[2]}
+    ret.update(kwargs)
+    return ret
+
+def _type_changes(old_types, new_types):
+    """Returns (added, removed) lists of types."""
+    old_set = set(old_types)
+    new_set = set(new_types)
+    return sorted(new_set - old_set), sorted(old_set - new_set)
+
+def _diff_function(key, old, new):
+    """Generates the 'changed' records for one function."""
+    old_args = old.get('arguments', {})
+    new_args = new.get('arguments', {})
+    names = list(old_args) + [n for n in new_args if n not in old_args]
+    for name in names:
+        added, removed = _type_changes(old_args.get(name, []), new_args.get(name, []))
+        if added or removed:
+            yield _record('changed', key, field='arguments', argument=name,
+                          added=added, removed=removed)
+    for field in TYPE_LIST_FIELDS:
+        added, removed = _type_changes(old.get(field, []), new.get(field, []))
+        if added or removed:
+            yield _record('changed', key, field=field, added=added, removed=removed)
+
+def diff(old, new):
+    """Generates the differences between two snapshots, or TypeInferencers,
+    as dicts, see the module documentation. This sorts the functions of both
+    then walks them together in a single linear merge."""
+    if not isinstance(old, dict):
+        old = snapshot(old)
+    if not isinstance(new, dict):
+        new = snapshot(new)
+    old_functions = _sorted_functions(old)
+    new_functions = _sorted_functions(new)
+    i = j = 0
+    while i < len(old_functions) and j < len(new_functions):
+        old_key, old_function = old_functions[i]
+        new_key, new_function = new_functions[j]
+        if old_key < new_key:
+            yield _record('removed', old_key)
+            i += 1
+        elif new_key < old_key:
+            yield _record('added', new_key)
+            j += 1
+        else:
+            yield from _diff_function(old_key, old_function, new_function)
+            i += 1
+            j += 1
+    for old_key, _old_function in old_functions[i:]:
+        yield _record('removed', old_key)
+    for new_key, _new_function in new_functions[j:]:
+        yield _record('added', new_key)
+
+def write_diff(records, stream=sys.stdout):
+    """Writes the diff records as JSON lines. Returns the number written."""
+    count = 0
+    for record in records:
+        stream.write(json.dumps(record, sort_keys=True))
+        stream.write('\n')
+        count += 1
+    return count
+
+def main():
+    """Command line to diff two snapshots, for example::
+
+        typin_diff before.json after.json
+
+    This writes the differences to stdout as JSON lines and exits with 1 if
+    there are any, 0 if there are none."""
+    parser = argparse.ArgumentParser(description='Compares two typin snapshots.')
+    parser.add_argument(dest='old', help='The earlier snapshot.')
+    parser.add_argument(dest='new', help='The later snapshot.')
+    parser.add_argument('-o', '--output', type=str, dest='output', default='',
+                        help='File to write the differences to. [default: stdout]')
+    cli_args = parser.parse_args()
+    records = diff(load(cli_args.old), load(cli_args.new))
+    if cli_args.output:
+        with open(cli_args.output, 'w') as stream:
+            count = write_diff(records, stream)
+    else:
+        count = write_diff(records)
+    return 1 if count else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
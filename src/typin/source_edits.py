@@ -0,0 +1,81 @@
+'''
+Applying many small edits to source code in a single pass.
+
+Positions from the ast module are (line number, UTF-8 byte column) pairs.
+These are converted to offsets into the source string with a table of line
+start offsets then all the edits are applied at once so the cost is linear
+in the size of the source rather than in the number of edits.
+'''
+import bisect
+import re
+
+RE_LINE_END = re.compile(r'\n')
+
+class SourceEditsException(Exception):
+    """Exception thrown when edits can not be applied."""
+    pass
+
+class LineOffsets:
+    """Converts (line, column) positions into offsets into the source."""
+    def __init__(self, source):
+        self.source = source
+        # Offset of the start of each line, line n is at index n-1.
+        self._starts = [0] + [m.end() for m in RE_LINE_END.finditer(source)]
+
+    def __len__(self):
+        return len(self._starts)
+
+    def line(self, lineno):
+        """Returns the text of the line including the line ending, lineno
+        starts at 1."""
+        start = self._starts[lineno - 1]
+        if lineno < len(self._starts):
+            return self.source[start:self._starts[lineno]]
+        return self.source[start:]
+
+    def offset(self, lineno, col_offset):
+        """Returns the offset into the source of a line number starting at 1
+        and a UTF-8 byte column as given by the ast module."""
+        start = self._starts[lineno - 1]
+        line = self.line(lineno)
+        if line.isascii():
+            return start + col_offset
+        return start + len(line.encode('utf-8')[:col_offset].decode('utf-8', errors='ignore'))
+
+    def char_offset(self, lineno, col):
+        """Returns the offset into the source of a line number starting at 1
+        and a character column as given by the tokenize module."""
+        return self._starts[lineno - 1] + col
+
+    def node_start(self, node):
+        """Returns the offset of the start of an ast node."""
+        return self.offset(node.lineno, node.col_offset)
+
+    def node_end(self, node):
+        """Returns the offset of the end of an ast node."""
+        return self.offset(node.end_lineno, node.end_col_offset)
+
+    def lineno(self, offset):
+        """Returns the line number, starting at 1, of an offset."""
+        return bisect.bisect_right(self._starts, offset)
+
+def apply_edits(source, edits):
+    """Returns the source with the edits applied. edits is an iterable of
+    ``(start_offset, end_offset, replacement)`` where the offsets are in the
+    original source. An insertion has start_offset == end_offset, insertions
+    at the same offset are applied in the order given.
+
+    :raises: ``SourceEditsException`` If any edits overlap.
+    """
+    pieces = []
+    position = 0
+    for start, end, replacement in sorted(edits, key=lambda e: (e[0], e[1])):
+        if start < position or end < start:
+            raise SourceEditsException(
+                'Edit [{:d}:{:d}] overlaps a previous edit ending at {:d}'.format(start, end, position)
+            )
+        pieces.append(source[position:start])
+        pieces.append(replacement)
+        position = end
+    pieces.append(source[position:])
+    return ''.join(pieces)
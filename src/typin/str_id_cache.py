@@ -3,40 +3,108 @@ Created on 22 Jun 2017
 
 @author: paulross
 '''
+import json
+
+STR_ID_CACHE_VERSION = 1
+
+class StringIdCacheException(Exception):
+    """Exception thrown when a saved cache can not be read."""
+    pass
 
 class StringIdCache:
     """Creates a cache of string to integer ID.
-    Used for file paths and function names."""
-    def __init__(self):
+    Used for file paths and function names.
+
+    IDs are allocated from 0 in the order that names are first seen and are
+    indexes into a list so the reverse lookup is O(1). IDs are stable across
+    save() and load(). Caches built separately, for example by different
+    processes, can be combined with merge()."""
+    def __init__(self, names=()):
         self._name_to_id = {}
-        # Reverse lookup
-        self._id_to_name = {}
-        
-    def _lengths_match(self):
-        if len(self._name_to_id) != len(self._id_to_name):
-            raise RuntimeError('Length mismatch')
-        return True
-        
+        # Reverse lookup, the index is the ID.
+        self._names = []
+        self.intern_many(names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._name_to_id
+
+    def __iter__(self):
+        """Iterates over the names in ID order."""
+        return iter(self._names)
+
     def id(self, name):
         """Returns an integer ID corresponding to the name."""
-        assert self._lengths_match()
         try:
             return self._name_to_id[name]
         except KeyError:
-            _id = len(self._name_to_id)
-            self._name_to_id[name] = _id
-            assert _id not in self._id_to_name
-            self._id_to_name[_id] = name
+            _id = self._name_to_id[name] = len(self._names)
+            self._names.append(name)
             return _id
-    
+
+    def get(self, name, default=None):
+        """Returns the integer ID of the name, or default if it is not in the
+        cache. Unlike id() the name is never added."""
+        return self._name_to_id.get(name, default)
+
+    def intern_many(self, names):
+        """Returns a list of the integer IDs of the names, in order."""
+        name_to_id = self._name_to_id
+        ret = []
+        for name in names:
+            try:
+                ret.append(name_to_id[name])
+            except KeyError:
+                _id = name_to_id[name] = len(self._names)
+                self._names.append(name)
+                ret.append(_id)
+        return ret
+
     def name(self, the_id):
         """Returns the name for a given integer ID.
         Will raise a KeyError is the ID does not exist."""
-        assert self._lengths_match()
-        return self._id_to_name[the_id]
+        if the_id < 0:
+            raise KeyError(the_id)
+        try:
+            return self._names[the_id]
+        except IndexError:
+            raise KeyError(the_id)
 
     def sorted_ids(self):
         """Returns a list of IDs sorted in order of the names."""
-        assert self._lengths_match()
-        lst = self._name_to_id.items()
-        return [v[1] for v in sorted(lst)]
+        return sorted(range(len(self._names)), key=self._names.__getitem__)
+
+    def merge(self, other):
+        """Adds the names of another StringIdCache. The IDs here are not
+        changed. Returns a list where the index is an ID in other and the
+        value is the ID of the same name here, this is for translating data
+        that uses the IDs of other."""
+        return self.intern_many(other._names)
+
+    def save(self, path):
+        """Saves the cache as JSON."""
+        with open(path, 'w') as stream:
+            json.dump({'version' : STR_ID_CACHE_VERSION, 'names' : self._names}, stream)
+
+    @classmethod
+    def load(cls, path):
+        """Returns a StringIdCache saved with save(), with the same IDs.
+
+        :raises: ``StringIdCacheException`` If the file is not a saved cache.
+        """
+        with open(path) as stream:
+            try:
+                data = json.load(stream)
+            except ValueError as err:
+                raise StringIdCacheException('{:s} is not JSON: {:s}'.format(path, str(err)))
+        if not isinstance(data, dict) or data.get('version') != STR_ID_CACHE_VERSION \
+                or not isinstance(data.get('names'), list):
+            raise StringIdCacheException(
+                '{:s} is not a version {:d} string ID cache'.format(path, STR_ID_CACHE_VERSION)
+            )
+        cache = cls(data['names'])
+        if len(cache) != len(data['names']):
+            raise StringIdCacheException('{:s} has duplicate names'.format(path))
+        return cache
@@ -0,0 +1,314 @@
+'''
+Merges the types seen when tracing into existing, possibly hand-written,
+stub files.
+
+Annotations are only added where they are missing or widened where the
+existing annotation does not accept every type that was seen. A type is
+accepted if it is a subclass of a member of the annotation, including the
+PEP 484 numeric tower so ``int`` is accepted by ``float``, or if it is named
+in the annotation. Type parameters, such as the ``int`` of ``Sequence[int]``,
+are not compared. Everything
+else in the stub, comments, ordering, ``@overload`` variants and functions
+that were not traced, is left untouched.
+'''
+import ast
+import bisect
+import builtins
+import collections
+import collections.abc
+
+from typin import function_index
+from typin import source_edits
+from typin import types
+
+#: text - The merged stub file.
+#: added - Number of annotations added where there were none.
+#: widened - Number of existing annotations widened to include the types seen.
+MergeResult = collections.namedtuple('MergeResult', 'text, added, widened')
+
+#: Existing annotations containing any of these are never widened.
+UNIVERSAL_ANNOTATIONS = frozenset(('Any', 'object', 'typing.Any'))
+
+#: PEP 484 numeric tower, {class : (classes also accepted, ...), ...}
+NUMERIC_TOWER = {
+    float : (int,),
+    complex : (int, float),
+}
+
+#: Classes of names in annotations that are not builtins, the typing aliases
+#: of builtins and the abstract base classes.
+ANNOTATION_CLASSES = dict(
+    (name, getattr(collections.abc, name)) for name in collections.abc.__all__
+)
+ANNOTATION_CLASSES.update({
+    'Dict' : dict,
+    'FrozenSet' : frozenset,
+    'List' : list,
+    'Set' : set,
+    'Text' : str,
+    'Tuple' : tuple,
+    'Type' : type,
+})
+
+#: Module prefixes that are removed from a name before it is looked up.
+ANNOTATION_MODULES = ('builtins.', 'collections.abc.', 'typing.')
+
+#: The ast nodes that can appear in a typing expression.
+TYPING_EXPRESSION_NODES = (
+    ast.Expression, ast.Name, ast.Attribute, ast.Subscript, ast.Tuple, ast.List,
+    ast.BinOp, ast.BitOr, ast.Constant, ast.Load,
+)
+
+class StubMergeException(Exception):
+    """Exception thrown when a stub can not be merged."""
+    pass
+
+def _normalise(annotation):
+    """Returns a normalised string of an annotation for comparison."""
+    try:
+        return ast.unparse(ast.parse(annotation, mode='eval'))
+    except SyntaxError:
+        return annotation
+
+def _is_overload(node):
+    for decorator in node.decorator_list:
+        if isinstance(decorator, ast.Name) and decorator.id == 'overload':
+            return True
+        if isinstance(decorator, ast.Attribute) and decorator.attr == 'overload':
+            return True
+    return False
+
+def _union_members(node):
+    """Returns the list of ast nodes that are the members of a union
+    annotation, ``Union[A, B]``, ``Optional[A]`` or ``A | B``, otherwise [node]."""
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr):
+        return _union_members(node.left) + _union_members(node.right)
+    if isinstance(node, ast.Subscript):
+        name = ast.unparse(node.value)
+        if name in ('Union', 'typing.Union'):
+            if isinstance(node.slice, ast.Tuple):
+                return list(node.slice.elts)
+            return [node.slice]
+        if name in ('Optional', 'typing.Optional'):
+            return [node.slice, ast.Constant(value=None)]
+    return [node]
+
+def _annotation_class(node):
+    """Returns the class of a member of an annotation, for a generic such as
+    ``list[int]`` the class of ``list``. None if it is not known."""
+    if isinstance(node, ast.Constant) and node.value is None:
+        return type(None)
+    if isinstance(node, ast.Subscript):
+        node = node.value
+    if not isinstance(node, (ast.Name, ast.Attribute)):
+        return None
+    name = ast.unparse(node)
+    for prefix in ANNOTATION_MODULES:
+        if name.startswith(prefix):
+            name = name[len(prefix):]
+            break
+    try:
+        return ANNOTATION_CLASSES[name]
+    except KeyError:
+        pass
+    cls = getattr(builtins, name, None)
+    if isinstance(cls, type):
+        return cls
+    return None
+
+def _is_typing_expression(text):
+    """Returns True if the text can be used as an annotation in a stub file.
+    This is not so for the str() of ``types.Type`` such as ``'list([int])'``."""
+    try:
+        tree = ast.parse(text, mode='eval')
+    except SyntaxError:
+        return False
+    for node in ast.walk(tree):
+        if not isinstance(node, TYPING_EXPRESSION_NODES):
+            return False
+        if isinstance(node, ast.BinOp) and not isinstance(node.op, ast.BitOr):
+            return False
+    return True
+
+def _accepts(cls, member_classes):
+    """Returns True if any of the member classes accepts the class cls."""
+    for member_class in member_classes:
+        if issubclass(cls, member_class) or cls in NUMERIC_TOWER.get(member_class, ()):
+            return True
+    return False
+
+def _union_str(members):
+    if len(members) == 1:
+        return members[0]
+    return 'Union[{:s}]'.format(', '.join(members))
+
+def _iter_functions(body, namespace_stack):
+    """Generates (namespace, FunctionDef node) for the functions in the body of
+    a module or class, recursing into classes."""
+    for node in body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            yield '.'.join(namespace_stack), node
+        elif isinstance(node, ast.ClassDef):
+            yield from _iter_functions(node.body, namespace_stack + [node.name])
+
+def argument_annotation_edit(source, offsets, arg, annotation):
+    """Returns the edit ``(start, end, replacement)`` that annotates an
+    ast.arg that has no annotation. A default gets PEP 8 spacing so
+    ``a=1`` becomes ``a: int = 1``.
+
+    :param source: The source code.
+    :type source: ``str``
+
+    :param offsets: The line offsets of the source.
+    :type offsets: ``typin.source_edits.LineOffsets``
+
+    :param arg: The argument.
+    :type arg: ``ast.arg``
+
+    :param annotation: The annotation.
+    :type annotation: ``str``
+
+    :return: ``tuple([int, int, str])`` -- The edit.
+    """
+    start = end = offsets.node_end(arg)
+    replacement = ': {:s}'.format(annotation)
+    while source[end] in ' \t':
+        end += 1
+    if source[end] == '=':
+        end += 1
+        while source[end] in ' \t':
+            end += 1
+        replacement += ' = '
+    else:
+        end = start
+    return start, end, replacement
+
+def return_annotation_edit(source, offsets, colons, node, annotation):
+    """Returns the edit ``(start, end, replacement)`` that adds a return
+    annotation to a function that has none.
+
+    :param colons: The result of ``function_index.colon_positions(source)``.
+    :type colons: ``list([tuple([int, int])])``
+
+    :param node: The function.
+    :type node: ``ast.FunctionDef, ast.AsyncFunctionDef``
+
+    Other parameters are as argument_annotation_edit().
+
+    :return: ``tuple([int, int, str])`` -- The edit.
+    """
+    index = bisect.bisect_left(colons, (node.lineno, node.col_offset))
+    offset = offsets.char_offset(*colons[index])
+    # Back up to just after the closing parenthesis.
+    while source[offset - 1] != ')':
+        offset -= 1
+    return offset, offset, ' -> {:s}'.format(annotation)
+
+class _StubMerger:
+    """Merges one stub file, this accumulates the edits and counts."""
+    def __init__(self, stub_text):
+        try:
+            self.tree = ast.parse(stub_text)
+        except SyntaxError as err:
+            raise StubMergeException('Can not parse stub: {:s}'.format(str(err)))
+        self.stub_text = stub_text
+        self.offsets = source_edits.LineOffsets(stub_text)
+        self.colons = None
+        self.edits = []
+        self.added = 0
+        self.widened = 0
+
+    def _widen(self, annotation_node, observed):
+        """Adds an edit to widen the annotation if it does not accept all of
+        the set of observed ``types.Type``. Observed types that can not be
+        written as a typing expression are left out."""
+        members = _union_members(annotation_node)
+        existing = set(ast.unparse(m) for m in members)
+        if existing & UNIVERSAL_ANNOTATIONS:
+            return
+        member_classes = [cls for cls in (_annotation_class(m) for m in members) if cls is not None]
+        missing = set()
+        for t in observed:
+            cls = t.base_class()
+            if _accepts(cls, member_classes) or cls.__name__ in existing or cls.__qualname__ in existing:
+                continue
+            annotation = t.annotation_str()
+            if _normalise(annotation) not in existing and _is_typing_expression(annotation):
+                missing.add(annotation)
+        if len(missing) == 0:
+            return
+        member_strs = []
+        for member in members:
+            segment = ast.get_source_segment(self.stub_text, member)
+            member_strs.append(segment if segment is not None else ast.unparse(member))
+        self.edits.append((
+            self.offsets.node_start(annotation_node),
+            self.offsets.node_end(annotation_node),
+            _union_str(member_strs + sorted(missing)),
+        ))
+        self.widened += 1
+
+    def _merge_arguments(self, node, fts):
+        for arg in node.args.posonlyargs + node.args.args + node.args.kwonlyargs:
+            if arg.arg == fts.SELF or arg.arg not in fts.arguments:
+                continue
+            if arg.annotation is None:
+                self.edits.append(argument_annotation_edit(
+                    self.stub_text, self.offsets, arg,
+                    _union_str(fts.annotation_strings(fts.arguments[arg.arg]))
+                ))
+                self.added += 1
+            else:
+                self._widen(arg.annotation, fts.arguments[arg.arg])
+
+    def _colons(self):
+        if self.colons is None:
+            self.colons = function_index.colon_positions(self.stub_text)
+        return self.colons
+
+    def _merge_return(self, node, fts):
+        if node.returns is None:
+            self.edits.append(return_annotation_edit(
+                self.stub_text, self.offsets, self._colons(), node, fts.return_annotation()
+            ))
+            self.added += 1
+        elif fts.generator_kind is None and not fts.return_unknown:
+            observed = set()
+            for type_set in fts.return_types.values():
+                observed |= type_set
+            if len(observed) == 0:
+                observed.add(types.Type(None))
+            self._widen(node.returns, observed)
+
+    def merge(self, file_map):
+        for namespace, node in _iter_functions(self.tree.body, []):
+            try:
+                fts = file_map[namespace][node.name]
+            except KeyError:
+                continue
+            if _is_overload(node) or fts.num_entry_points == 0:
+                # Hand written @overload variants are left alone.
+                continue
+            self._merge_arguments(node, fts)
+            self._merge_return(node, fts)
+        return MergeResult(
+            source_edits.apply_edits(self.stub_text, self.edits), self.added, self.widened
+        )
+
+def merge_stub(stub_text, file_map):
+    """Merges the observed types into the text of a stub file.
+
+    :param stub_text: The existing stub file contents.
+    :type stub_text: ``str``
+
+    :param file_map: The types observed for the source file, this is a value
+        of ``TypeInferencer.function_map`` i.e.
+        ``{ namespace : { function_name : FunctionTypes, ...}, ...}``
+    :type file_map: ``dict``
+
+    :return: The merged text and the number of annotations added and widened.
+    :rtype: ``MergeResult``
+
+    :raises: ``StubMergeException`` If the stub can not be parsed.
+    """
+    return _StubMerger(stub_text).merge(file_map)
@@ -4,6 +4,8 @@ Created on 22 Jun 2017
 @author: paulross
 """
 import collections
+import collections.abc
+import dis
 import gc
 import inspect
 import logging
@@ -11,10 +13,19 @@ import os
 import pprint
 import re
 import sys
+import time
 import traceback
 
-# from typin import str_id_cache
+from typin import function_index
+from typin import interval_tree
+from typin import snapshot
+from typin import str_id_cache
 from typin import types
+from typin.deferred import DeferredRecorder
+from typin.event_log import CodeEntry, EventLog
+from typin.event_log import KIND_CALL, KIND_EXCEPTION, KIND_LINE, KIND_RESUME, KIND_RETURN, KIND_YIELD
+from typin.event_log import NO_FINGERPRINT
+from typin.observation_store import ColumnarFunctionTypes, ObservationStore
 
 class TypeInferencerExceptionBase(Exception):
     """Base class for exceptions thrown by this module."""
@@ -32,6 +43,31 @@ RE_DECORATOR = re.compile(r'\s*@(\S+)\s*')
 RE_FUNCTION = re.compile(r'\s*def\s+(\S+)\((.*)')
 RE_METHOD = re.compile(r'\s*def\s+(\S+)\(self(.*)')
 
+#: Opcodes where a generator frame is suspended when we see a 'return' event.
+YIELD_OPCODES = frozenset(dis.opmap[name] for name in ('YIELD_VALUE', 'YIELD_FROM') if name in dis.opmap)
+#: Python 3.11+ has a RESUME opcode at the start of a function and after each
+#: yield or await, its argument is 0 only at the start of the function.
+RESUME_OPCODE = dis.opmap.get('RESUME')
+
+def is_resumption(frame):
+    """Returns True if a 'call' event for this generator or coroutine frame is
+    a resumption after a yield or await rather than the initial call."""
+    lasti = frame.f_lasti
+    if lasti < 0:
+        # Before Python 3.11 the initial call has not executed anything.
+        return False
+    co_code = frame.f_code.co_code
+    if co_code[lasti] == RESUME_OPCODE:
+        return co_code[lasti + 1] & 3 != 0
+    # Resumption with throw() or close().
+    return True
+
+def is_yield(frame):
+    """Returns True if a 'return' event for this generator or coroutine frame
+    is a yield or await rather than the final return."""
+    lasti = frame.f_lasti
+    return lasti >= 0 and frame.f_code.co_code[lasti] in YIELD_OPCODES
+
 #: This is to hold exception data while we decide whether the exception is
 #: caught within a function (then we don't record the function as raising or
 #: propagating the exception) or not. See research.rst 2017-11-16 and 18.
@@ -41,6 +77,96 @@ ExceptionInProgress = collections.namedtuple(
     'ExceptionInProgress', 'filename function lineno exception_value eventno'
 )
 
+#: Where the events of a code object are recorded, see
+#: TypeInferencer._bind_code(). func_types is None if the events are ignored.
+#: settled is True if the events first get the cheap check of a function
+#: loaded from a baseline. file_id and q_name_id are the IDs of file_path and
+#: q_name in TypeInferencer.names.
+CodeBinding = collections.namedtuple(
+    'CodeBinding', 'func_types file_path namespace q_name settled file_id q_name_id'
+)
+
+class PhaseTimer:
+    """Accumulates the time taken by each phase of handling an event with
+    ``time.perf_counter_ns()``. start() is called at the start of the event
+    then lap() at the end of each phase."""
+    def __init__(self, phases):
+        # dict of {phase : nanoseconds, ...}
+        self.phase_ns = dict.fromkeys(phases, 0)
+        # Number of events timed.
+        self.samples = 0
+        self._start = 0
+
+    def start(self):
+        self.samples += 1
+        self._start = time.perf_counter_ns()
+
+    def lap(self, phase):
+        now = time.perf_counter_ns()
+        self.phase_ns[phase] += now - self._start
+        self._start = now
+
+class _NullPhaseTimer:
+    """Used for the events that are not timed."""
+    def start(self):
+        pass
+
+    def lap(self, phase):
+        pass
+
+_NULL_PHASE_TIMER = _NullPhaseTimer()
+
+class FunctionMap(collections.abc.MutableMapping):
+    """The function types by file path, namespace and function name. This is
+    a view of dicts keyed by the integer IDs of those names in a
+    ``str_id_cache.StringIdCache`` so that each name is held once::
+
+        {file_path : { namespace : { function_name : FunctionTypes, ...}, ...}
+
+    The values of the outer levels are also FunctionMap views. Setting a value
+    that is a dict keyed by names copies it into the dicts keyed by ID."""
+    def __init__(self, data, names, levels=3):
+        # dict of {name_id : value, ...}
+        self._data = data
+        self._names = names
+        # Number of levels of dicts, including this one.
+        self._levels = levels
+
+    def _id_keyed(self, value, levels):
+        """Returns the dict keyed by ID of a value to be set at a level."""
+        if levels == 0:
+            return value
+        if isinstance(value, FunctionMap):
+            return value._data
+        return {self._names.id(k) : self._id_keyed(v, levels - 1) for k, v in value.items()}
+
+    def __getitem__(self, name):
+        name_id = self._names.get(name)
+        if name_id is None or name_id not in self._data:
+            raise KeyError(name)
+        if self._levels > 1:
+            return FunctionMap(self._data[name_id], self._names, self._levels - 1)
+        return self._data[name_id]
+
+    def __setitem__(self, name, value):
+        self._data[self._names.id(name)] = self._id_keyed(value, self._levels - 1)
+
+    def __delitem__(self, name):
+        name_id = self._names.get(name)
+        if name_id is None or name_id not in self._data:
+            raise KeyError(name)
+        del self._data[name_id]
+
+    def __iter__(self):
+        name = self._names.name
+        return (name(name_id) for name_id in list(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return '{:s}({!r:s})'.format(type(self).__name__, dict(self))
+
 # TODO: How to create the taxonomy? collections.abc [Python3]?
 
 class TypeInferencer(object):
@@ -60,7 +186,23 @@ class TypeInferencer(object):
     FALSE_FUNCTION_NAMES = set(['<dictcomp>', '<genexpr>', '<listcomp>', '<module>', '<setcomp>'])
     DOCSTRING_STYLE_DEFAULT = 'sphinx'
     DOCSTRING_STYLES_AVAILABLE = types.FunctionTypes.DOCSTRING_STYLES_AVAILABLE
-    def __init__(self, trace_frame_event=False, events_to_trace=None):
+    # Phases of handling an event that are timed, see stats().
+    PHASE_RESOLUTION = 'resolution'
+    PHASE_BASES = 'bases'
+    PHASE_TYPES = 'types'
+    PHASE_RECORD = 'record'
+    PHASE_LOGGING = 'logging'
+    PHASE_EXCEPTIONS = 'exceptions'
+    PHASES = (PHASE_RESOLUTION, PHASE_BASES, PHASE_TYPES, PHASE_RECORD, PHASE_LOGGING, PHASE_EXCEPTIONS)
+    # Every PROFILE_SAMPLE_INTERVAL'th event is timed by phase.
+    PROFILE_SAMPLE_INTERVAL = 64
+    # The binding of code whose events are not recorded.
+    IGNORED_CODE = CodeBinding(None, '', GLOBAL_NAMESPACE, '', False, None, None)
+    # Number of files and functions with the most events in stats_report().
+    STATS_REPORT_TOP = 10
+    def __init__(self, trace_frame_event=False, events_to_trace=None, widen_threshold=None,
+                 asyncio_aware=False, baseline=None, verbose=None, deferred=False,
+                 event_log=None, columnar=False):
         """Constructor, initialises internal state.
 
         trace_frame_event - Verbose reporting of frame events for trace/debug which can be set
@@ -68,13 +210,57 @@ class TypeInferencer(object):
 
         events_to_trace - List of events to trace, None means all.
 
+        widen_threshold - Size above which a set of argument or return types is
+            collapsed to a common type. None is the types.FunctionTypes default,
+            0 disables widening.
+
+        asyncio_aware - If True then exceptions in flight are tracked per frame
+            rather than globally. This is needed when coroutines suspend and
+            resume across interleaved tasks.
+
+        baseline - A snapshot of a previous run, see load_baseline(), or None.
+
+        verbose - If True the trace function reports events with
+            trace_frame_event and logs each event at DEBUG level. If False
+            the trace function has no diagnostics at all. None means True if
+            trace_frame_event is set or logging is at DEBUG level now. This
+            is fixed for the lifetime of this object.
+
+        deferred - If True, or a ``deferred.DeferredRecorder``, then the trace
+            function only takes a shallow snapshot of each value and the types
+            are created on a background thread, see ``typin.deferred``. This
+            reduces the latency added to each traced call. Observations are
+            dropped if the background thread falls behind, see stats().
+            Functions loaded from a baseline are not given the settled check.
+
+        event_log - A ``event_log.EventLog``, or the path to create one, or
+            None. If given the trace function only appends a record of each
+            event to the log and nothing is recorded until
+            process_event_log() is called after tracing, see
+            ``typin.event_log``. This takes precedence over verbose and
+            deferred.
+
+        columnar - If True the observations are recorded in the columns of an
+            ``observation_store.ObservationStore``, self.store, rather than
+            in a ``types.FunctionTypes`` for each function. The values of
+            function_map record into the store and otherwise behave as
+            ``types.FunctionTypes`` built from it.
+
         See also some hard coded trace controls::
 
             self._trace_flag
             self._trace_non_tracked_events
         """
-        # dict of {file_path : { namespace : { function_name : FunctionTypes, ...}, ...}
-        self.function_map = {}
+        # Interned file paths, namespaces, function names and qualified names
+        # and, with columnar, type names. The functions are keyed by these IDs.
+        self.names = str_id_cache.StringIdCache()
+        # dict of {file_id : { namespace_id : { function_name_id : FunctionTypes, ...}, ...}
+        self._functions = {}
+        # A view of self._functions keyed by name, see function_map.
+        self._function_map = FunctionMap(self._functions, self.names)
+        # With columnar the store of all the observations, otherwise None.
+        # This shares self.names.
+        self.store = ObservationStore(widen_threshold, self.names) if columnar else None
         # TODO: Record if the function is a generator/co-routine by observing StopIteration?
         # Bases classes of a class from __bases__
         # dict of {file_path : { namespace : (__bases__, ...), ...}
@@ -87,61 +273,178 @@ class TypeInferencer(object):
         self.trace_frame_event = trace_frame_event
         # List of events to trace, None means all.
         self.events_to_trace = events_to_trace
+        # Passed to each types.FunctionTypes
+        self.widen_threshold = widen_threshold
+        # Cache of generator kind detected from the code object flags.
+        # dict of {code_object : types.FunctionTypes.KIND_... or None, ...}
+        self._generator_kinds = {}
+        # Generator frames that have been closed with GeneratorExit, the
+        # following 'return' event is neither a yield nor a return value.
+        self._generators_exiting = set()
+        # Cache of function resolution from _qualified_name_bases_signature()
+        # dict of {code_object : (qualified_name, bases, signature), ...}
+        self._code_resolutions = {}
+        # The record of the function of each code object that has been seen
+        # while tracing. This is cleared when tracing stops as function_map
+        # can then be changed.
+        # dict of {code_object : CodeBinding, ...}
+        self._code_bindings = {}
+        # Line interval trees for function_at() and functions_in_range(), these
+        # are rebuilt if a function has been added, removed or its line range
+        # has changed since they were built. Functions can be recorded without
+        # any event, see ``typin.recording``.
+        # dict of {file_path : (spans, interval_tree.IntervalTree), ...}
+        self._interval_trees = {}
         # Deferred evaluation of exceptions to exclude spurious
         # return None events
         # This is a ExceptionInProgress object or None
         self.exception_in_progress = None
+        self.asyncio_aware = asyncio_aware
+        # With asyncio_aware this is used instead of self.exception_in_progress
+        # dict of {frame : ExceptionInProgress, ...}
+        self.exceptions_in_progress = {}
         # Event number for checking exceptions
         self.eventno = 0
         # Event counters for different events, for the curious
         self.event_counter = collections.Counter()
+        # Call, return and exception events by file and by function, the
+        # keys are IDs in self.names, see stats() for these by name.
+        # Counter of {file_id : count, ...}
+        self.file_event_counter = collections.Counter()
+        # Counter of {(file_id, qualified_name_id) : count, ...}
+        self.function_event_counter = collections.Counter()
+        # Hits and misses of self._code_bindings by call, return and exception events.
+        self._code_resolution_hits = 0
+        self._code_resolution_misses = 0
+        # Events handled by the cheap check of a settled function.
+        self._settled_events = 0
+        # Time by phase of a sample of the events, see stats().
+        self._phase_timer = PhaseTimer(self.PHASES)
+        # Events not handled by the settled check, for sampling.
+        self._profile_eventno = 0
         # Used for trace/debug, manually set this when necessary.
         # This makes multiple reports, see self._trace(), self._debug() etc.
         self._trace_flag = False
         # This adds even more verbose event tracking as it set sys.setprofile(...)
         # which responds to c_call and c_return events.
         self._trace_non_tracked_events = False
+        if verbose is None:
+            verbose = self.trace_frame_event or self._trace_flag \
+                or logging.getLogger().isEnabledFor(logging.DEBUG)
+        self._verbose = verbose
+        # The trace function, this is a bound method that is given to
+        # sys.settrace() and returns itself as the local trace function.
+        if isinstance(event_log, str):
+            event_log = EventLog(event_log)
+        self._event_log = event_log
+        # With an event log this is the cache of code objects.
+        # dict of {code_object : (code_id or None, generator_kind), ...}
+        self._event_log_codes = {}
+        # With an event log this has the frames with an exception in flight.
+        # dict of {frame : line_number, ...}
+        self._event_log_exceptions = {}
+        # With an event log the activation_id of each frame that has not yet
+        # returned. dict of {frame : activation_id, ...}
+        self._event_log_activations = {}
+        self._event_log_activation_count = 0
+        if self._event_log is not None:
+            self._handler = self._call_event_log
+        elif self._verbose:
+            self._handler = self._call_verbose
+        else:
+            self._handler = self._call_fast
+        # Records the types on a background thread, or None.
+        if deferred is True:
+            deferred = DeferredRecorder()
+        self._deferred = deferred or None
+        # Frames whose 'call' was dropped by self._deferred so that the
+        # 'return' or 'exception' is also dropped.
+        self._dropped_call_frames = set()
+        if baseline is not None:
+            self.load_baseline(baseline)
+
+    def load_baseline(self, snap):
+        """Pre-populates the function types from a snapshot of a previous run,
+        see ``typin.snapshot``. These functions are marked as settled so that
+        while tracing their calls and returns only get a cheap check of the
+        classes of the values. Only those not seen before, and a sparse
+        sample of the rest, are recorded in full. The classes of the loaded
+        types count as seen, see ``FunctionTypes.seed_fingerprints()``.
+        Functions already known are left alone.
+
+        :param snap: The snapshot, for example from ``typin.snapshot.load()``.
+        :type snap: ``dict``
+
+        :return: ``int`` -- The number of functions loaded.
+        """
+        # Existing bindings might not be to the loaded functions.
+        self._code_bindings.clear()
+        count = 0
+        name_id = self.names.id
+        for file_path in snap:
+            file_map = self._functions.setdefault(name_id(file_path), {})
+            for namespace in snap[file_path]:
+                namespace_map = file_map.setdefault(name_id(namespace), {})
+                for function_name, function_snap in snap[file_path][namespace].items():
+                    function_name_id = name_id(function_name)
+                    if function_name_id not in namespace_map:
+                        namespace_map[function_name_id] = snapshot.function_types(
+                            function_snap, self.widen_threshold
+                        )
+                        count += 1
+        return count
+
+    @property
+    def function_map(self):
+        """The ``FunctionMap`` of::
+
+            {file_path : { namespace : { function_name : FunctionTypes, ...}, ...}
+        """
+        return self._function_map
 
     def dump(self, stream=sys.stdout):
         """Dump the internal representation to a stream."""
-        stream.write(' TypeInferencer.dump() '.center(75, '='))
-        stream.write('\n')
-        stream.write(' self.function_map '.center(75, '-'))
-        stream.write('\n')
+        stream.writelines(self.iter_dump())
+
+    def iter_dump(self):
+        """Generates the internal representation as a sequence of strings
+        for writing to a stream, one function at a time."""
+        yield ' TypeInferencer.dump() '.center(75, '=')
+        yield '\n'
+        yield ' self.function_map '.center(75, '-')
+        yield '\n'
         # dict of {file_path : { namespace : { function_name : FunctionTypes, ...}, ...}
         for file_path in sorted(self.function_map.keys()):
-            stream.write('File: {:s}\n'.format(file_path))
+            yield 'File: {:s}\n'.format(file_path)
             for namespace in sorted(self.function_map[file_path].keys()):
-                stream.write('  Namespace: "{:s}"\n'.format(namespace))
+                yield '  Namespace: "{:s}"\n'.format(namespace)
                 for function in sorted(self.function_map[file_path][namespace].keys()):
-                    stream.write(
-                        '    Function: "{:s}" {!r:s}\n'.format(
-                            function, self.function_map[file_path][namespace][function]
-                        )
+                    yield '    Function: "{:s}" {!r:s}\n'.format(
+                        function, self.function_map[file_path][namespace][function]
                     )
-        stream.write(' END: self.function_map '.center(75, '-'))
-        stream.write('\n')
-        stream.write(' self.class_bases '.center(75, '-'))
-        stream.write('\n')
+        yield ' END: self.function_map '.center(75, '-')
+        yield '\n'
+        yield ' self.class_bases '.center(75, '-')
+        yield '\n'
         # dict of {file_path : { namespace : (__bases__, ...), ...}
         for file_path in sorted(self.class_bases.keys()):
             non_global_ns = [ns for ns in self.class_bases[file_path].keys()
                              if ns != self.GLOBAL_NAMESPACE]
             if len(non_global_ns):
-                stream.write(file_path)
-                stream.write('\n')
+                yield file_path
+                yield '\n'
                 for ns in sorted(non_global_ns):
                     if ns != self.GLOBAL_NAMESPACE:
-                        stream.write('{:s}{:s}: {!r:s}'.format(
+                        yield '{:s}{:s}: {!r:s}'.format(
                            self.INDENT,
                            ns,
-                           self.class_bases[file_path][ns]),
+                           self.class_bases[file_path][ns],
                         )
-                        stream.write('\n')
-        stream.write(' END: self.class_bases '.center(75, '-'))
-        stream.write('\n')
-        stream.write(' END: TypeInferencer.dump() '.center(75, '='))
-        stream.write('\n')
+                        yield '\n'
+        yield ' END: self.class_bases '.center(75, '-')
+        yield '\n'
+        yield ' END: TypeInferencer.dump() '.center(75, '=')
+        yield '\n'
 
     def file_paths(self):
         """Returns the file paths seen as a dict keys object."""
@@ -173,6 +476,86 @@ class TypeInferencer(object):
             ret_val = [(v, v[len(abs_path)+1:]) for v in ret_val]
         return ret_val
 
+    def _interval_tree(self, file_path):
+        """Returns the IntervalTree of line ranges of the functions in the file.
+        Each interval spans the lines seen when tracing and, if the source can
+        be parsed, the whole function declaration.
+
+        :raises: ``KeyError`` If file_path is unknown.
+        """
+        spans = self._function_spans(file_path)
+        try:
+            cached_spans, tree = self._interval_trees[file_path]
+        except KeyError:
+            pass
+        else:
+            if cached_spans == spans:
+                return tree
+        index = function_index.function_index(file_path)
+        intervals = []
+        for namespace, function_name, fts, begin, end in spans:
+            location = index.function_at(fts.line_decl) if index is not None else None
+            if location is not None:
+                begin = min(begin, location.start_lineno)
+                end = max(end, location.end_lineno)
+            intervals.append((begin, end, (namespace, function_name)))
+        tree = interval_tree.IntervalTree(intervals)
+        self._interval_trees[file_path] = (spans, tree)
+        return tree
+
+    def _function_spans(self, file_path):
+        """Returns a list of ``(namespace, function_name, FunctionTypes, begin, end)``
+        of the line ranges seen of the functions in the file with entry points.
+
+        :raises: ``KeyError`` If file_path is unknown.
+        """
+        spans = []
+        for namespace, function_map in self.function_map[file_path].items():
+            for function_name, fts in function_map.items():
+                if fts.num_entry_points:
+                    spans.append((namespace, function_name, fts) + fts.line_range)
+        return spans
+
+    def function_at(self, file_path, lineno):
+        """Returns the functions seen in the file whose span includes the line
+        as a list of ``(namespace, function_name)``. Nested functions mean that
+        there can be more than one, the innermost is first.
+
+        :param file_path: Path to the source file.
+        :type file_path: ``str``
+
+        :param lineno: Line number starting at 1.
+        :type lineno: ``int``
+
+        :return: ``list([tuple([str, str])])`` -- Functions that span the line.
+
+        :raises: ``KeyError`` If file_path is unknown.
+        """
+        intervals = self._interval_tree(file_path).at(lineno)
+        intervals.sort(key=lambda i: (i[1] - i[0], -i[0]))
+        return [value for _begin, _end, value in intervals]
+
+    def functions_in_range(self, file_path, first_lineno, last_lineno):
+        """Returns the functions seen in the file whose span overlaps the
+        inclusive range of lines as a list of ``(namespace, function_name)``
+        in the order of their declaration.
+
+        :param file_path: Path to the source file.
+        :type file_path: ``str``
+
+        :param first_lineno: First line number starting at 1.
+        :type first_lineno: ``int``
+
+        :param last_lineno: Last line number, inclusive.
+        :type last_lineno: ``int``
+
+        :return: ``list([tuple([str, str])])`` -- Functions that overlap the range.
+
+        :raises: ``KeyError`` If file_path is unknown.
+        """
+        intervals = self._interval_tree(file_path).overlapping(first_lineno, last_lineno)
+        return [value for _begin, _end, value in intervals]
+
 #     def file_paths_cwd(self, relative=False):
 #         """Returns a list of file paths seen that are below the current
 #         working directory."""
@@ -216,12 +599,21 @@ class TypeInferencer(object):
             base_str = ''
         return '{:s}class {:s}{:s}:'.format(prefix, class_name_stack[-1], base_str)
 
-    def _pformat_file(self, file_path, add_line_number_as_comment):
+    def _pformat_file(self, file_path, add_line_number_as_comment, use_overloads=False):
         """
         Pretty format all the known classes and functions in the particular file.
-        Returns a list of lines.
+        Returns a list of lines, see _iter_pformat_file().
 
-        This uses types.FunctionTypes.stub_file_str() for each function.
+        :returns: ``list[str]`` -- List of pretty formatted lines.
+        """
+        return list(self._iter_pformat_file(file_path, add_line_number_as_comment, use_overloads))
+
+    def _iter_pformat_file(self, file_path, add_line_number_as_comment, use_overloads=False):
+        """
+        Pretty format all the known classes and functions in the particular file.
+        Generates the lines without line endings.
+
+        This uses types.FunctionTypes.stub_file_strs() for each function.
 
         :param file_path: File path to access map of
             ``{ namespace : { function_name : FunctionTypes, ...}``
@@ -231,12 +623,15 @@ class TypeInferencer(object):
             ``def category(unit: bytes) -> bytes: ...#688``
         :type add_line_number_as_comment: ``bool``
 
-        :returns: ``list[str]`` -- List of pretty formatted lines.
+        :param use_overloads: Flag to write ``@overload`` variants for functions
+            where types.FunctionTypes.overloads() is non-empty.
+        :type use_overloads: ``bool``
+
+        :returns: ``generator(str)`` -- Pretty formatted lines.
         """
         # file_map is { namespace : { function_name : FunctionTypes, ...}
         file_map = self.function_map[file_path]
 #         pprint.pprint(file_map)
-        str_list = []
         for namespace in sorted(file_map.keys()):
             prefix = ''
             if namespace != self.GLOBAL_NAMESPACE:
@@ -255,24 +650,19 @@ class TypeInferencer(object):
                 # Now write out all the enclosing empty classes
                 while i < len(namespace_stack) - 1:
                     prefix = self.INDENT * i
-                    str_list.append(self._pformat_class_line(file_path, prefix,
-                                                             namespace_stack[:i+1],
-                                                             ))
+                    yield self._pformat_class_line(file_path, prefix,
+                                                   namespace_stack[:i+1],
+                                                   )
                     i += 1
                 # Continue with this base class
                 prefix = self.INDENT * (len(namespace_stack) - 1)
-                str_list.append(self._pformat_class_line(file_path, prefix,
-                                                         namespace_stack))
+                yield self._pformat_class_line(file_path, prefix,
+                                               namespace_stack)
                 prefix += self.INDENT
             for function_name in sorted(file_map[namespace]):
                 fts = file_map[namespace][function_name]
                 try:
-                    str_list.append('{:s}def {:s}{:s}'.format(
-                        prefix,
-                        function_name,
-                        fts.stub_file_str()
-                        )
-                    )
+                    stub_strs = fts.stub_file_strs(use_overloads)
                 except types.TypesExceptionBase as err:
                     logging.error(
                         'Could not get stub_file_str, namespace: {:s}, function: {:s}, error: {!r:s}: {:s}'.format(
@@ -285,14 +675,21 @@ class TypeInferencer(object):
                             lineno = fts.line_range[0]
                         except types.FunctionTypesExceptionNoData:
                             lineno = -1
-                        str_list[-1] = str_list[-1] + '#{:d}'.format(lineno)
-        return str_list
+                        suffix = '#{:d}'.format(lineno)
+                    else:
+                        suffix = ''
+                    for stub_str in stub_strs:
+                        if len(stub_strs) > 1:
+                            yield '{:s}@overload'.format(prefix)
+                        yield '{:s}def {:s}{:s}{:s}'.format(
+                            prefix, function_name, stub_str, suffix
+                        )
 
-    def pretty_format(self, file=None, add_line_number_as_comment=False):
+    def pretty_format(self, file=None, add_line_number_as_comment=False, use_overloads=False):
         """
         Returns a pretty formatted string, this is the same as the stub file contents.
 
-        This uses types.FunctionTypes.stub_file_str() for each function.
+        This uses types.FunctionTypes.stub_file_strs() for each function.
 
         :param file_path: File path to access map of
             ``{ namespace : { function_name : FunctionTypes, ...}``
@@ -303,19 +700,47 @@ class TypeInferencer(object):
             ``def category(unit: bytes) -> bytes: ...#688``
         :type add_line_number_as_comment: ``bool``
 
+        :param use_overloads: Flag to write ``@overload`` variants where the
+            observed argument types determine the return types.
+        :type use_overloads: ``bool``
+
         :returns: ``str`` -- Stub files contents for each file.
         """
-        str_list = []
+        return '\n'.join(self.iter_pretty_format(file, add_line_number_as_comment, use_overloads))
+
+    def iter_pretty_format(self, file=None, add_line_number_as_comment=False, use_overloads=False):
+        """
+        As pretty_format() but generates the lines, without line endings, so
+        that all files can be processed in bounded memory.
+
+        :returns: ``generator(str)`` -- Stub files lines for each file.
+        """
         # {file_path : { namespace : { function_name : FunctionTypes, ...}, ...}
         if file is None:
-            for file_path in sorted(self.function_map.keys()):
-                if len(str_list):
-                    str_list.append('')
-                str_list.append('File: {:s}'.format(file_path))
-                str_list.extend(self._pformat_file(file_path, add_line_number_as_comment))
+            for i, file_path in enumerate(sorted(self.function_map.keys())):
+                if i:
+                    yield ''
+                yield 'File: {:s}'.format(file_path)
+                yield from self._iter_pformat_file(file_path, add_line_number_as_comment,
+                                                   use_overloads)
         else:
-            str_list.extend(self._pformat_file(file, add_line_number_as_comment))
-        return '\n'.join(str_list)
+            yield from self._iter_pformat_file(file, add_line_number_as_comment, use_overloads)
+
+    def write_pretty_format(self, stream, file=None, add_line_number_as_comment=False,
+                            use_overloads=False):
+        """
+        Writes the pretty format to a stream, each line is terminated with a
+        newline. Memory use is bounded by the size of the largest function.
+        Returns the number of lines written.
+
+        :returns: ``int`` -- Number of lines written.
+        """
+        count = 0
+        for line in self.iter_pretty_format(file, add_line_number_as_comment, use_overloads):
+            stream.write(line)
+            stream.write('\n')
+            count += 1
+        return count
 
     def stub_file_str(self, file_path, namespace, function_name):
         fts = self.function_types(file_path, namespace, function_name)
@@ -362,28 +787,202 @@ class TypeInferencer(object):
                     line_docs[lineno] = (namespace, function_name, docstring)
         return line_docs
 
-    def _get_func_data(self, file_path, qualified_name, signature):
+    def _get_func_data(self, file_path, qualified_name, signature, generator_kind=None):
         """
         Return a FunctionTypes() object for the function, created if necessary.
         """
-        if file_path not in self.function_map:
-            self.function_map[file_path] = {}
-        # Compute namespace hierarchy
+        namespace, function_name = self._split_qualified_name(qualified_name)
+        return self._function_types(file_path, namespace, function_name, signature, generator_kind)
+
+    def _split_qualified_name(self, qualified_name):
+        """Returns (namespace, function_name) from a qualified name."""
         hierarchy = qualified_name.split('.')
         assert len(hierarchy) > 0
         if len(hierarchy) == 1:
-            namespace = self.GLOBAL_NAMESPACE
-            function_name = hierarchy[0]
-        else:
-            namespace = '.'.join(hierarchy[:-1])
-            function_name = hierarchy[-1]
-        if namespace not in self.function_map[file_path]:
-            self.function_map[file_path][namespace] = {}
-        if function_name not in self.function_map[file_path][namespace]:
-            self.function_map[file_path][namespace][function_name] = types.FunctionTypes(signature)
-        r = self.function_map[file_path][namespace][function_name]
+            return self.GLOBAL_NAMESPACE, hierarchy[0]
+        return '.'.join(hierarchy[:-1]), hierarchy[-1]
+
+    def _function_types(self, file_path, namespace, function_name, signature, generator_kind):
+        """Return the FunctionTypes() object for the function in the
+        namespace, created if necessary."""
+        name_id = self.names.id
+        try:
+            file_map = self._functions[name_id(file_path)]
+        except KeyError:
+            file_map = self._functions[name_id(file_path)] = {}
+        try:
+            namespace_map = file_map[name_id(namespace)]
+        except KeyError:
+            namespace_map = file_map[name_id(namespace)] = {}
+        function_name_id = name_id(function_name)
+        try:
+            r = namespace_map[function_name_id]
+        except KeyError:
+            if self.store is None:
+                r = types.FunctionTypes(signature, self.widen_threshold, generator_kind)
+            else:
+                r = ColumnarFunctionTypes(
+                    self.store, self.store.add_function(file_path, namespace, function_name,
+                                                       signature, generator_kind)
+                )
+            namespace_map[function_name_id] = r
+        if r.signature is None:
+            # Loaded from a baseline.
+            r.signature = signature
         return r
 
+    def function_types_of(self, function, bases=None):
+        """Returns the FunctionTypes that records the calls of a function
+        object, created if necessary. This is for recording calls without
+        tracing, see ``typin.recording``.
+
+        :param function: The function.
+        :type function: ``function``
+
+        :param bases: For a method this is the ``__bases__`` of the class,
+            None if this is not known.
+        :type bases: ``tuple, NoneType``
+
+        :return: ``typin.types.FunctionTypes`` -- The record of the function.
+        """
+        code = function.__code__
+        file_path = os.path.abspath(code.co_filename)
+        q_name = self._strip_locals_from_qualified_name(function.__qualname__)
+        if bases is not None:
+            self._set_bases(file_path, code.co_firstlineno, q_name, bases)
+        return self._get_func_data(file_path, q_name, inspect.signature(function),
+                                   self._generator_kind(code))
+
+    def _bind_code(self, frame, timer):
+        """Returns the CodeBinding for the code of a frame, created and cached
+        on its first event. This resolves the function, records the bases of
+        its class and finds its FunctionTypes so that later events of the code
+        only need to look up the binding."""
+        code = frame.f_code
+        self._code_resolution_misses += 1
+        if self.RE_TEMPORARY_FILE.match(code.co_filename) or code.co_name in self.FALSE_FUNCTION_NAMES:
+            # Ignore these.
+            binding = self.IGNORED_CODE
+        else:
+            # Only look at 'real' files and functions
+            try:
+                q_name, bases, signature = self._code_resolutions[code]
+            except KeyError:
+                q_name, bases, signature = self._qualified_name_bases_signature(frame)
+                self._code_resolutions[code] = q_name, bases, signature
+            timer.lap(self.PHASE_RESOLUTION)
+            if q_name == '':
+                self._error('Could not find qualified name in code: {!r:s}'.format(code))
+                binding = self.IGNORED_CODE
+            else:
+                file_path = os.path.abspath(code.co_filename)
+                self._set_bases(file_path, frame.f_lineno, q_name, bases)
+                timer.lap(self.PHASE_BASES)
+                namespace, function_name = self._split_qualified_name(q_name)
+                func_types = self._function_types(file_path, namespace, function_name, signature,
+                                                  self._generator_kind(code))
+                settled = func_types.settled and func_types.generator_kind is None \
+                    and self._deferred is None
+                if settled:
+                    # So that the first call is checked against the baseline.
+                    func_types.seed_fingerprints(code.co_varnames[:code.co_argcount + code.co_kwonlyargcount])
+                binding = CodeBinding(
+                    func_types, file_path, namespace, q_name, settled,
+                    self.names.id(file_path), self.names.id(q_name),
+                )
+        self._code_bindings[code] = binding
+        timer.lap(self.PHASE_RESOLUTION)
+        return binding
+
+    def _generator_kind(self, code):
+        """Returns the kind of generator from the flags of the code object,
+        None for ordinary functions. This is cached per code object."""
+        try:
+            return self._generator_kinds[code]
+        except KeyError:
+            pass
+        flags = code.co_flags
+        if flags & inspect.CO_ASYNC_GENERATOR:
+            kind = types.FunctionTypes.KIND_ASYNC_GENERATOR
+        elif flags & inspect.CO_COROUTINE:
+            kind = types.FunctionTypes.KIND_COROUTINE
+        elif flags & inspect.CO_GENERATOR:
+            kind = types.FunctionTypes.KIND_GENERATOR
+        else:
+            kind = None
+        self._generator_kinds[code] = kind
+        return kind
+
+    def _add_yield(self, func_types, arg, lineno):
+        """Records a 'return' event that is a yield or await."""
+        if func_types.generator_kind == types.FunctionTypes.KIND_GENERATOR:
+            self._record_yield(func_types, arg, lineno)
+        elif func_types.generator_kind == types.FunctionTypes.KIND_ASYNC_GENERATOR \
+        and type(arg).__name__ == 'async_generator_wrapped_value':
+            # The yielded value is wrapped, the wrapper has no Python
+            # interface but the garbage collector can see inside it.
+            self._record_yield(func_types, gc.get_referents(arg)[0], lineno)
+        else:
+            # Suspension at an await, nothing to record apart from the line.
+            self._record_resume(func_types, lineno)
+
+    #---- Recording into a FunctionTypes now or deferred. ----
+    # When recording now the types.Type objects are constructed here,
+    # between laps of the timer, so that time is the types phase.
+    def _record_call(self, frame, func_types, frame_info, timer=_NULL_PHASE_TIMER):
+        arg_info = inspect.getargvalues(frame)
+        if self._deferred is None:
+            values = [arg_info.locals[arg] for arg in arg_info.args]
+            timer.lap(self.PHASE_RECORD)
+            arg_types = [types.Type(value) for value in values]
+            timer.lap(self.PHASE_TYPES)
+            func_types.add_call_types(
+                arg_info.args, arg_types, frame_info.filename, frame_info.lineno,
+                tuple(type(value) for value in values) if func_types.settled else None,
+            )
+        elif not self._deferred.submit_call(
+                    func_types, arg_info.args, [arg_info.locals[arg] for arg in arg_info.args],
+                    frame_info.filename, frame_info.lineno) \
+                and func_types.generator_kind is None:
+            self._dropped_call_frames.add(frame)
+
+    def _deferred_call_dropped(self, frame):
+        """Returns True if the 'call' of this frame was dropped, the caller
+        then drops the 'return' or 'exception'."""
+        if frame in self._dropped_call_frames:
+            self._dropped_call_frames.discard(frame)
+            self._deferred.drop()
+            return True
+        return False
+
+    def _record_return(self, frame, func_types, return_value, lineno, timer=_NULL_PHASE_TIMER):
+        if self._deferred is None:
+            timer.lap(self.PHASE_RECORD)
+            t = types.Type(return_value)
+            timer.lap(self.PHASE_TYPES)
+            func_types.add_return_type(t, lineno, type(return_value))
+        elif not self._deferred_call_dropped(frame):
+            self._deferred.submit_return(func_types, return_value, lineno)
+
+    def _record_exception(self, frame, func_types, exception, lineno):
+        if self._deferred is None:
+            func_types.add_exception(exception, lineno)
+        elif not self._deferred_call_dropped(frame):
+            self._deferred.submit_exception(func_types, exception, lineno)
+
+    def _record_yield(self, func_types, yield_value, lineno):
+        if self._deferred is None:
+            func_types.add_yield(yield_value, lineno)
+        else:
+            self._deferred.submit_yield(func_types, yield_value, lineno)
+
+    def _record_resume(self, func_types, lineno):
+        if self._deferred is None:
+            func_types.add_resume(lineno)
+        else:
+            self._deferred.submit_resume(func_types, lineno)
+    #---- END: Recording into a FunctionTypes now or deferred. ----
+
     def is_temporary_file(self, file_path):
         """
         Returns True if the file_path is to a temporary file such as '<string>'
@@ -397,7 +996,7 @@ class TypeInferencer(object):
         """classname including dotted scope."""
 #         print('_set_bases:', file_path, lineno, q_name, bases)
         parent_scope = '.'.join(q_name.split('.')[:-1])
-        if file_path not in self.function_map:
+        if file_path not in self.class_bases:
             self.class_bases[file_path] = {}
         if parent_scope not in self.class_bases[file_path]:
             self.class_bases[file_path][parent_scope] = bases
@@ -531,103 +1130,200 @@ class TypeInferencer(object):
             print(*args, flush=True)
         logging.error(*args)
 
-    def _assert_exception_propagates(self, event, arg, frame_info):
+    def _get_exception_in_progress(self, frame):
+        """Returns the ExceptionInProgress for the frame or None."""
+        if self.asyncio_aware:
+            return self.exceptions_in_progress.get(frame)
+        return self.exception_in_progress
+
+    def _set_exception_in_progress(self, frame, exception_in_progress):
+        """Sets the ExceptionInProgress for the frame, None clears it."""
+        if self.asyncio_aware:
+            if exception_in_progress is None:
+                self.exceptions_in_progress.pop(frame, None)
+            else:
+                self.exceptions_in_progress[frame] = exception_in_progress
+        else:
+            self.exception_in_progress = exception_in_progress
+
+    def _assert_exception_propagates(self, event, arg, frame_info, exception_in_progress):
         """Does some asserts when an exception is propagates from a function."""
         assert event == 'return', 'Event is "{!r:s}"'.format(event)
         assert arg is None, 'arg is {!r:s} instead of None'.format(arg)
-        assert self.exception_in_progress is not None, \
-            'self.exception_in_progress: {!r:s}'.format(self.exception_in_progress)
-        assert frame_info.filename == self.exception_in_progress.filename, \
+        assert exception_in_progress is not None, \
+            'exception_in_progress: {!r:s}'.format(exception_in_progress)
+        assert frame_info.filename == exception_in_progress.filename, \
             '"return": File name was {:s} now {:s}'.format(
-                self.exception_in_progress.filename, frame_info.filename
+                exception_in_progress.filename, frame_info.filename
             )
-        assert frame_info.function == self.exception_in_progress.function, \
+        assert frame_info.function == exception_in_progress.function, \
             '"return": Function was "{:s}" now "{:s}"'.format(
-                self.exception_in_progress.function, frame_info.function
+                exception_in_progress.function, frame_info.function
             )
-        assert frame_info.lineno == self.exception_in_progress.lineno, \
+        # With asyncio_aware the return may be from the line of an enclosing
+        # async with statement after __aexit__() has run.
+        assert self.asyncio_aware or frame_info.lineno == exception_in_progress.lineno, \
             '"return": Line number was {:d} now {:d}'.format(
-                self.exception_in_progress.lineno, frame_info.lineno
+                exception_in_progress.lineno, frame_info.lineno
             )
-        assert self.exception_in_progress.eventno == self.eventno - 1, \
+        # With asyncio other tasks, or __aexit__(), can run in between.
+        assert self.asyncio_aware or exception_in_progress.eventno == self.eventno - 1, \
             '"return": Event number was {:d}, expected {:d}'.format(
-                self.exception_in_progress.eventno, self.eventno - 1
+                exception_in_progress.eventno, self.eventno - 1
             )
 
-    def _assert_exception_caught(self, event, arg, frame_info):
+    def _assert_exception_caught(self, event, arg, frame_info, exception_in_progress):
         """Does some asserts when an exception is caught within a function."""
         assert event == 'line', 'Event is "{!r:s}"'.format(event)
-        assert self.exception_in_progress is not None, \
-            'self.exception_in_progress: {!r:s}'.format(self.exception_in_progress)
+        assert exception_in_progress is not None, \
+            'exception_in_progress: {!r:s}'.format(exception_in_progress)
         assert arg is None, 'arg is {!r:s} instead of None'.format(arg)
-        assert frame_info.filename == self.exception_in_progress.filename, \
+        assert frame_info.filename == exception_in_progress.filename, \
             '"line": File name was {:s} now {:s}'.format(
-                self.exception_in_progress.filename, frame_info.filename
+                exception_in_progress.filename, frame_info.filename
             )
-        assert frame_info.function == self.exception_in_progress.function, \
+        assert frame_info.function == exception_in_progress.function, \
             '"line": Function was "{:s}" now "{:s}"'.format(
-                self.exception_in_progress.function, frame_info.function
+                exception_in_progress.function, frame_info.function
             )
         # We have jumped forward in the function to the catch point so line
         # number must be > than where originally raised.
-        assert frame_info.lineno > self.exception_in_progress.lineno, \
+        assert frame_info.lineno > exception_in_progress.lineno, \
             '"line": Line number was {:d} now {:d}'.format(
-                self.exception_in_progress.lineno, frame_info.lineno
+                exception_in_progress.lineno, frame_info.lineno
             )
-        assert self.exception_in_progress.eventno == self.eventno - 1, \
+        assert self.asyncio_aware or exception_in_progress.eventno == self.eventno - 1, \
             '"line": Event number was {:d}, expected {:d}'.format(
-                self.exception_in_progress.eventno, self.eventno - 1
+                exception_in_progress.eventno, self.eventno - 1
             )
 
-    def _process_call_return_exception(self, frame, event, arg, frame_info, func_types):
+    def _process_call_return_exception(self, frame, event, arg, frame_info, func_types,
+                                       timer=_NULL_PHASE_TIMER):
         assert event in ('call', 'return', 'exception')
         if event == 'call':
             # arg is None
-            func_types.add_call(inspect.getargvalues(frame), frame_info.filename, frame_info.lineno)
+            if func_types.generator_kind is not None and is_resumption(frame):
+                # A generator or coroutine continuing after a yield or await.
+                self._record_resume(func_types, frame_info.lineno)
+            else:
+                self._record_call(frame, func_types, frame_info, timer)
         elif event == 'return':
-            if self.exception_in_progress is not None:
-                self._assert_exception_propagates(event, arg, frame_info)
+            exception_in_progress = self._get_exception_in_progress(frame)
+            if exception_in_progress is not None:
+                self._assert_exception_propagates(event, arg, frame_info, exception_in_progress)
                 # Ignore spurious return after exception instead add
                 # a propagated exception.
-                self._trace('TRACE: "return": adding exception:', self.exception_in_progress)
-                func_types.add_exception(self.exception_in_progress.exception_value, self.exception_in_progress.lineno)
-                self.exception_in_progress = None
+                if self._verbose:
+                    self._trace('TRACE: "return": adding exception:', exception_in_progress)
+                self._record_exception(frame, func_types, exception_in_progress.exception_value,
+                                       exception_in_progress.lineno)
+                self._set_exception_in_progress(frame, None)
+            elif frame in self._generators_exiting:
+                # Generator closed, there is no return value.
+                self._generators_exiting.discard(frame)
+            elif func_types.generator_kind is not None and is_yield(frame):
+                if self._verbose:
+                    self._trace('TRACE: "return": adding yield value:', arg, frame_info.lineno)
+                self._add_yield(func_types, arg, frame_info.lineno)
             else:
-                self._trace('TRACE: "return": adding return value:', arg, frame_info.lineno)
+                if self._verbose:
+                    self._trace('TRACE: "return": adding return value:', arg, frame_info.lineno)
                 # arg is a valid return value
-                func_types.add_return(arg, frame_info.lineno)
+                self._record_return(frame, func_types, arg, frame_info.lineno, timer)
         else:
             assert event == 'exception'
             # arg is a tuple (exception_type, exception_value, traceback)
             # For a stop iteration these values are: (<class 'StopIteration'>, StopIteration(), None)
             exception_type, exception_value, exception_traceback = arg
-            self._trace('TRACE:', frame_info.filename, frame_info.function,
-                        frame_info.lineno, exception_type, repr(exception_value),
-                        repr(exception_traceback))
+            if self._verbose:
+                self._trace('TRACE:', frame_info.filename, frame_info.function,
+                            frame_info.lineno, exception_type, repr(exception_value),
+                            repr(exception_traceback))
+            if exception_type is GeneratorExit:
+                self._generators_exiting.add(frame)
             # Ignore exceptions caused by co-routines as that is just for flow of control.
             if exception_type not in (StopIteration, GeneratorExit):
                 # func_types.add_exception(arg[1], lineno)
                 # Fields: filename function lineno exception_value eventno
-                assert self.exception_in_progress is None, \
+                exception_in_progress = self._get_exception_in_progress(frame)
+                assert exception_in_progress is None, \
                     'File: {:s}, function: {:s}, exception {:s} type {!r:s} in flight from line {:d}, now see exception event {:s} at {:d}'.format(
                         frame_info.filename,
                         frame_info.function,
-                        repr(self.exception_in_progress.exception_value),
-                        type(self.exception_in_progress.exception_value),
-                        self.exception_in_progress.lineno,
+                        repr(exception_in_progress.exception_value),
+                        type(exception_in_progress.exception_value),
+                        exception_in_progress.lineno,
                         repr(exception_value),
                         frame_info.lineno
                     )
                 # ExceptionInProgress _fields: filename, function, lineno, exception_value, eventno
-                self.exception_in_progress = ExceptionInProgress(
+                self._set_exception_in_progress(frame, ExceptionInProgress(
                     frame_info.filename, frame_info.function, frame_info.lineno, exception_value, self.eventno,
-                )
+                ))
+
+    def _skip_settled_event(self, frame, event, arg, func_types):
+        """Makes the cheap check of an event of a settled function, see
+        load_baseline(). Returns True if the event need not be processed."""
+        if event == 'call':
+            code = frame.f_code
+            f_locals = frame.f_locals
+            return func_types.skip_known_call(tuple(
+                type(f_locals[name])
+                for name in code.co_varnames[:code.co_argcount + code.co_kwonlyargcount]
+            ))
+        if self._get_exception_in_progress(frame) is not None:
+            return False
+        if event == 'return':
+            return func_types.skip_known_return(arg, frame.f_lineno)
+        # A line event only matters if an exception is in flight.
+        return event == 'line'
 
     def __call__(self, frame, event, arg):
-        """Handle a trace event."""
-        self.event_counter.update({event : 1})
+        """Handle a trace event with the handler chosen at construction."""
+        return self._handler(frame, event, arg)
+
+    def _start_timer(self):
+        """Returns the PhaseTimer, started, if this event is to be timed
+        otherwise a timer that does nothing."""
+        if self._profile_eventno % self.PROFILE_SAMPLE_INTERVAL == 0:
+            timer = self._phase_timer
+        else:
+            timer = _NULL_PHASE_TIMER
+        self._profile_eventno += 1
+        timer.start()
+        return timer
+
+    def _call_fast(self, frame, event, arg):
+        """The trace function when not verbose. This has no diagnostic output
+        and does not read the source code for the context of each event."""
+        self.event_counter[event] += 1
+        code = frame.f_code
+        binding = self._code_bindings.get(code)
+        if binding is not None and binding.settled \
+                and self._skip_settled_event(frame, event, arg, binding.func_types):
+            self._settled_events += 1
+            self.eventno += 1
+            return self._handler
+        timer = self._start_timer()
+        frame_info = inspect.Traceback(code.co_filename, frame.f_lineno, code.co_name, None, None)
+        timer.lap(self.PHASE_RESOLUTION)
+        self._handle_event(frame, event, arg, frame_info, timer, binding)
+        return self._handler
+
+    def _call_verbose(self, frame, event, arg):
+        """The trace function when verbose, this reports every event as
+        requested by trace_frame_event and logs at DEBUG level."""
+        self.event_counter[event] += 1
+        binding = self._code_bindings.get(frame.f_code)
+        if binding is not None and binding.settled and not self.trace_frame_event \
+                and self._skip_settled_event(frame, event, arg, binding.func_types):
+            self._settled_events += 1
+            self.eventno += 1
+            return self._handler
+        timer = self._start_timer()
         # A named tuple: Traceback(filename, lineno, function, code_context, index)
         frame_info = inspect.getframeinfo(frame)
+        timer.lap(self.PHASE_RESOLUTION)
         if self.trace_frame_event and (self.events_to_trace is None or event in self.events_to_trace):
             # The tuple contains the filename, the line number of the current line, the function name, a list of lines
             # of context from the source code, and the index of the current line within that list.
@@ -660,56 +1356,246 @@ class TypeInferencer(object):
                     frame_info.function, frame_info.filename, frame_info.lineno
                 )
             )
-        self._trace('TRACE: self.exception_in_progress', self.exception_in_progress)
-        if self.RE_TEMPORARY_FILE.match(frame_info.filename) \
-        or frame_info.function in self.FALSE_FUNCTION_NAMES:
+        self._trace('TRACE: exception_in_progress', self._get_exception_in_progress(frame))
+        timer.lap(self.PHASE_LOGGING)
+        self._handle_event(frame, event, arg, frame_info, timer, binding)
+        self._trace()
+        timer.lap(self.PHASE_LOGGING)
+        return self._handler
+
+    def _event_log_code(self, frame):
+        """Returns (code_id, generator_kind) for the code of a frame, adding it
+        to the event log. code_id is None if the code is not to be logged."""
+        code = frame.f_code
+        if self.RE_TEMPORARY_FILE.match(code.co_filename) or code.co_name in self.FALSE_FUNCTION_NAMES:
+            return None, None
+        q_name, bases, signature = self._qualified_name_bases_signature(frame)
+        if q_name == '':
+            self._error('Could not find qualified name in code: {!r:s}'.format(code))
+            return None, None
+        generator_kind = self._generator_kind(code)
+        code_id = self._event_log.add_code(CodeEntry(
+            os.path.abspath(code.co_filename), q_name, bases, signature, generator_kind,
+            code.co_varnames[:code.co_argcount + code.co_kwonlyargcount], code.co_firstlineno,
+        ))
+        return code_id, generator_kind
+
+    def _call_event_log(self, frame, event, arg):
+        """The trace function with an event log, this just appends a record of
+        the event to the log. 'line' events are only logged when an exception
+        is in flight in the frame."""
+        self.eventno += 1
+        try:
+            code_id, generator_kind = self._event_log_codes[frame.f_code]
+        except KeyError:
+            code_id, generator_kind = self._event_log_codes[frame.f_code] = self._event_log_code(frame)
+        if code_id is None:
+            return self._handler
+        log = self._event_log
+        lineno = frame.f_lineno
+        if event == 'line':
+            exception_lineno = self._event_log_exceptions.get(frame)
+            if exception_lineno is not None:
+                log.append(KIND_LINE, code_id, lineno, NO_FINGERPRINT, self._event_log_activations[frame])
+                if not self.asyncio_aware or lineno > exception_lineno:
+                    del self._event_log_exceptions[frame]
+            return self._handler
+        activation_id = self._event_log_activations.get(frame)
+        if activation_id is None:
+            self._event_log_activation_count += 1
+            activation_id = self._event_log_activations[frame] = self._event_log_activation_count
+        if event == 'call':
+            if generator_kind is not None and is_resumption(frame):
+                log.append(KIND_RESUME, code_id, lineno, NO_FINGERPRINT, activation_id)
+            else:
+                f_locals = frame.f_locals
+                fingerprint = tuple(log.snapshot(f_locals[name]) for name in log.codes[code_id].arg_names)
+                log.append(KIND_CALL, code_id, lineno, log.fingerprint_id(fingerprint), activation_id)
+        elif event == 'return':
+            self._event_log_exceptions.pop(frame, None)
+            if generator_kind is not None and is_yield(frame):
+                if generator_kind == types.FunctionTypes.KIND_GENERATOR:
+                    log.append(KIND_YIELD, code_id, lineno, log.fingerprint_id(log.snapshot(arg)), activation_id)
+                elif generator_kind == types.FunctionTypes.KIND_ASYNC_GENERATOR \
+                and type(arg).__name__ == 'async_generator_wrapped_value':
+                    log.append(KIND_YIELD, code_id, lineno,
+                               log.fingerprint_id(log.snapshot(gc.get_referents(arg)[0])), activation_id)
+                else:
+                    log.append(KIND_RESUME, code_id, lineno, NO_FINGERPRINT, activation_id)
+            else:
+                log.append(KIND_RETURN, code_id, lineno, log.fingerprint_id(log.snapshot(arg)), activation_id)
+                del self._event_log_activations[frame]
+        elif event == 'exception':
+            self._event_log_exceptions[frame] = lineno
+            log.append(KIND_EXCEPTION, code_id, lineno, log.fingerprint_id(log.snapshot(arg[1])), activation_id)
+        return self._handler
+
+    def process_event_log(self, jobs=None):
+        """With an event log this records the types from the log, this is
+        called once after tracing. The log file is then closed, truncated to
+        the records written. See ``typin.event_log``.
+
+        :param jobs: Number of worker processes, None for the number of CPUs.
+        :type jobs: ``int, NoneType``
+
+        :return: ``int`` -- The number of records processed.
+        """
+        count = self._event_log.process(self, jobs)
+        # Truncates the file to the records and releases the memory map.
+        self._event_log.close()
+        self._cleanup()
+        return count
+
+    def _handle_event(self, frame, event, arg, frame_info, timer, binding):
+        """Records the event, this is common to both trace functions. binding
+        is the CodeBinding of the code of the frame, None if there is none
+        yet."""
+        if binding is None:
+            binding = self._bind_code(frame, timer)
+            if binding.settled and not self.trace_frame_event \
+                    and self._skip_settled_event(frame, event, arg, binding.func_types):
+                self._settled_events += 1
+                self.eventno += 1
+                return
+        elif event != 'line':
+            self._code_resolution_hits += 1
+        func_types = binding.func_types
+        if func_types is None:
             # Ignore these.
             pass
         else:
-            # Only look at 'real' files and functions
             lineno = frame_info.lineno
-            if event in ('call', 'return', 'exception'):# and frame_info.filename != '<module>':
-                file_path = os.path.abspath(frame_info.filename)
-                # TODO: For methods use __qualname__
-                #             function_name = frame_info.function
-                q_name, bases, signature = self._qualified_name_bases_signature(frame)
-                self._debug(
-                    'TypeInferencer.__call__(): q_name="{:s}", bases={!r:s})'.format(
-                        q_name, bases
-                ))
-                if q_name != '':
-                    try:
-                        self._set_bases(file_path, lineno, q_name, bases)
-                        # func_types is a types.FunctionTypes object
-                        func_types = self._get_func_data(file_path, q_name, signature)
-                        self._process_call_return_exception(frame, event, arg,
-                                                            frame_info, func_types)
-                        if self.trace_frame_event and (self.events_to_trace is None or event in self.events_to_trace):
-                            print('[{:8d}] func_types now: {!r:s}'.format(self.eventno, func_types), flush=True)
-                    except Exception as err:
-                        self._error(
-                            'ERROR: Could not add event "{:s}" Function: {:s} File: {:s}#{:d}'.format(
-                                event,
-                                frame_info.function,
-                                frame_info.filename,
-                                frame_info.lineno,
-                            )
+            if event in ('call', 'return', 'exception'):
+                if self._verbose:
+                    self._debug(
+                        'TypeInferencer.__call__(): q_name="{:s}", bases={!r:s})'.format(
+                            binding.q_name, self._code_resolutions[frame.f_code][1]
+                    ))
+                    timer.lap(self.PHASE_LOGGING)
+                self.file_event_counter[binding.file_id] += 1
+                self.function_event_counter[(binding.file_id, binding.q_name_id)] += 1
+                try:
+                    self._process_call_return_exception(frame, event, arg,
+                                                        frame_info, func_types, timer)
+                    if event == 'exception':
+                        timer.lap(self.PHASE_EXCEPTIONS)
+                    else:
+                        timer.lap(self.PHASE_RECORD)
+                    if self.trace_frame_event and (self.events_to_trace is None or event in self.events_to_trace):
+                        print('[{:8d}] func_types now: {!r:s}'.format(self.eventno, func_types), flush=True)
+                except Exception as err:
+                    self._error(
+                        'ERROR: Could not add event "{:s}" Function: {:s} File: {:s}#{:d}'.format(
+                            event,
+                            frame_info.function,
+                            frame_info.filename,
+                            frame_info.lineno,
                         )
-                        self._error('ERROR: Type error: {!r:s}, message: {:s}'.format(type(err), str(err)))
-                        self._error(''.join(traceback.format_exception(*sys.exc_info())))
-                else:
-                    self._error('Could not find qualified name in frame: {!r:s}'.format(frame_info))
+                    )
+                    self._error('ERROR: Type error: {!r:s}, message: {:s}'.format(type(err), str(err)))
+                    self._error(''.join(traceback.format_exception(*sys.exc_info())))
             elif event == 'line':
                 # Deferred decision about the exception reveals that
                 # this exception is caught within the function.
-                if self.exception_in_progress is not None:
-                    self._trace('TRACE: Exception in flight followed by line event', frame_info.filename, frame_info.function, lineno)
-                    # The exception has been caught within the function
-                    self._assert_exception_caught(event, arg, frame_info)
-                    self.exception_in_progress = None
+                exception_in_progress = self._get_exception_in_progress(frame)
+                if exception_in_progress is not None:
+                    if self._verbose:
+                        self._trace('TRACE: Exception in flight followed by line event', frame_info.filename, frame_info.function, lineno)
+                    if self.asyncio_aware and lineno <= exception_in_progress.lineno:
+                        # Going back to an enclosing (async) with statement to
+                        # run __exit__() or __aexit__(), the exception may
+                        # still propagate.
+                        pass
+                    else:
+                        # The exception has been caught within the function
+                        self._assert_exception_caught(event, arg, frame_info, exception_in_progress)
+                        self._set_exception_in_progress(frame, None)
+                timer.lap(self.PHASE_EXCEPTIONS)
         self.eventno += 1
-        self._trace()
-        return self
+
+    def stats(self):
+        """Returns a dict of statistics of my own performance::
+
+            {
+                'events' : int, # All events.
+                'event_counts' : {event : count, ...},
+                'settled_events' : int, # Handled by the settled check.
+                'sampled_events' : int, # Timed by phase.
+                'phase_ns' : {phase : nanoseconds, ...}, # Estimated for all events.
+                'file_events' : {file_path : count, ...},
+                'function_events' : {file_path : {qualified_name : count, ...}, ...},
+                # Lookups of the code bindings by call, return and exception events.
+                'code_resolution' : {'hits' : int, 'misses' : int, 'hit_rate' : float},
+                'deferred' : {'processed' : int, 'dropped' : int}, # None if not deferred.
+            }
+
+        Only every PROFILE_SAMPLE_INTERVAL'th event is timed so the time by
+        phase is estimated from those. File and function counts are of call,
+        return and exception events.
+        """
+        timer = self._phase_timer
+        if timer.samples:
+            scale = self._profile_eventno / timer.samples
+        else:
+            scale = 0.0
+        function_events = {}
+        name = self.names.name
+        for (file_id, q_name_id), count in self.function_event_counter.items():
+            function_events.setdefault(name(file_id), {})[name(q_name_id)] = count
+        lookups = self._code_resolution_hits + self._code_resolution_misses
+        return {
+            'events' : self.eventno,
+            'event_counts' : dict(self.event_counter),
+            'settled_events' : self._settled_events,
+            'sampled_events' : timer.samples,
+            'phase_ns' : {k : int(v * scale) for k, v in timer.phase_ns.items()},
+            'file_events' : {name(k) : v for k, v in self.file_event_counter.items()},
+            'function_events' : function_events,
+            'code_resolution' : {
+                'hits' : self._code_resolution_hits,
+                'misses' : self._code_resolution_misses,
+                'hit_rate' : self._code_resolution_hits / lookups if lookups else 0.0,
+            },
+            'deferred' : None if self._deferred is None else {
+                'processed' : self._deferred.processed,
+                'dropped' : self._deferred.dropped,
+            },
+        }
+
+    def stats_report(self):
+        """Returns the result of stats() as a printable string. Only the
+        STATS_REPORT_TOP files and functions with the most events are shown."""
+        stats = self.stats()
+        lines = [
+            'Events: {:d} settled: {:d} sampled: {:d}'.format(
+                stats['events'], stats['settled_events'], stats['sampled_events']
+            ),
+            'Event counts: {:s}'.format(
+                ', '.join('{:s}={:d}'.format(k, v) for k, v in sorted(stats['event_counts'].items()))
+            ),
+            'Code resolution cache: hits: {hits:d} misses: {misses:d} hit rate: {hit_rate:.1%}'.format(
+                **stats['code_resolution']
+            ),
+        ]
+        if stats['deferred'] is not None:
+            lines.append('Deferred observations: processed: {processed:d} dropped: {dropped:d}'.format(
+                **stats['deferred']
+            ))
+        lines.append('Estimated time by phase:')
+        total_ns = sum(stats['phase_ns'].values())
+        for phase in self.PHASES:
+            phase_ns = stats['phase_ns'][phase]
+            lines.append('{:s}{:12s} {:10.3f} (ms) {:6.1%}'.format(
+                self.INDENT, phase, phase_ns / 1e6, phase_ns / total_ns if total_ns else 0.0
+            ))
+        lines.append('Files with most events:')
+        name = self.names.name
+        for file_id, count in self.file_event_counter.most_common(self.STATS_REPORT_TOP):
+            lines.append('{:s}{:8d} {:s}'.format(self.INDENT, count, name(file_id)))
+        lines.append('Functions with most events:')
+        for (file_id, q_name_id), count in self.function_event_counter.most_common(self.STATS_REPORT_TOP):
+            lines.append('{:s}{:8d} {:s} {:s}'.format(self.INDENT, count, name(file_id), name(q_name_id)))
+        return '\n'.join(lines)
 
     def _cleanup(self):
         """This does any spring cleaning once tracing has stopped.
@@ -718,26 +1604,51 @@ class TypeInferencer(object):
         I don't understand why this is so but a function call event is generated
         which ends up with the entry point the class declaration and the return
         line the declaration of the last method.
+
+        Where the source file can be parsed these are found with the function
+        index, otherwise by matching global function names to class names.
         """
         # self.function_map is a dict of:
         # {file_path : { namespace : { function_name : FunctionTypes, ...}, ...}
-        for file_path in self.function_map:
-            class_names = []
-            for ns in self.function_map[file_path]:
-                if ns != self.GLOBAL_NAMESPACE:
-                    class_names.append(ns.split('.')[-1])
-            names_to_remove = []
-            # TODO: Remove functions by reading the source and checking
-            # RE_FUNCTION matches? Need to take care of decorators.
-            if self.GLOBAL_NAMESPACE in self.function_map[file_path]:
-                for function_name in self.function_map[file_path][self.GLOBAL_NAMESPACE]:
-                    if function_name in class_names:
-                        names_to_remove.append(function_name)
+        self._interval_trees.clear()
+        # Functions may be removed from self.function_map.
+        self._code_bindings.clear()
+        # A copy of the keys as, when nested, this might itself be traced.
+        for file_path in list(self.function_map):
+            index = function_index.function_index(file_path)
+            if index is not None:
+                names_to_remove = self._class_body_functions(file_path, index)
+            else:
+                names_to_remove = self._class_named_functions(file_path)
             if len(names_to_remove):
                 logging.info('TypeInferencer._cleanup(): file: {:s}'.format(file_path))
-                for function_name in names_to_remove:
+                for namespace, function_name in names_to_remove:
                     logging.info('TypeInferencer._cleanup(): removing {:s}'.format(function_name))
-                    del self.function_map[file_path][self.GLOBAL_NAMESPACE][function_name]
+                    del self.function_map[file_path][namespace][function_name]
+
+    def _class_body_functions(self, file_path, index):
+        """Returns a list of (namespace, function_name) of the functions whose
+        entry point is a class declaration."""
+        result = []
+        for namespace in list(self.function_map[file_path]):
+            for function_name, fts in list(self.function_map[file_path][namespace].items()):
+                if fts.num_entry_points and index.is_class(fts.line_decl):
+                    result.append((namespace, function_name))
+        return result
+
+    def _class_named_functions(self, file_path):
+        """Returns a list of (namespace, function_name) of global functions that
+        have the same name as a class."""
+        class_names = []
+        for ns in self.function_map[file_path]:
+            if ns != self.GLOBAL_NAMESPACE:
+                class_names.append(ns.split('.')[-1])
+        names_to_remove = []
+        if self.GLOBAL_NAMESPACE in self.function_map[file_path]:
+            for function_name in self.function_map[file_path][self.GLOBAL_NAMESPACE]:
+                if function_name in class_names:
+                    names_to_remove.append((self.GLOBAL_NAMESPACE, function_name))
+        return names_to_remove
 
     @staticmethod
     def sys_setprofile(frame, event, arg):
@@ -781,8 +1692,10 @@ class TypeInferencer(object):
         So returning None on the same line as a previously seen exception must
         be ignored as it is a phantom return value.
         """
+        if self._deferred is not None:
+            self._deferred.start()
         self._trace_fn_stack.append(sys.gettrace())
-        sys.settrace(self)
+        sys.settrace(self._handler)
         if self._trace_non_tracked_events:
             sys.setprofile(TypeInferencer.sys_setprofile)
         return self
@@ -795,9 +1708,20 @@ class TypeInferencer(object):
         sys.settrace(self._trace_fn_stack.pop())
         if self._trace_non_tracked_events:
             sys.setprofile(None)
+        # Release any frames held by undecided state.
+        self.exceptions_in_progress.clear()
+        self._generators_exiting.clear()
+        self._dropped_call_frames.clear()
+        self._event_log_exceptions.clear()
+        self._event_log_activations.clear()
+        if self._event_log is not None:
+            self._event_log.flush()
+        if self._deferred is not None and len(self._trace_fn_stack) == 0:
+            # Wait for the types to be recorded.
+            self._deferred.stop()
         self._cleanup()
 
-    def find_docstring_insertion_line_number(self, file_path, src_lines, lineno):
+    def find_docstring_insertion_line_number(self, file_path, src_lines, lineno, index=None):
         """Finds the insertion point for the docstring. If the result of this
         is non-zero then the caller can insert the documentation lines thus::
 
@@ -814,6 +1738,11 @@ class TypeInferencer(object):
             src_lines, lineno-1 is the index.
         :type lineno: ``int``
 
+        :param index: The function index of src_lines, if None it is created.
+            Callers making many lookups should create this once. False means
+            that src_lines can not be parsed so regular expressions are used.
+        :type index: ``typin.function_index.FunctionIndex, NoneType, bool``
+
         :raises: ``IndexError`` On out of bounds.
 
         :return: ``int`` -- The source code line number starting at 1.
@@ -821,6 +1750,34 @@ class TypeInferencer(object):
             If so a warning message is emitted and the caller can ignore the
             insertion.
         """
+        if index is None:
+            index = self._function_index_of_lines(file_path, src_lines)
+        if index is None or index is False:
+            return self._find_docstring_insertion_line_number_by_regex(file_path, src_lines, lineno)
+        location = index.function_at(lineno)
+        if location is None or location.colon_lineno == 0:
+            # Example: members.sort(key=lambda t: (t[1], t[0]))
+            # lambda seen as function, or def f(): pass
+            logging.warning(
+                'insert_docstrings(): file {:s}{:d} source line "{:s}" is not a function'.format(
+                    file_path, lineno, src_lines[lineno - 1].rstrip()
+            ))
+            return 0
+        return location.colon_lineno
+
+    def _function_index_of_lines(self, file_path, src_lines):
+        """Returns a FunctionIndex of the source lines or None if they can not
+        be parsed, for example Python 2 code."""
+        try:
+            return function_index.FunctionIndex.from_lines(src_lines)
+        except (SyntaxError, ValueError) as err:
+            logging.warning('Can not parse {:s}, using regular expressions: {!r:s}: {:s}'.format(
+                file_path, type(err), str(err)))
+            return None
+
+    def _find_docstring_insertion_line_number_by_regex(self, file_path, src_lines, lineno):
+        """As find_docstring_insertion_line_number() by scanning the source
+        lines. This is used when the source can not be parsed."""
         # With decorators the lineno is the line of the decorator, not the function.
         while RE_DECORATOR.match(src_lines[lineno - 1]):
             lineno += 1
@@ -850,8 +1807,11 @@ class TypeInferencer(object):
         """
         return len(self.docstring_map(file_path))
 
-    def insert_docstrings(self, file_path, src_lines=None, style=DOCSTRING_STYLE_DEFAULT):
-        """Injects the documentation strings into lines of source code.
+    def iter_insert_docstrings(self, file_path, src_lines=None, style=DOCSTRING_STYLE_DEFAULT,
+                               docstring_map=None):
+        """Generates the lines of source code with the documentation strings
+        injected. All the insertion points are found first then the output is
+        produced in a single pass so the time taken is linear in the file size.
 
         :param file_path: Path to the source file.
         :type file_path: ``str``
@@ -863,27 +1823,59 @@ class TypeInferencer(object):
         :param style: Docstring style.
         :type style: ``str``
 
-        :return: ``list([str])`` -- List of source lines with docstrings inserted.
+        :param docstring_map: The result of ``self.docstring_map(file_path, style)``
+            if the caller already has it, if None (default) it is created.
+        :type docstring_map: ``dict, NoneType``
+
+        :return: ``generator(str)`` -- Source lines with docstrings inserted.
         """
         if src_lines is None:
             with open(file_path) as f:
                 src_lines = f.readlines()
-        docstring_map = self.docstring_map(file_path, style=style)
-        for lineno in reversed(sorted(docstring_map.keys())):
-            # print('TRACE:', lineno, src_lines[lineno - 1])
+        if docstring_map is None:
+            docstring_map = self.docstring_map(file_path, style=style)
+        index = self._function_index_of_lines(file_path, src_lines)
+        if index is None:
+            # Do not parse again for each function.
+            index = False
+        # dict of {insertion_line_number : [docstring_line, ...], ...}
+        insertions = collections.defaultdict(list)
+        for lineno in sorted(docstring_map.keys()):
             namespace, _function_name, docstring = docstring_map[lineno]
-            prefix = '    '
-            if namespace != '':
-                prefix *= 1 + len(namespace.split('.'))
-            # docstring = '"""{:s}"""'.format(docstring)
-            docstring_lines = [
-                '{:s}{:s}\n'.format(prefix, aline) for aline in docstring.split('\n')
-            ]
+            location = index.function_at(lineno) if index is not False else None
             # Adjust the line number for decorators, multi-line declarations.
             lineno = self.find_docstring_insertion_line_number(
-                file_path, src_lines, lineno
+                file_path, src_lines, lineno, index
             )
             # Ignore lambdas where lineno is 0.
             if lineno:
-                src_lines = src_lines[:lineno] + docstring_lines + src_lines[lineno:]
-        return src_lines
+                if location is not None:
+                    prefix = location.indent
+                else:
+                    prefix = '    '
+                    if namespace != '':
+                        prefix *= 1 + len(namespace.split('.'))
+                insertions[lineno].extend(
+                    '{:s}{:s}\n'.format(prefix, aline) for aline in docstring.split('\n')
+                )
+        for lineno, aline in enumerate(src_lines, start=1):
+            yield aline
+            if lineno in insertions:
+                yield from insertions[lineno]
+
+    def insert_docstrings(self, file_path, src_lines=None, style=DOCSTRING_STYLE_DEFAULT):
+        """Injects the documentation strings into lines of source code.
+
+        :param file_path: Path to the source file.
+        :type file_path: ``str``
+
+        :param src_lines: List of lines of source code, if None (default) then
+            file_path will be read using readlines().
+        :type src_lines: ``list([str]),NoneType``
+
+        :param style: Docstring style.
+        :type style: ``str``
+
+        :return: ``list([str])`` -- List of source lines with docstrings inserted.
+        """
+        return list(self.iter_insert_docstrings(file_path, src_lines, style))
@@ -3,9 +3,14 @@ Created on 17 Jul 2017
 
 @author: paulross
 '''
+import array
+import builtins
 import collections
+import collections.abc
 import functools
+import itertools
 # import inspect
+import numbers
 import sys
 
 import re
@@ -24,8 +29,12 @@ class Type(object):
     For sequences and so on this will contain a sequence of types.
     """
     # Matches "<class 'int'>" to extract "int"
-    # re.ASCII is "<enum RegexFlag>"
-    RE_TYPE_STR_MATCH = re.compile(r'<(?:class|enum) \'(.+)\'>')
+    # re.ASCII is "<enum RegexFlag>", socket.AddressInfo is "<flag 'AddressInfo'>"
+    RE_TYPE_STR_MATCH = re.compile(r'<(?:class|enum|flag) \'(.+)\'>')
+    # Set by a type extractor, see register_type_extractor().
+    _description = None
+    # True if this was created by from_str(), the description is the name.
+    _named = False
 
     def __init__(self, obj, __ids=None):
         """Constructor with an object. __ids is used internally to prevent
@@ -33,6 +42,14 @@ class Type(object):
         This constructor decomposes the object into its types."""
 #         print('TRACE: Type.__init__:', type(obj))
         self._type = None
+        extractor = _TYPE_EXTRACTORS.get(type(obj), _UNRESOLVED)
+        if extractor is _UNRESOLVED:
+            extractor = _resolve_type_extractor(type(obj))
+        if extractor is not None:
+            # Fast path for arrays and buffers, the elements are never examined.
+            self._type = type(obj)
+            self._description = extractor(obj)
+            return
         # __ids is a set of ID values from id(object)
         if __ids is None:
             __ids = set()
@@ -89,16 +106,22 @@ class Type(object):
     def __eq__(self, other):
         # other could be a type object not just a Type object
         if hasattr(other, '_type'):
-            return self._type == other._type
+            if self._named or getattr(other, '_named', False):
+                # A Type from a previous run only has a name.
+                return str(self) == str(other)
+            return self._type == other._type and self._description == other._description
         return False
 
     def __lt__(self, other):
-        return str(self._type) < str(other._type)
+        return (str(self._type), self._description or '') \
+            < (str(other._type), other._description or '')
 
     def __hash__(self):
         return hash(str(self))
 
     def __str__(self):
+        if self._description is not None:
+            return self._description
         if isinstance(self._type, (list, set, tuple)):
             sl = [Type.str_of_object_type(self._type), '([']
             if isinstance(self._type, (list, set)):
@@ -139,6 +162,333 @@ class Type(object):
             return m.group(1)
         raise ValueError('Can not parse object: "{:s}", type {:s}'.format(str(obj), str(type(obj))))
 
+    @classmethod
+    def from_type(cls, typ):
+        """Returns a Type that represents the class typ rather than an
+        instance of it. This is used for widened types such as
+        ``numbers.Number``."""
+        t = cls.__new__(cls)
+        t._type = typ
+        return t
+
+    @classmethod
+    def from_str(cls, type_str):
+        """Returns a Type that only has the name given by str() of a Type in
+        a previous run, for example ``'int'`` or ``'list([int])'``. This is
+        equal to any Type with the same str() and its base class is
+        ``object``. This is used for loading a baseline."""
+        t = cls.__new__(cls)
+        t._type = object
+        t._description = type_str
+        t._named = True
+        return t
+
+    @classmethod
+    def from_snapshot(cls, snap):
+        """Returns the Type of an object from its shallow_snapshot(). This is
+        equal to ``Type(obj)`` when no container in obj was truncated by the
+        snapshot."""
+        t = cls.__new__(cls)
+        typ, payload = snap
+        if payload is None:
+            t._type = typ
+        elif isinstance(payload, str):
+            t._type = typ
+            t._description = payload
+        elif issubclass(typ, list):
+            t._type = []
+            for s in payload:
+                element = cls._from_element_snapshot(s, True)
+                if element not in t._type:
+                    t._type.append(element)
+        elif issubclass(typ, tuple):
+            elements = [cls._from_element_snapshot(s) for s in payload]
+            if hasattr(typ, '_fields'):
+                t._type = typ(*elements)
+            else:
+                t._type = tuple(elements)
+        elif issubclass(typ, set):
+            t._type = typ([cls._from_element_snapshot(s) for s in payload])
+        else:
+            t._type = {}
+            for k, v in payload:
+                key = cls._from_element_snapshot(k)
+                val = cls._from_element_snapshot(v)
+                try:
+                    t._type[key].add(val)
+                except KeyError:
+                    t._type[key] = set([val,])
+        return t
+
+    @classmethod
+    def _from_element_snapshot(cls, snap, as_type=False):
+        """An element snapshot that is a bare class is an object that was
+        already seen, see _get_type()."""
+        if isinstance(snap, type):
+            return cls.from_type(snap) if as_type else snap
+        return cls.from_snapshot(snap)
+
+    def annotation_str(self):
+        """Returns the type as a PEP 484 annotation using PEP 585 generics and
+        PEP 604 unions, for example ``'dict[str, int | None]'``. This is
+        suitable for writing into source code that has
+        ``from __future__ import annotations``."""
+        if self._named:
+            return self._description
+        if self._description is not None:
+            return self.str_of_type(self._type)
+        if isinstance(self._type, tuple):
+            if hasattr(self._type, '_fields'):
+                return self.str_of_object_type(self._type)
+            if len(self._type) == 0:
+                return 'tuple[()]'
+            return 'tuple[{:s}]'.format(', '.join(annotation_str_of(t) for t in self._type))
+        if isinstance(self._type, (list, set, frozenset)):
+            name = self.str_of_object_type(self._type)
+            if len(self._type) == 0:
+                return name
+            return '{:s}[{:s}]'.format(name, union_annotation_str(self._type))
+        if isinstance(self._type, dict):
+            name = self.str_of_object_type(self._type)
+            if len(self._type) == 0:
+                return name
+            values = set()
+            for v in self._type.values():
+                values |= v
+            return '{:s}[{:s}, {:s}]'.format(
+                name, union_annotation_str(self._type.keys()), union_annotation_str(values)
+            )
+        return annotation_str_of(self._type)
+
+    def base_class(self):
+        """Returns the Python class that this Type represents, for containers
+        this is the container class e.g. ``list``."""
+        if isinstance(self._type, (list, tuple, set, frozenset, dict)):
+            return type(self._type)
+        return self._type
+
+#: The class name at the start of str() of a Type.
+RE_TYPE_STR_CLASS_NAME = re.compile(r'[A-Za-z_][\w.]*')
+
+def class_of_type_str(type_str):
+    """Returns the class named by str() of a Type in a previous run, or its
+    translation as in FunctionTypes.TYPE_NAME_TRANSLATION, for example ``int``
+    for ``'int'`` and ``list`` for ``'list([int])'``. The
+    class must be a builtin or in a module that has been imported. Returns
+    None if it can not be found."""
+    m = RE_TYPE_STR_CLASS_NAME.match(type_str)
+    if m is None:
+        return None
+    name = m.group(0)
+    if name in ('None', 'NoneType'):
+        return type(None)
+    parts = name.split('.')
+    obj = None
+    if len(parts) == 1:
+        obj = getattr(builtins, name, None)
+    else:
+        for i in range(len(parts) - 1, 0, -1):
+            module = sys.modules.get('.'.join(parts[:i]))
+            if module is not None:
+                obj = module
+                for attr in parts[i:]:
+                    obj = getattr(obj, attr, None)
+                break
+    return obj if isinstance(obj, type) else None
+
+def annotation_str_of(typ):
+    """Returns the annotation string of a Type or a class."""
+    if isinstance(typ, Type):
+        return typ.annotation_str()
+    if typ is type(None):
+        return 'None'
+    return Type.str_of_type(typ)
+
+def union_annotation_str(type_iterable):
+    """Returns the PEP 604 union of the annotation strings of Type objects or
+    classes, for example ``'int | str'``. This is 'None' if empty.
+    None is placed last as in ``'int | None'``."""
+    strs = sorted(set(annotation_str_of(t) for t in type_iterable), key=lambda s: (s == 'None', s))
+    if len(strs) == 0:
+        return 'None'
+    return ' | '.join(strs)
+
+#---- Shallow snapshots. ----
+# A shallow snapshot records just enough of an object to create its Type
+# later, possibly in another thread, with Type.from_snapshot(). It is a tuple
+# (class, payload) where payload is:
+#
+# * None for a non-container.
+# * A string for an object with a type extractor, the description.
+# * A tuple of element snapshots for a list, tuple or set.
+# * A tuple of (key snapshot, value snapshot) for a dict.
+#
+# An element that has already been seen is just its class, as Type does.
+
+#: Default maximum number of elements of each container in a snapshot.
+SNAPSHOT_SAMPLE_SIZE = 8
+#: Default maximum depth of nested containers in a snapshot, deeper
+#: containers are recorded as their class.
+SNAPSHOT_DEPTH = 4
+
+def shallow_snapshot(obj, sample_size=SNAPSHOT_SAMPLE_SIZE, depth=SNAPSHOT_DEPTH, __ids=None):
+    """Returns a shallow snapshot of obj that Type.from_snapshot() can turn
+    into a Type. This is cheaper than creating the Type as at most sample_size
+    elements of each container are examined and nothing is interned. As the
+    classes are captured the object can be mutated afterwards.
+
+    :param obj: The object.
+    :type obj: ``object``
+
+    :param sample_size: The maximum number of elements of each container.
+    :type sample_size: ``int``
+
+    :param depth: The maximum depth of nested containers.
+    :type depth: ``int``
+
+    :return: ``tuple`` -- The snapshot, see the module comment.
+    """
+    cls = type(obj)
+    extractor = _TYPE_EXTRACTORS.get(cls, _UNRESOLVED)
+    if extractor is _UNRESOLVED:
+        extractor = _resolve_type_extractor(cls)
+    if extractor is not None:
+        return cls, extractor(obj)
+    # As Type.__init__()
+    if __ids is None:
+        __ids = set()
+    if id(obj) in __ids:
+        return cls, None
+    __ids.add(id(obj))
+    if depth <= 0 or not isinstance(obj, (list, tuple, set, dict)):
+        return cls, None
+    depth -= 1
+    if isinstance(obj, list):
+        return cls, tuple(shallow_snapshot(o, sample_size, depth, __ids)
+                          for o in obj[:sample_size])
+    if isinstance(obj, dict):
+        pairs = []
+        for k, v in obj.items():
+            if len(pairs) >= sample_size:
+                break
+            pairs.append((_element_snapshot(k, sample_size, depth, __ids),
+                          _element_snapshot(v, sample_size, depth, __ids)))
+        return cls, tuple(pairs)
+    elements = []
+    for o in obj:
+        if len(elements) >= sample_size:
+            break
+        elements.append(_element_snapshot(o, sample_size, depth, __ids))
+    return cls, tuple(elements)
+
+def _element_snapshot(obj, sample_size, depth, __ids):
+    """As Type._get_type(), an element that has been seen is its class."""
+    if id(obj) in __ids:
+        return type(obj)
+    r = shallow_snapshot(obj, sample_size, depth, __ids)
+    __ids.add(id(obj))
+    return r
+
+#---- END: Shallow snapshots. ----
+
+#---- Type extractors. ----
+# These give a Type for an object in O(1) time without examining elements.
+# This is essential for large arrays and buffers.
+
+#: dict of {class : extractor or None, ...} where None means no extractor.
+#: Classes are added here as they are first seen.
+_TYPE_EXTRACTORS = {}
+#: dict of {(module_name, class_qualified_name) : extractor, ...} resolved
+#: when an object of that class is first seen.
+_LAZY_TYPE_EXTRACTORS = {}
+_UNRESOLVED = object()
+
+def register_type_extractor(cls, extractor):
+    """Registers an extractor for objects of class cls and its subclasses.
+    The extractor is a function that takes the object and returns a string
+    such as ``"array.array('d')"`` or None to just use the class name.
+    It must take O(1) time, it must not iterate over the object."""
+    _clear_unregistered_type_extractors()
+    _TYPE_EXTRACTORS[cls] = extractor
+
+def register_lazy_type_extractor(module_name, class_name, extractor):
+    """Registers an extractor for a class that is identified by name so that
+    the module is never imported by typin. It is resolved when an object of
+    that class, or a subclass, is first seen by which time the traced code
+    has imported the module."""
+    _clear_unregistered_type_extractors()
+    _LAZY_TYPE_EXTRACTORS[(module_name, class_name)] = extractor
+
+def _clear_unregistered_type_extractors():
+    """Remove cached 'no extractor' entries as a registration might change them."""
+    for cls in [k for k, v in _TYPE_EXTRACTORS.items() if v is None]:
+        del _TYPE_EXTRACTORS[cls]
+
+def _resolve_type_extractor(cls):
+    """Finds the extractor for cls by searching its MRO, this is cached.
+    Returns None if there is no extractor."""
+    extractor = None
+    for base in cls.__mro__:
+        if _TYPE_EXTRACTORS.get(base) is not None:
+            extractor = _TYPE_EXTRACTORS[base]
+            break
+        key = (getattr(base, '__module__', None), getattr(base, '__qualname__', None))
+        if key in _LAZY_TYPE_EXTRACTORS:
+            extractor = _LAZY_TYPE_EXTRACTORS[key]
+            _TYPE_EXTRACTORS[base] = extractor
+            break
+    _TYPE_EXTRACTORS[cls] = extractor
+    return extractor
+
+def _no_description(obj):
+    """Extractor for objects where the class name is enough e.g. bytes."""
+    return None
+
+def _array_description(obj):
+    """Extractor for array.array, for example ``"array.array('d')"``."""
+    return '{:s}({!r:s})'.format(Type.str_of_type(type(obj)), obj.typecode)
+
+def _memoryview_description(obj):
+    """Extractor for memoryview, for example ``"memoryview[B, 1d]"``."""
+    return '{:s}[{:s}, {:d}d]'.format(Type.str_of_type(type(obj)), obj.format, obj.ndim)
+
+def _ndarray_description(obj):
+    """Extractor for numpy.ndarray, for example ``"numpy.ndarray[float64, 2d]"``."""
+    return '{:s}[{!s:s}, {:d}d]'.format(Type.str_of_type(type(obj)), obj.dtype, obj.ndim)
+
+register_type_extractor(bytes, _no_description)
+register_type_extractor(bytearray, _no_description)
+register_type_extractor(memoryview, _memoryview_description)
+register_type_extractor(array.array, _array_description)
+register_lazy_type_extractor('numpy', 'ndarray', _ndarray_description)
+
+#---- END: Type extractors. ----
+
+#: Abstract classes tried in order when the common base class of a set of
+#: types is just ``object``.
+WIDENING_PROTOCOLS = (numbers.Number, collections.abc.Mapping, collections.abc.Sequence)
+
+def common_base_class(classes):
+    """Returns the most derived class in the MRO of the first class that all
+    the classes are derived from. This will be ``object`` if nothing else."""
+    for base in classes[0].__mro__:
+        if all(issubclass(c, base) for c in classes[1:]):
+            return base
+    return object
+
+def widen(type_iterable):
+    """Returns a single Type that covers all the given Type objects.
+    This is the common base class found from the MRO or, if that is
+    ``object``, the first of WIDENING_PROTOCOLS that covers all of them."""
+    classes = [t.base_class() for t in type_iterable]
+    base = common_base_class(classes)
+    if base is object:
+        for protocol in WIDENING_PROTOCOLS:
+            if all(issubclass(c, protocol) for c in classes):
+                base = protocol
+                break
+    return Type.from_type(base)
+
 class FunctionTypes:
     """Class that accumulate function call data such as call arguments,
     return values and exceptions raised."""
@@ -150,11 +500,76 @@ class FunctionTypes:
     SELF = 'self'
     # Alphabetical order
     DOCSTRING_STYLES_AVAILABLE = tuple(sorted(('sphinx', 'google')))
-    def __init__(self, signature=None):
-        """Constructor, takes no arguments, merely initialises internal state."""
+    # Maximum number of distinct (argument types -> return/exception type)
+    # rows retained. Beyond this the least frequently seen row is evicted.
+    MAX_CALL_RETURN_ROWS = 64
+    # Emit @overload variants only if the number of distinct argument type
+    # combinations is in the range [2, MAX_OVERLOADS].
+    MAX_OVERLOADS = 4
+    CALL_RETURN_KIND_RETURN = 'return'
+    CALL_RETURN_KIND_EXCEPTION = 'exception'
+    # Return annotation when returns were dropped and none were recorded.
+    RETURN_UNKNOWN = 'Any'
+    # Default size above which a set of argument or return types is widened
+    # to a single common type.
+    WIDEN_THRESHOLD = 16
+    # The interned types no longer stored are dropped when the table has
+    # grown to twice its size after the last pruning, or to this if larger.
+    INTERNED_TYPES_PRUNE_MIN = 256
+    # Values for generator_kind, None is an ordinary function.
+    KIND_GENERATOR = 'generator'
+    KIND_COROUTINE = 'coroutine'
+    KIND_ASYNC_GENERATOR = 'async_generator'
+    # Yielded values are decomposed into types for the first YIELD_SAMPLE_FULL
+    # yields. After that only a value of a previously unseen class or every
+    # YIELD_SAMPLE_INTERVAL'th value is decomposed.
+    YIELD_SAMPLE_FULL = 64
+    YIELD_SAMPLE_INTERVAL = 64
+    # A settled function, one loaded from a baseline, skips recording calls
+    # and returns whose classes have been recorded before. Every
+    # SETTLED_SAMPLE_INTERVAL'th of these is recorded in full regardless.
+    SETTLED_SAMPLE_INTERVAL = 64
+    # Maximum number of combinations of argument classes seeded from a
+    # baseline, see seed_fingerprints().
+    MAX_SEEDED_FINGERPRINTS = 64
+    def __init__(self, signature=None, widen_threshold=None, generator_kind=None):
+        """Constructor, merely initialises internal state.
+
+        signature - An inspect.Signature object or None.
+
+        widen_threshold - When a set of types for an argument or return line
+            grows beyond this size then it is collapsed to a single common type.
+            None means use WIDEN_THRESHOLD, 0 disables widening.
+
+        generator_kind - None for an ordinary function otherwise one of
+            KIND_GENERATOR, KIND_COROUTINE, KIND_ASYNC_GENERATOR.
+        """
         super().__init__()
         # An inspect.Signature object.
         self.signature = signature
+        if widen_threshold is None:
+            widen_threshold = self.WIDEN_THRESHOLD
+        self.widen_threshold = widen_threshold
+        # Record of widening for arguments and return types:
+        # dict of {argument_name : (types.Type, count), ...} and
+        # dict of {line_number : (types.Type, count), ...}
+        # Where the types.Type is the widened type and count is the total
+        # number of types collapsed into it, including each covered type seen
+        # since.
+        self.widened_arguments = {}
+        self.widened_returns = {}
+        self.widened_yields = {}
+        self.generator_kind = generator_kind
+        # For generators self.return_types is the final return value and these
+        # are the yielded and sent values.
+        # dict of {line_number : set(types.Type), ...}
+        self.yield_types = {}
+        # set(types.Type)
+        self.send_types = set()
+        # Number of yields seen and the classes of the values yielded, this is
+        # used for sampling.
+        self._yield_count = 0
+        self._yield_classes = set()
         # TODO: Track a range of line numbers.
         # 'call' must be always the same line number
         # Since functions can not overlap the 'return' shows function bounds
@@ -182,8 +597,39 @@ class FunctionTypes:
         self.min_line_number = sys.maxsize
         # Largest seen line number
         self.max_line_number = 0
-        # TODO: Track call/return type pairs so we can use the @overload
-        # decorator in the .pyi files.
+        # Track call/return type pairs so we can use the @overload decorator
+        # in the .pyi files.
+        # dict of {types.Type : types.Type, ...} so that each distinct Type is
+        # held once however many rows refer to it. Only the types stored in a
+        # set or a row are interned, see _prune_interned_types().
+        self._interned_types = {}
+        self._interned_types_limit = self.INTERNED_TYPES_PRUNE_MIN
+        # Stack of tuples of argument types for calls that have not yet
+        # returned or raised. This is a stack to cope with recursion.
+        self._call_stack = []
+        # dict of {(tuple(types.Type, ...), kind, types.Type) : count, ...}
+        # where the tuple is the argument types in argument order and kind is
+        # CALL_RETURN_KIND_RETURN or CALL_RETURN_KIND_EXCEPTION.
+        # This has at most MAX_CALL_RETURN_ROWS entries.
+        self.call_return_rows = {}
+        # Number of rows evicted to keep within MAX_CALL_RETURN_ROWS.
+        self.call_return_rows_evicted = 0
+        # Number of returns and exceptions dropped without their value being
+        # seen, see drop_return().
+        self.returns_dropped = 0
+        # True if the types were loaded from a previous run, see
+        # skip_known_call() and skip_known_return().
+        self.settled = False
+        # Fingerprints of the calls and returns recorded in full while settled
+        # or seeded from a baseline, see seed_fingerprints().
+        # set of {(class, ...), ...} of the argument classes in order and
+        # set of {(line_number, class), ...} of the return values where the
+        # line_number is None if seeded.
+        self._call_fingerprints = set()
+        self._return_fingerprints = set()
+        # Count of known calls and returns for sampling and the number skipped.
+        self._settled_count = 0
+        self.settled_skipped = 0
         self.DOCSTRING_STYLE_FUNCTIONS = {
                 'sphinx' : self._docstring_sphinx,
                 'google' : self._docstring_google,
@@ -208,6 +654,19 @@ class FunctionTypes:
         _str_list_add_dict('Exceptions', self.exception_type_strings, str_l)
         str_l.append('Entry points: {!r:s}'.format(self.call_line_numbers))
         str_l.append('Signature: {!s:s}'.format(self.signature))
+        if self.generator_kind is not None:
+            str_l.append('Kind: {:s}'.format(self.generator_kind))
+            _str_list_add_dict('Yield types', self._stringify_dict_of_set(self.yield_types), str_l)
+            str_l.append('Send types: {!r:s}'.format(sorted(str(t) for t in self.send_types)))
+        for title, widened in (('Widened arguments', self.widened_arguments),
+                               ('Widened returns', self.widened_returns),
+                               ('Widened yields', self.widened_yields)):
+            if len(widened):
+                _str_list_add_dict(
+                    title,
+                    {k : '{!s:s} from {:d} types'.format(t, n) for k, (t, n) in widened.items()},
+                    str_l
+                )
         return ', '.join(str_l)
 
     def _stringify_dict_of_set(self, dofs):
@@ -229,6 +688,12 @@ class FunctionTypes:
         There should only be one type in the set."""
         return self._stringify_dict_of_set(self.return_types)
 
+    @property
+    def yield_type_strings(self):
+        """A dict of ``{line_number : set(types, ...), ...}`` for the values
+        yielded by a generator where the types are strings."""
+        return self._stringify_dict_of_set(self.yield_types)
+
     @property
     def exception_type_strings(self):
         """A dict of ``{line_number : set(types, ...), ...}`` for any exceptions
@@ -273,12 +738,27 @@ class FunctionTypes:
         #     varargs - name entry in the locals for *args or None.
         #     keywords - name entry in the locals for *kwargs or None.
         #     locals - dict of {name : value, ...} of arguments.
-        for arg in arg_info.args:
-            t = Type(arg_info.locals[arg])
-            try:
-                self.arguments[arg].add(t)
-            except KeyError:
-                self.arguments[arg] = set([t])
+        self.add_call_types(
+            arg_info.args,
+            [Type(arg_info.locals[arg]) for arg in arg_info.args],
+            file_path,
+            line_number,
+            tuple(type(arg_info.locals[arg]) for arg in arg_info.args) if self.settled else None,
+        )
+
+    def add_call_types(self, arg_names, arg_types, file_path, line_number, fingerprint=None):
+        """As add_call() with the list of argument names and the list of
+        their types.Type objects. fingerprint is the tuple of the classes of
+        the arguments, this is only needed for a settled function."""
+        arg_types = [
+            self._add_to_type_set(self.arguments, self.widened_arguments, arg, t)
+            for arg, t in zip(arg_names, arg_types)
+        ]
+        if self.settled and fingerprint is not None:
+            self._call_fingerprints.add(fingerprint)
+        if self.generator_kind is None:
+            # Call/return pairs are not tracked for generators.
+            self._call_stack.append(tuple(arg_types))
         if len(self.call_line_numbers) == 0:
             # First call
             self.call_line_numbers.append(line_number)
@@ -303,11 +783,18 @@ class FunctionTypes:
         if return_value is None and line_number in self._exception_types:
             # Ignore phantom return value of None immediately after an exception
             return
-        t = Type(return_value)
-        try:
-            self.return_types[line_number].add(t)
-        except KeyError:
-            self.return_types[line_number] = set([t])
+        self.add_return_type(Type(return_value), line_number, type(return_value))
+
+    def add_return_type(self, t, line_number, cls):
+        """As add_return() with the types.Type t of the return value and its
+        class cls."""
+        if cls is type(None) and line_number in self._exception_types:
+            # Ignore phantom return value of None immediately after an exception
+            return
+        if self.settled:
+            self._return_fingerprints.add((line_number, cls))
+        t = self._add_to_type_set(self.return_types, self.widened_returns, line_number, t)
+        self._add_call_return_row(self.CALL_RETURN_KIND_RETURN, t)
         # No general sanity check is possible on the ordering of line numbers
         # since property setters and getters can be called in any order.
         # Generators have a call site at declaration and each yield statement
@@ -316,7 +803,12 @@ class FunctionTypes:
 
     def add_exception(self, exception, line_number):
         """Add an exception."""
-        t = Type(exception)
+        self.add_exception_type(Type(exception), line_number)
+
+    def add_exception_type(self, t, line_number):
+        """As add_exception() with the types.Type t of the exception."""
+        t = self._intern(t)
+        self._add_call_return_row(self.CALL_RETURN_KIND_EXCEPTION, t)
         try:
             self._exception_types[line_number].add(t)
         except KeyError:
@@ -327,8 +819,255 @@ class FunctionTypes:
         self.min_line_number = min(self.min_line_number, line_number)
         self.max_line_number = max(self.max_line_number, line_number)
 
+    def add_resume(self, line_number):
+        """Records that a generator or coroutine has been resumed at a particular
+        line number. This is a continuation, not a new entry point."""
+        self.min_line_number = min(self.min_line_number, line_number)
+        self.max_line_number = max(self.max_line_number, line_number)
+
+    def add_yield(self, yield_value, line_number):
+        """Records a value yielded from a generator at a particular line number.
+        Once YIELD_SAMPLE_FULL values have been seen this only decomposes values
+        of a new class and every YIELD_SAMPLE_INTERVAL'th value."""
+        self.add_resume(line_number)
+        if self.sample_yield(type(yield_value)):
+            self.add_yield_type(Type(yield_value), line_number)
+
+    def sample_yield(self, cls):
+        """Counts a yielded value of class cls and returns True if its type
+        should be recorded, see add_yield()."""
+        self._yield_count += 1
+        if self._yield_count > self.YIELD_SAMPLE_FULL \
+        and cls in self._yield_classes \
+        and self._yield_count % self.YIELD_SAMPLE_INTERVAL:
+            return False
+        self._yield_classes.add(cls)
+        return True
+
+    def add_yield_type(self, t, line_number):
+        """Records the types.Type t of a yielded value that has been sampled
+        by sample_yield()."""
+        self._add_to_type_set(self.yield_types, self.widened_yields, line_number, t)
+
+    def add_send(self, send_value):
+        """Records a value sent into a generator with ``send()``."""
+        self.add_send_type(Type(send_value))
+
+    def add_send_type(self, t):
+        """As add_send() with the types.Type t of the value."""
+        self.send_types.add(self._intern(t))
+
+    def _add_to_type_set(self, type_map, widened, key, t):
+        """Adds the types.Type t to the set type_map[key] and returns the
+        interned t. If key has been widened and t is covered by the widened
+        type then t is only counted in widened[key] and returned as it is.
+        If the set grows beyond widen_threshold then the set is replaced with
+        a single widened type and widened[key] is updated."""
+        if key in widened:
+            widened_type, count = widened[key]
+            if issubclass(t.base_class(), widened_type.base_class()):
+                widened[key] = (widened_type, count + 1)
+                return t
+        t = self._intern(t)
+        try:
+            type_set = type_map[key]
+        except KeyError:
+            type_map[key] = set([t])
+            return t
+        type_set.add(t)
+        if self.widen_threshold and len(type_set) > self.widen_threshold:
+            widened_type = self._intern(widen(type_set))
+            if key in widened:
+                # The previous widened type is in type_set and has already been counted.
+                count = widened[key][1] + len(type_set) - 1
+            else:
+                count = len(type_set)
+            widened[key] = (widened_type, count)
+            type_map[key] = set([widened_type])
+            self._prune_interned_types()
+        return t
+
+    def _intern(self, t):
+        """Returns the interned equivalent of the types.Type t."""
+        return self._interned_types.setdefault(t, t)
+
+    def _prune_interned_types(self):
+        """Drops the interned types that are no longer stored in a set or a
+        row, such as those widened away or in evicted rows. So that this is
+        cheap on average the table is only rebuilt when it has doubled in
+        size since the last time."""
+        if len(self._interned_types) < self._interned_types_limit:
+            return
+        stored = set(self.send_types)
+        for type_map in (self.arguments, self.return_types, self.yield_types, self._exception_types):
+            for type_set in type_map.values():
+                stored.update(type_set)
+        for arg_types, _kind, t in self.call_return_rows:
+            stored.update(arg_types)
+            stored.add(t)
+        # The members of stored are the interned objects themselves.
+        self._interned_types = {t : t for t in stored}
+        self._interned_types_limit = max(self.INTERNED_TYPES_PRUNE_MIN, 2 * len(stored))
+
+    def _add_call_return_row(self, kind, t):
+        """Pairs the return value or exception type t with the argument types
+        of the innermost call in flight and counts that row."""
+        if len(self._call_stack) == 0:
+            # Tracing started within the function.
+            return
+        arg_types = self._call_stack.pop()
+        if arg_types is None:
+            # The call was skipped, see skip_known_call().
+            return
+        self._count_call_return_row((arg_types, kind, t), 1)
+
+    def add_call_return_row(self, arg_types, kind, t, count=1):
+        """Counts calls with the types.Type objects arg_types, in argument
+        order, that returned, or raised, the types.Type t. kind is
+        CALL_RETURN_KIND_RETURN or CALL_RETURN_KIND_EXCEPTION.
+        This is for calls and returns that have been paired elsewhere, such
+        as from an event log, see ``typin.event_log``."""
+        self._count_call_return_row((tuple(arg_types), kind, t), count)
+
+    def _count_call_return_row(self, row, count):
+        """If the table is full the least frequently seen row is evicted.
+        The types of a new row are interned."""
+        try:
+            self.call_return_rows[row] += count
+        except KeyError:
+            if len(self.call_return_rows) >= self.MAX_CALL_RETURN_ROWS:
+                victim = min(self.call_return_rows, key=self.call_return_rows.get)
+                del self.call_return_rows[victim]
+                self.call_return_rows_evicted += 1
+                self._prune_interned_types()
+            arg_types, kind, t = row
+            row = (tuple(self._intern(a) for a in arg_types), kind, self._intern(t))
+            self.call_return_rows[row] = count
+
+    def clear_call_stack(self):
+        """Forgets the calls in flight so that later returns and exceptions
+        are not paired with them."""
+        del self._call_stack[:]
+
+    def _skip_settled(self):
+        """Returns True if a known call or return of a settled function can
+        be skipped, this is False for every SETTLED_SAMPLE_INTERVAL'th one."""
+        self._settled_count += 1
+        if self._settled_count % self.SETTLED_SAMPLE_INTERVAL == 0:
+            return False
+        self.settled_skipped += 1
+        return True
+
+    def seed_fingerprints(self, arg_names):
+        """For a settled function this adds the fingerprints of the classes
+        of the types loaded from a baseline so that even the first call with
+        them need not be recorded, see skip_known_call(). arg_names are the
+        names of the arguments in order. Calls are not seeded if the class of
+        a type can not be found or there are more than MAX_SEEDED_FINGERPRINTS
+        combinations of them. The baseline does not have the lines of the
+        returns so these are seeded for any line."""
+        if not self.settled:
+            return
+        arg_classes = []
+        for name in arg_names:
+            classes = set(class_of_type_str(str(t)) for t in self.arguments.get(name, ()))
+            if len(classes) == 0 or None in classes:
+                break
+            arg_classes.append(classes)
+        else:
+            count = 1
+            for classes in arg_classes:
+                count *= len(classes)
+            if count <= self.MAX_SEEDED_FINGERPRINTS:
+                self._call_fingerprints.update(itertools.product(*arg_classes))
+        for type_set in self.return_types.values():
+            for t in type_set:
+                cls = class_of_type_str(str(t))
+                if cls is not None:
+                    self._return_fingerprints.add((None, cls))
+
+    def skip_known_call(self, fingerprint):
+        """For a settled function this is a cheap check of a call that
+        returns True if the call need not be recorded with add_call().
+        This is so if a call with the same argument classes has been recorded
+        since the function was settled, subject to sampling.
+
+        fingerprint - A tuple of the classes of the arguments in order, as in
+            ``tuple(type(value) for value in argument_values)``.
+
+        This is only for ordinary functions, not generators.
+        """
+        if self.settled and fingerprint in self._call_fingerprints and self._skip_settled():
+            self.skip_call()
+            return True
+        return False
+
+    def skip_known_return(self, return_value, line_number):
+        """As skip_known_call() for a return value, returns True if the
+        return need not be recorded with add_return()."""
+        cls = type(return_value)
+        if self.settled and ((line_number, cls) in self._return_fingerprints
+                             or (None, cls) in self._return_fingerprints) \
+                and self._skip_settled():
+            self.skip_return()
+            return True
+        return False
+
+    def skip_call(self):
+        """Notes a call that is not recorded with add_call() so that the
+        following return or exception is not paired with another call."""
+        if self.generator_kind is None:
+            self._call_stack.append(None)
+
+    def skip_return(self):
+        """Notes a return that is not recorded with add_return()."""
+        if len(self._call_stack):
+            self._call_stack.pop()
+
+    def drop_return(self):
+        """Notes a return or exception that was dropped without its value
+        being seen. If no return is ever recorded then the return type is
+        unknown rather than None, see return_unknown."""
+        self.returns_dropped += 1
+        self.skip_return()
+
+    @property
+    def return_unknown(self):
+        """True if returns were dropped and none were recorded so the return
+        type is not known."""
+        return self.returns_dropped > 0 and not any(self.return_types.values())
+
 #---- END: Data acquisition. ----
 
+    def overloads(self):
+        """Returns a list of pairs ``(argument_types, return_types)`` suitable
+        for writing ``@overload`` variants to a stub file. argument_types is a
+        tuple of ``types.Type`` in argument order and return_types is a set of
+        ``types.Type``. Argument combinations that only ever raised are omitted.
+
+        This returns an empty list when overloads are not appropriate, that is
+        when rows have been evicted, when there are fewer than two or more than
+        MAX_OVERLOADS combinations or when every combination returns the
+        same types.
+
+        :returns: ``list([tuple(tuple([types.Type]), set([types.Type]))])``
+        """
+        if self.call_return_rows_evicted:
+            return []
+        arg_map = {}
+        for arg_types, kind, t in self.call_return_rows:
+            if kind == self.CALL_RETURN_KIND_RETURN:
+                try:
+                    arg_map[arg_types].add(t)
+                except KeyError:
+                    arg_map[arg_types] = set([t])
+        if not 1 < len(arg_map) <= self.MAX_OVERLOADS:
+            return []
+        return_sets = list(arg_map.values())
+        if all(v == return_sets[0] for v in return_sets[1:]):
+            return []
+        return sorted(arg_map.items(), key=lambda v: [str(t) for t in v[0]])
+
     def has_self_first_arg(self):
         """Returns True if 'self' is the first argument i.e. I am a method."""
         arg_types = self.argument_type_strings
@@ -370,7 +1109,7 @@ class FunctionTypes:
         for v in self.return_types.values():
             return_types |= v
         if len(return_types) == 0:
-            sl.append('-> None')
+            sl.append('-> Any' if self.return_unknown else '-> None')
         elif len(return_types) == 1:
             sl.append('-> {:s}'.format(str(return_types.pop())))
         else:
@@ -383,19 +1122,17 @@ class FunctionTypes:
         """Translates a type name if necessary."""
         return self.TYPE_NAME_TRANSLATION.get(name, name)
 
-    def stub_file_str(self):
-        """A string suitable for writing to a stub file.
-        Example::
-
-            def encodebytes(s: bytes) -> bytes: ...
-        """
+    def _stub_file_str(self, arguments, return_types):
+        """Returns a stub file string from an ``OrderedDict`` of
+        ``{argument_name : set(types.Type), ...}`` and a set of return
+        ``types.Type``."""
         sl = ['(']
         arg_str_list = []
-        for arg_name in self.arguments:
+        for arg_name in arguments:
             if arg_name.startswith(self.SELF):
                 arg_str_list.append(self.SELF)
             else:
-                argument_types = sorted(self.arguments[arg_name])
+                argument_types = sorted(arguments[arg_name])
                 if len(argument_types) == 1:
                     arg_str_list.append('{:s}: {:s}'.format(
                         arg_name,
@@ -408,25 +1145,140 @@ class FunctionTypes:
                         )
                     )
         sl.append(', '.join(arg_str_list))
+        sl.append(') -> ')
+        sl.append(self._return_annotation(return_types))
+        sl.append(': ...')
+        return ''.join(sl)
+
+    def _union_str(self, type_set):
+        """Returns the annotation of a set of types.Type, 'None' if empty."""
+        if len(type_set) == 0:
+            return 'None'
+        elif len(type_set) == 1:
+            return self._type(str(next(iter(type_set))))
+        return 'Union[{:s}]'.format(
+            ', '.join(sorted(self._type(str(t)) for t in type_set))
+        )
+
+    def _return_annotation(self, return_types):
+        """Returns the annotation of the return value given the set of
+        types.Type returned. Generators and coroutines are annotated as
+        ``Generator[Y, S, R]``, ``AsyncGenerator[Y, S]`` or
+        ``Coroutine[Any, Any, R]``. The return type is ``Any`` if it is not
+        known, see return_unknown."""
+        if self.generator_kind is None:
+            return self._return_union_str(return_types)
+        yield_types = set()
+        for v in self.yield_types.values():
+            yield_types |= v
+        if self.generator_kind == self.KIND_GENERATOR:
+            return 'Generator[{:s}, {:s}, {:s}]'.format(
+                self._union_str(yield_types),
+                self._union_str(self.send_types),
+                self._return_union_str(return_types),
+            )
+        elif self.generator_kind == self.KIND_ASYNC_GENERATOR:
+            return 'AsyncGenerator[{:s}, {:s}]'.format(
+                self._union_str(yield_types),
+                self._union_str(self.send_types),
+            )
+        assert self.generator_kind == self.KIND_COROUTINE, self.generator_kind
+        return 'Coroutine[Any, Any, {:s}]'.format(self._return_union_str(return_types))
+
+    def _return_union_str(self, return_types):
+        """Returns the annotation of a set of returned types.Type, this is
+        RETURN_UNKNOWN rather than 'None' if the return type is not known."""
+        if len(return_types) == 0 and self.return_unknown:
+            return self.RETURN_UNKNOWN
+        return self._union_str(return_types)
+
+    def _all_return_types(self):
+        """The set of types.Type returned from any line."""
         # self.return_types is a dict of {line_number : set(types.Type), ...}
-        sl.append(') ->')
         return_types = set()
         for v in self.return_types.values():
             return_types |= v
-        if len(return_types) == 0:
-            sl.append(' None')
-        elif len(return_types) == 1:
-            sl.append(' {:s}'.format(self._type(str(return_types.pop()))))
+        return return_types
+
+    def annotation_strings(self, type_set):
+        """Returns a sorted list of the annotation strings of a set of
+        types.Type, these are the members of a Union. ['None'] if empty."""
+        if len(type_set) == 0:
+            return ['None']
+        return sorted(self._type(str(t)) for t in type_set)
+
+    def return_annotation_strings(self):
+        """Returns a sorted list of the annotation strings of the types
+        returned from any line. ['None'] if nothing was returned and
+        [RETURN_UNKNOWN] if the return type is not known."""
+        if self.return_unknown:
+            return [self.RETURN_UNKNOWN]
+        return self.annotation_strings(self._all_return_types())
+
+    def annotation_str(self, type_set):
+        """Returns the PEP 604 union annotation of a set of types.Type suitable
+        for source code, see Type.annotation_str()."""
+        return union_annotation_str(type_set)
+
+    def return_annotation_str(self):
+        """Returns the return annotation suitable for source code, see
+        Type.annotation_str(). Coroutines are annotated with the type
+        they return as that is how ``async def`` is annotated. If the return
+        type is not known this is ``typing.Any``."""
+        if self.return_unknown:
+            return_str = 'typing.' + self.RETURN_UNKNOWN
         else:
-            sl.append(
-                ' Union[{:s}]'.format(
-                    ', '.join(
-                        sorted(self._type(str(t)) for t in return_types)
-                    )
-                )
+            return_str = union_annotation_str(self._all_return_types())
+        if self.generator_kind is None or self.generator_kind == self.KIND_COROUTINE:
+            return return_str
+        yield_types = set()
+        for v in self.yield_types.values():
+            yield_types |= v
+        if self.generator_kind == self.KIND_GENERATOR:
+            return 'collections.abc.Generator[{:s}, {:s}, {:s}]'.format(
+                union_annotation_str(yield_types),
+                union_annotation_str(self.send_types),
+                return_str,
             )
-        sl.append(': ...')
-        return ''.join(sl)
+        assert self.generator_kind == self.KIND_ASYNC_GENERATOR, self.generator_kind
+        return 'collections.abc.AsyncGenerator[{:s}, {:s}]'.format(
+            union_annotation_str(yield_types),
+            union_annotation_str(self.send_types),
+        )
+
+    def return_annotation(self):
+        """Returns the return annotation as a string, for example
+        ``'Union[bytes, str]'`` or ``'Generator[int, None, None]'``."""
+        return self._return_annotation(self._all_return_types())
+
+    def stub_file_str(self):
+        """A string suitable for writing to a stub file.
+        Example::
+
+            def encodebytes(s: bytes) -> bytes: ...
+        """
+        return self._stub_file_str(self.arguments, self._all_return_types())
+
+    def stub_file_strs(self, use_overloads=True):
+        """A list of strings suitable for writing to a stub file.
+        If use_overloads is True and ``overloads()`` is non-empty then this
+        is one string per ``@overload`` variant, otherwise this is
+        ``[self.stub_file_str()]``.
+        Example of overload variants::
+
+            ['(s: bytes) -> bytes: ...', '(s: str) -> str: ...']
+        """
+        overloads = self.overloads() if use_overloads else []
+        if len(overloads) == 0:
+            return [self.stub_file_str()]
+        arg_names = list(self.arguments.keys())
+        ret = []
+        for arg_types, return_types in overloads:
+            arguments = collections.OrderedDict(
+                (name, set([t])) for name, t in zip(arg_names, arg_types)
+            )
+            ret.append(self._stub_file_str(arguments, return_types))
+        return ret
 
     def _insert_doc_marker(self, suffix):
         return '<insert documentation for {:s}>'.format(suffix).replace(' ', '_')
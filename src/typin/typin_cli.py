@@ -2,12 +2,20 @@
 """Main module."""
 import argparse
 import datetime
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
 import sys
+import tempfile
 import time
 import traceback
 
+from typin import annotation_writer
+from typin import import_hook
+from typin import snapshot
+from typin import stub_merge
 from typin import type_inferencer
 
 def _new_file_path(root, file_path, makedirs=False, new_ext=''):
@@ -24,8 +32,177 @@ def _new_file_path(root, file_path, makedirs=False, new_ext=''):
         os.makedirs(out_dir)
     return out_path
 
-def write_all_stub_files(ti, stubs_dir):
-    """Writes out stubs files.
+#: Files per task given to a worker process.
+STUB_FILES_PER_TASK = 64
+DOCSTRING_FILES_PER_TASK = 16
+ANNOTATION_FILES_PER_TASK = 16
+# The TypeInferencer for worker processes. This is set before the pool is
+# forked so each worker inherits a copy-on-write snapshot of it rather than
+# having it pickled, it can contain classes that are not importable.
+_WORKER_TI = None
+# The manifest for worker processes, inherited in the same way.
+_STUB_WRITER_MANIFEST = {}
+#: The manifest of stub file hashes is the stubs directory name with this suffix.
+STUBS_MANIFEST_SUFFIX = '.manifest.json'
+STUBS_MANIFEST_VERSION = 1
+
+def _new_file_mode():
+    """Returns the permissions that open() would give a new file."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+def _write_file_atomically(out_path, lines):
+    """Writes the iterable of strings to out_path via a temporary file in the
+    same directory and a rename so that a reader never sees a partially
+    written file. An existing file keeps its permissions, a new file gets
+    the same permissions as open() would give it."""
+    try:
+        mode = os.stat(out_path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = _new_file_mode()
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(out_path),
+                                     prefix='.' + os.path.basename(out_path),
+                                     suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as stream:
+            stream.writelines(lines)
+        # mkstemp() creates the file as owner read/write only.
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, out_path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+def stubs_manifest_path(stubs_dir):
+    """Returns the path of the manifest for a stubs directory, this is next to
+    the directory rather than in it so it is not mistaken for a stub."""
+    return os.path.abspath(stubs_dir).rstrip(os.sep) + STUBS_MANIFEST_SUFFIX
+
+def read_stubs_manifest(stubs_dir):
+    """Returns the manifest as a dict of ``{relative_path : sha256, ...}`` or an
+    empty dict if there is no manifest or it is not readable."""
+    try:
+        with open(stubs_manifest_path(stubs_dir)) as stream:
+            manifest = json.load(stream)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as err:
+        logging.warning('Ignoring unreadable stubs manifest: {!r:s}: {:s}'.format(type(err), str(err)))
+        return {}
+    if manifest.get('version') != STUBS_MANIFEST_VERSION:
+        return {}
+    return manifest['files']
+
+def write_stubs_manifest(stubs_dir, files):
+    """Writes the manifest, files is a dict of ``{relative_path : sha256, ...}``."""
+    text = json.dumps({'version' : STUBS_MANIFEST_VERSION, 'files' : files},
+                      indent=1, sort_keys=True)
+    _write_file_atomically(stubs_manifest_path(stubs_dir), (text, '\n'))
+
+def _merge_stub_file(ti, file_path, out_path):
+    """Merges the types for file_path into the existing stub at out_path.
+    Returns the merge result and the existing text."""
+    with open(out_path) as stream:
+        existing = stream.read()
+    return stub_merge.merge_stub(existing, ti.function_map[file_path]), existing
+
+def _write_stub_files(file_paths, stubs_dir, use_overloads, header, merge=False):
+    """Writes the stub files for the given file paths using _WORKER_TI.
+    A file is only written if the hash of its content, which excludes the
+    header, differs from that in _STUB_WRITER_MANIFEST or the file is missing.
+    If merge is True then existing stub files have the types merged into them
+    rather than being replaced.
+    Returns a list of ``(out_path, line_count, sha256, written, merge_result)``
+    where merge_result is None if the file was not merged."""
+    ti = _WORKER_TI
+    dirs_created = set()
+    result = []
+    for file_path in file_paths:
+        out_path = _new_file_path(stubs_dir, file_path)
+        out_dir = os.path.dirname(out_path)
+        try:
+            if merge and os.path.exists(out_path):
+                merge_result, existing = _merge_stub_file(ti, file_path, out_path)
+                lines = (merge_result.text,)
+                digest = hashlib.sha256(merge_result.text.encode('utf-8')).hexdigest()
+                written = merge_result.text != existing
+                line_count = merge_result.text.count('\n')
+            else:
+                merge_result = None
+                stub_file_contents = ti.pretty_format(file_path, add_line_number_as_comment=True,
+                                                      use_overloads=use_overloads)
+                body = stub_file_contents + '\n'
+                lines = (header, body)
+                digest = hashlib.sha256(body.encode('utf-8')).hexdigest()
+                written = _STUB_WRITER_MANIFEST.get(os.path.relpath(out_path, stubs_dir)) != digest \
+                    or not os.path.exists(out_path)
+                line_count = stub_file_contents.count('\n') + 1
+            if written:
+                if out_dir not in dirs_created:
+                    os.makedirs(out_dir, exist_ok=True)
+                    dirs_created.add(out_dir)
+                _write_file_atomically(out_path, lines)
+        except Exception as err:
+            logging.error('Could not write stub file {:s}: {!r:s}: {:s}'.format(out_path, type(err), str(err)))
+            logging.error(''.join(traceback.format_exception(*sys.exc_info())))
+        else:
+            result.append((out_path, line_count, digest, written, merge_result))
+    return result
+
+def _write_stub_files_task(task):
+    """Pool entry point, task is the argument tuple for _write_stub_files()."""
+    return _write_stub_files(*task)
+
+def _map_tasks(ti, task_function, tasks, jobs):
+    """Returns the list of task_function(task) for each task. These are run
+    in a pool of jobs forked processes that inherit ti as _WORKER_TI.
+    Where fork is not available, or jobs is 1, they are run in this process.
+    Returns the results and the number of processes used."""
+    global _WORKER_TI
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(min(jobs, len(tasks)), 1)
+    _WORKER_TI = ti
+    try:
+        if jobs > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            with multiprocessing.get_context('fork').Pool(jobs) as pool:
+                return pool.map(task_function, tasks), jobs
+        return [task_function(task) for task in tasks], 1
+    finally:
+        _WORKER_TI = None
+
+def _prune_stale_stubs(stubs_dir, stale_paths):
+    """Removes stale stub files given as paths relative to stubs_dir, and any
+    directories that become empty. Returns the number of files removed."""
+    count = 0
+    for rel_path in sorted(stale_paths):
+        out_path = os.path.join(stubs_dir, rel_path)
+        try:
+            os.unlink(out_path)
+        except FileNotFoundError:
+            pass
+        else:
+            print('Pruned: {:s}'.format(out_path))
+            count += 1
+        out_dir = os.path.dirname(out_path)
+        while out_dir != stubs_dir and out_dir.startswith(stubs_dir):
+            try:
+                os.rmdir(out_dir)
+            except OSError:
+                break
+            out_dir = os.path.dirname(out_dir)
+    return count
+
+def write_all_stub_files(ti, stubs_dir, use_overloads=True, jobs=None, prune_stale=False,
+                         merge=False):
+    """Writes out stubs files. The files are partitioned across a pool of
+    worker processes, each of which inherits a snapshot of the type inferencer
+    when it is forked. Where fork is not available, or jobs is 1, the files
+    are written serially in this process.
+
+    A manifest of content hashes is kept next to the stubs directory and a
+    file is only rewritten when its content, ignoring the header, changes.
 
     :param ti: The type inferencer.
     :type ti: ``typin.type_inferencer.TypeInferencer``
@@ -33,31 +210,68 @@ def write_all_stub_files(ti, stubs_dir):
     :param stubs_dir: The directory to write to.
     :type stubs_dir: ``str``
 
-    :return: ``NoneType``
+    :param use_overloads: Write ``@overload`` variants where appropriate.
+    :type use_overloads: ``bool``
+
+    :param jobs: Number of worker processes, None for the number of CPUs.
+    :type jobs: ``int, NoneType``
+
+    :param prune_stale: Remove stubs in the manifest that were not generated by this run.
+    :type prune_stale: ``bool``
+
+    :param merge: Merge the types into existing stub files, see :py:mod:`typin.stub_merge`.
+    :type merge: ``bool``
+
+    :return: The stub files, line counts and whether they were (re)written, sorted by path.
+    :rtype: ``list([tuple([str, int, bool])])``
     """
+    global _STUB_WRITER_MANIFEST
     assert stubs_dir != ''
     stubs_dir = os.path.abspath(stubs_dir)
     print(' write_all_stub_files() '.center(75, '-'))
-    for file_path in sorted(ti.file_paths()):
-        if os.path.splitext(file_path)[1] == '.py':
-            out_path = _new_file_path(stubs_dir, file_path, makedirs=True)
-            try:
-                stub_file_contents = ti.pretty_format(file_path, add_line_number_as_comment=True)
-            except Exception as err:
-                logging.error('Could not write stub file string to {:s}: {!r:s}: {:s}'.format(out_path, type(err), str(err)))
-                logging.error(''.join(traceback.format_exception(*sys.exc_info())))
-            else:
-                print('{:s} [{:d}]'.format(out_path, stub_file_contents.count('\n') + 1))
-                with open(out_path, 'w') as stream:
-                    now = datetime.datetime.now()
-                    stream.write('# Generated by typin_cli.py on {:s}\n'.format(now.strftime('%c')))
-                    try:
-                        stream.write(stub_file_contents)
-                    except Exception as err:
-                        logging.error('Could not write docstring to {:s}: {!r:s}: {:s}'.format(out_path, type(err), str(err)))
-                        logging.error(''.join(traceback.format_exception(*sys.exc_info())))
-                    stream.write('\n')
+    start_time = time.perf_counter()
+    file_paths = [f for f in sorted(ti.file_paths()) if os.path.splitext(f)[1] == '.py']
+    header = '# Generated by typin_cli.py on {:s}\n'.format(datetime.datetime.now().strftime('%c'))
+    tasks = [
+        (file_paths[i:i + STUB_FILES_PER_TASK], stubs_dir, use_overloads, header, merge)
+        for i in range(0, len(file_paths), STUB_FILES_PER_TASK)
+    ]
+    old_manifest = read_stubs_manifest(stubs_dir)
+    _STUB_WRITER_MANIFEST = old_manifest
+    try:
+        results, jobs = _map_tasks(ti, _write_stub_files_task, tasks, jobs)
+    finally:
+        _STUB_WRITER_MANIFEST = {}
+    stubs = sorted(r for result in results for r in result)
+    new_manifest = {
+        os.path.relpath(out_path, stubs_dir) : digest for out_path, _n, digest, _w, _m in stubs
+    }
+    stale_paths = set(old_manifest) - set(new_manifest)
+    pruned = 0
+    if prune_stale:
+        pruned = _prune_stale_stubs(stubs_dir, stale_paths)
+    else:
+        # Keep them, they may be from a run over other code.
+        for rel_path in stale_paths:
+            new_manifest[rel_path] = old_manifest[rel_path]
+    if new_manifest != old_manifest:
+        os.makedirs(stubs_dir, exist_ok=True)
+        write_stubs_manifest(stubs_dir, new_manifest)
+    written = 0
+    for out_path, line_count, _digest, was_written, merge_result in stubs:
+        if merge_result is not None:
+            print('{:s} [{:d}] merged: added {:d} widened {:d}'.format(
+                out_path, line_count, merge_result.added, merge_result.widened))
+        elif was_written:
+            print('{:s} [{:d}]'.format(out_path, line_count))
+        written += was_written
+    elapsed = time.perf_counter() - start_time
+    print('Wrote {:d}, unchanged {:d}, pruned {:d} of {:d} files in {:.3f} (s)'
+          ' {:.1f} files/s using {:d} process(es)'.format(
+              written, len(stubs) - written, pruned, len(file_paths), elapsed,
+              len(stubs) / elapsed if elapsed > 0 else 0.0, jobs))
     print(' DONE: write_all_stub_files() '.center(75, '-'))
+    return [(out_path, line_count, was_written) for out_path, line_count, _d, was_written, _m in stubs]
 
 def dump_docstrings(ti, style, stream=sys.stdout, reverse_lines=False):
     stream.write(' dump_docstrings '.center(75, '-'))
@@ -88,8 +302,38 @@ def dump_docstrings(ti, style, stream=sys.stdout, reverse_lines=False):
     stream.write(' END: dump_docstrings '.center(75, '-'))
     stream.write('\n')
 
-def insert_docstrings(ti, doc_dir, style):
-    """Writes out source files with documentation strings.
+def _insert_docstrings_in_files(file_paths, doc_dir, style):
+    """Writes the source files with docstrings using _WORKER_TI.
+    Returns a list of ``(out_path, number_of_docstrings)`` for the files written."""
+    ti = _WORKER_TI
+    dirs_created = set()
+    result = []
+    for file_path in file_paths:
+        out_path = _new_file_path(doc_dir, file_path)
+        out_dir = os.path.dirname(out_path)
+        if out_dir not in dirs_created:
+            os.makedirs(out_dir, exist_ok=True)
+            dirs_created.add(out_dir)
+        try:
+            docstring_map = ti.docstring_map(file_path, style=style)
+            _write_file_atomically(
+                out_path, ti.iter_insert_docstrings(file_path, style=style, docstring_map=docstring_map)
+            )
+        except Exception as err:
+            logging.error('Could not write docstrings to {:s}: {!r:s}: {:s}'.format(out_path, type(err), str(err)))
+            logging.error(''.join(traceback.format_exception(*sys.exc_info())))
+        else:
+            result.append((out_path, len(docstring_map)))
+    return result
+
+def _insert_docstrings_task(task):
+    """Pool entry point, task is the argument tuple for _insert_docstrings_in_files()."""
+    return _insert_docstrings_in_files(*task)
+
+def insert_docstrings(ti, doc_dir, style, jobs=None):
+    """Writes out source files with documentation strings. The files are
+    partitioned across a pool of worker processes in the same way as
+    :py:func:`write_all_stub_files`.
 
     :param ti: The type inferencer.
     :type ti: ``typin.type_inferencer.TypeInferencer``
@@ -97,18 +341,105 @@ def insert_docstrings(ti, doc_dir, style):
     :param doc_dir: The directory to write to.
     :type doc_dir: ``str``
 
-    :return: ``NoneType``
+    :param style: Docstring style.
+    :type style: ``str``
+
+    :param jobs: Number of worker processes, None for the number of CPUs.
+    :type jobs: ``int, NoneType``
+
+    :return: The files written and the number of docstrings inserted, sorted by path.
+    :rtype: ``list([tuple([str, int])])``
     """
     print(' insert_docstrings() '.center(75, '-'))
+    start_time = time.perf_counter()
     # dict of {file_path : { namespace : { function_name : FunctionTypes, ...}, ...}
-    for file_path in sorted(ti.file_paths()):
-        out_path = _new_file_path(doc_dir, file_path, makedirs=True)
-        print('{:s} [{:d}]'.format(out_path, ti.num_docstrings_to_insert(file_path)))
-        src_lines = ti.insert_docstrings(file_path, style=style)
-        with open(out_path, 'w') as f:
-            for aline in src_lines:
-                f.write(aline)
+    file_paths = sorted(ti.file_paths())
+    tasks = [
+        (file_paths[i:i + DOCSTRING_FILES_PER_TASK], doc_dir, style)
+        for i in range(0, len(file_paths), DOCSTRING_FILES_PER_TASK)
+    ]
+    results, jobs = _map_tasks(ti, _insert_docstrings_task, tasks, jobs)
+    written = sorted(r for result in results for r in result)
+    for out_path, count in written:
+        print('{:s} [{:d}]'.format(out_path, count))
+    elapsed = time.perf_counter() - start_time
+    print('Wrote {:d} of {:d} files in {:.3f} (s) {:.1f} files/s using {:d} process(es)'.format(
+        len(written), len(file_paths), elapsed,
+        len(written) / elapsed if elapsed > 0 else 0.0, jobs))
     print(' DONE: insert_docstrings() '.center(75, '-'))
+    return written
+
+def _annotate_files(file_paths, out_dir):
+    """Writes the source files with annotations using _WORKER_TI. If out_dir
+    is None the files are rewritten in place.
+    Returns a list of ``(out_path, added, skipped)`` for the files written."""
+    ti = _WORKER_TI
+    dirs_created = set()
+    result = []
+    for file_path in file_paths:
+        if out_dir is None:
+            out_path = file_path
+        else:
+            out_path = _new_file_path(out_dir, file_path)
+        try:
+            with open(file_path) as stream:
+                source = stream.read()
+            annotated = annotation_writer.annotate_source(source, ti.function_map[file_path],
+                                                          annotation_writer.module_name_of(file_path))
+            if out_dir is not None or annotated.text != source:
+                out_dir_path = os.path.dirname(out_path)
+                if out_dir_path not in dirs_created:
+                    os.makedirs(out_dir_path, exist_ok=True)
+                    dirs_created.add(out_dir_path)
+                _write_file_atomically(out_path, (annotated.text,))
+        except Exception as err:
+            logging.error('Could not annotate {:s}: {!r:s}: {:s}'.format(file_path, type(err), str(err)))
+            logging.error(''.join(traceback.format_exception(*sys.exc_info())))
+        else:
+            result.append((out_path, annotated.added, annotated.skipped))
+    return result
+
+def _annotate_files_task(task):
+    """Pool entry point, task is the argument tuple for _annotate_files()."""
+    return _annotate_files(*task)
+
+def write_annotations(ti, out_dir=None, jobs=None):
+    """Writes the observed types into the function signatures of the traced
+    source files as PEP 484 annotations, see :py:mod:`typin.annotation_writer`.
+    The files are partitioned across a pool of worker processes in the same
+    way as :py:func:`write_all_stub_files`.
+
+    :param ti: The type inferencer.
+    :type ti: ``typin.type_inferencer.TypeInferencer``
+
+    :param out_dir: The directory to write to, if None the source files are
+        rewritten in place.
+    :type out_dir: ``str, NoneType``
+
+    :param jobs: Number of worker processes, None for the number of CPUs.
+    :type jobs: ``int, NoneType``
+
+    :return: The files, annotations added and functions skipped as their
+        source has changed, sorted by path.
+    :rtype: ``list([tuple([str, int, int])])``
+    """
+    print(' write_annotations() '.center(75, '-'))
+    start_time = time.perf_counter()
+    file_paths = [f for f in sorted(ti.file_paths()) if os.path.splitext(f)[1] == '.py']
+    tasks = [
+        (file_paths[i:i + ANNOTATION_FILES_PER_TASK], out_dir)
+        for i in range(0, len(file_paths), ANNOTATION_FILES_PER_TASK)
+    ]
+    results, jobs = _map_tasks(ti, _annotate_files_task, tasks, jobs)
+    written = sorted(r for result in results for r in result)
+    for out_path, added, skipped in written:
+        print('{:s} added {:d} skipped {:d}'.format(out_path, added, skipped))
+    elapsed = time.perf_counter() - start_time
+    print('Annotated {:d} of {:d} files in {:.3f} (s) {:.1f} files/s using {:d} process(es)'.format(
+        len(written), len(file_paths), elapsed,
+        len(written) / elapsed if elapsed > 0 else 0.0, jobs))
+    print(' DONE: write_annotations() '.center(75, '-'))
+    return written
 
 def dump_type_inferencer(ti, stream=sys.stdout):
     """Dumps complete internal representation to stream."""
@@ -127,11 +458,18 @@ def print_pretty_format(ti, root_path, stream=sys.stdout):
 #         print(os.path.join(cli_args.stubs, file_path))
         stream.write(file_path)
         stream.write('\n')
-        stream.write(ti.pretty_format(key))
-        stream.write('\n')
+        ti.write_pretty_format(stream, key)
     stream.write(' END: ti.pretty_format() '.center(75, '-'))
     stream.write('\n')
 
+def write_dump(ti, root_path, style, stream=sys.stdout):
+    """Writes the pretty format, internal representation and docstrings to
+    the stream. These are written as they are generated so memory use does not
+    grow with the size of the trace."""
+    print_pretty_format(ti, root_path, stream)
+    dump_type_inferencer(ti, stream)
+    dump_docstrings(ti, style, stream)
+
 class BaseClass:
     def __init__(self):
         pass
@@ -163,8 +501,24 @@ def test():
     print(' typin_cli.test() ti.dump() '.center(75, '-'))
     ti.dump()
 
-def compile_and_exec(filename, trace_frame_events, events_to_trace, *args, **kwargs):
-    """Main execution point to trace function calls."""
+#: Trace every function with sys.settrace().
+MODE_SETTRACE = 'settrace'
+#: Only record the functions of modules imported that match the --instrument
+#: patterns, see typin.import_hook.
+MODE_IMPORT_HOOK = 'import-hook'
+MODES = (MODE_SETTRACE, MODE_IMPORT_HOOK)
+
+def compile_and_exec(filename, trace_frame_events, events_to_trace, *args,
+                     widen_threshold=None, baseline=None, mode=MODE_SETTRACE,
+                     instrument_patterns=(), deferred=False, event_log=None, **kwargs):
+    """Main execution point to trace function calls. baseline is a snapshot
+    of a previous run, see TypeInferencer.load_baseline(). If deferred the
+    types are created on a background thread, see typin.deferred.
+    If event_log is a path the events are only logged to that file, see
+    TypeInferencer.process_event_log().
+    With MODE_IMPORT_HOOK there is no tracing, only the functions in modules
+    matching instrument_patterns that are imported are recorded, deferred and
+    event_log are not supported."""
     print('TRACE: compile_and_exec()', filename, args, kwargs)
     sys.argv = [filename] + list(args)
     logging.debug('typein_cli.compile_and_exec({:s})'.format(filename))
@@ -172,12 +526,28 @@ def compile_and_exec(filename, trace_frame_events, events_to_trace, *args, **kwa
         src = f_obj.read()
         logging.debug('typein_cli.compile_and_exec() read {:d} lines'.format(src.count('\n')))
         code = compile(src, filename, 'exec')
-        with type_inferencer.TypeInferencer(trace_frame_events, events_to_trace or None) as ti:
-            try:
-                exec(code, globals())#, locals())
-            except SystemExit:
-                # Trap CLI code that calls exit() or sys.exit()
-                pass
+        if mode == MODE_IMPORT_HOOK:
+            ti = type_inferencer.TypeInferencer(trace_frame_events, events_to_trace or None,
+                                                widen_threshold=widen_threshold,
+                                                baseline=baseline)
+            with import_hook.instrumented_imports(instrument_patterns, ti):
+                try:
+                    exec(code, globals())#, locals())
+                except SystemExit:
+                    # Trap CLI code that calls exit() or sys.exit()
+                    pass
+            # As TypeInferencer.__exit__() when tracing.
+            ti._cleanup()
+        else:
+            with type_inferencer.TypeInferencer(trace_frame_events, events_to_trace or None,
+                                                widen_threshold=widen_threshold,
+                                                baseline=baseline, deferred=deferred,
+                                                event_log=event_log) as ti:
+                try:
+                    exec(code, globals())#, locals())
+                except SystemExit:
+                    # Trap CLI code that calls exit() or sys.exit()
+                    pass
     return ti
 
 def main():
@@ -191,7 +561,7 @@ def main():
     control of typin and write all the type annotations to the stubs/ directory.
     """
     start_time = time.time()
-    start_clock = time.clock()
+    start_clock = time.process_time()
     program_version = "v%s" % '0.1.0'
     program_shortdesc = 'typin_cli - Infer types of Python functions.'
     program_license = """%s
@@ -212,16 +582,63 @@ USAGE
     parser.add_argument("-d", "--dump", action="store_true", dest="dump",
                          default=False,
                       help="Dump results on stdout after processing. [default: %(default)s]")
+    parser.add_argument("--dump-file", type=str, dest="dump_file", default="",
+                        help="Write the --dump results to this file rather than stdout,"
+                        " this implies --dump. [default: %(default)s]")
+    parser.add_argument("--snapshot", type=str, dest="snapshot", default="",
+                        help="Save a snapshot of the types as JSON to this file for comparison"
+                        " with typin_diff. [default: %(default)s]")
+    parser.add_argument("--baseline", type=str, dest="baseline", default="",
+                        help="Load a snapshot of a previous run, the functions in it are only"
+                        " sampled unless they see new types. [default: %(default)s]")
+    parser.add_argument("--pretty-format-file", type=str, dest="pretty_format_file", default="",
+                        help="Write the stubs for every file to this single file. [default: %(default)s]")
+    parser.add_argument("--mode", type=str, dest="mode", default=MODE_SETTRACE, choices=MODES,
+                        help="How to record types, '{:s}' traces every function, '{:s}' only"
+                        " wraps the functions of imported modules that match --instrument."
+                        " [default: %(default)s]".format(MODE_SETTRACE, MODE_IMPORT_HOOK))
+    parser.add_argument("--instrument", action='append', default=[], dest="instrument",
+                        help="With --mode={:s} the name of a package or module to record,"
+                        " wildcards can be used (additive).".format(MODE_IMPORT_HOOK))
+    parser.add_argument("--deferred", action="store_true", dest="deferred", default=False,
+                        help="Only take a shallow snapshot of values when tracing and create"
+                        " the types on a background thread. Observations may be dropped"
+                        " under load, see --stats. [default: %(default)s]")
+    parser.add_argument("--event-log", type=str, dest="event_log", default="",
+                        help="Only log the events to this file while tracing, the types are"
+                        " found from the log afterwards using --jobs processes."
+                        " [default: %(default)s]")
+    parser.add_argument("--stats", action="store_true", dest="stats", default=False,
+                        help="Print the time typin spent by phase, the events by file and"
+                        " function and cache hit rates. [default: %(default)s]")
     parser.add_argument("-t", "--trace-frame-events", action="store_true", dest="trace_frame_events",
                         default=False,
                         help="""Very verbose trace output, one line per frame event. [default: %(default)s]""")
     parser.add_argument("-e", "--events-to-trace", action='append', default=[], dest="events_to_trace",
                         help="Events to trace (additive). [default: %(default)s] i.e. every event.")
+    parser.add_argument("--widen-threshold", type=int, dest="widen_threshold", default=None,
+                        help="Collapse a set of types to a common base type once it has more than"
+                        " this many members, 0 disables. [default: %(default)s] i.e. the typin default.")
     parser.add_argument("-s", "--stubs",
                          type=str,
                          dest="stubs",
                          default="",
                          help="Directory to write stubs files. [default: %(default)s]")
+    parser.add_argument("-j", "--jobs", type=int, dest="jobs", default=None,
+                        help="Number of processes to write stubs and docstrings files, and to"
+                        " process an --event-log, with."
+                        " [default: %(default)s] i.e. the number of CPUs.")
+    parser.add_argument("--merge-stubs", action="store_true", dest="merge_stubs",
+                        default=False,
+                        help="Merge types into existing stubs files, only adding missing"
+                        " annotations and widening narrower ones. [default: %(default)s]")
+    parser.add_argument("--prune-stale", action="store_true", dest="prune_stale",
+                        default=False,
+                        help="Remove stubs files from earlier runs that were not generated by this run."
+                        " [default: %(default)s]")
+    parser.add_argument("--no-overloads", action="store_false", dest="use_overloads",
+                        default=True,
+                        help="Do not write @overload variants to the stubs files. [default: overloads are written]")
     parser.add_argument(
         "-w", "--write-docstrings",
         type=str,
@@ -229,6 +646,13 @@ USAGE
         default="",
         help="Directory to write source code with docstrings. [default: %(default)s]"
     )
+    parser.add_argument("--write-annotations", type=str, dest="write_annotations", default="",
+                        help="Directory to write source code with type annotations added to"
+                        " the function signatures. [default: %(default)s]")
+    parser.add_argument("--annotate-in-place", action="store_true", dest="annotate_in_place",
+                        default=False,
+                        help="Add type annotations to the function signatures of the traced"
+                        " source files themselves. [default: %(default)s]")
     parser.add_argument(
         "--docstring-style",
         type=str,
@@ -267,23 +691,55 @@ USAGE
     root_path = os.path.abspath(os.path.normpath(cli_args.root))
 #     test()
     target_args = cli_args.argstring.split(' ')
+    if cli_args.mode == MODE_IMPORT_HOOK and not cli_args.instrument:
+        parser.error('--mode={:s} needs at least one --instrument pattern'.format(MODE_IMPORT_HOOK))
+    if cli_args.mode == MODE_IMPORT_HOOK and (cli_args.deferred or cli_args.event_log):
+        parser.error('--mode={:s} can not be used with --deferred or --event-log'.format(MODE_IMPORT_HOOK))
+    baseline = None
+    if cli_args.baseline:
+        baseline = snapshot.load(cli_args.baseline)
     # Execution point
     ti = compile_and_exec(cli_args.program, cli_args.trace_frame_events,
-                          cli_args.events_to_trace, *target_args)
+                          cli_args.events_to_trace, *target_args,
+                          widen_threshold=cli_args.widen_threshold,
+                          baseline=baseline, mode=cli_args.mode,
+                          instrument_patterns=cli_args.instrument,
+                          deferred=cli_args.deferred,
+                          event_log=cli_args.event_log or None)
+    if cli_args.event_log:
+        ti.process_event_log(cli_args.jobs)
     # Output: stubs, docstrings and dump.
     if cli_args.stubs:
-        write_all_stub_files(ti, cli_args.stubs)
+        write_all_stub_files(ti, cli_args.stubs, cli_args.use_overloads, cli_args.jobs,
+                             cli_args.prune_stale, cli_args.merge_stubs)
     if cli_args.write_docstrings:
-        insert_docstrings(ti, cli_args.write_docstrings, cli_args.docstring_style)
-    if cli_args.dump:
-        print_pretty_format(ti, root_path)
-        dump_type_inferencer(ti)
-        dump_docstrings(ti, cli_args.docstring_style)
+        insert_docstrings(ti, cli_args.write_docstrings, cli_args.docstring_style, cli_args.jobs)
+    if cli_args.write_annotations:
+        write_annotations(ti, cli_args.write_annotations, cli_args.jobs)
+    elif cli_args.annotate_in_place:
+        write_annotations(ti, None, cli_args.jobs)
+    if cli_args.snapshot:
+        snapshot.save(ti, cli_args.snapshot)
+        print('Wrote snapshot {:s}'.format(cli_args.snapshot))
+    if cli_args.pretty_format_file:
+        with open(cli_args.pretty_format_file, 'w') as stream:
+            line_count = ti.write_pretty_format(stream, add_line_number_as_comment=True,
+                                                use_overloads=cli_args.use_overloads)
+        print('Wrote {:s} [{:d}]'.format(cli_args.pretty_format_file, line_count))
+    if cli_args.dump_file:
+        with open(cli_args.dump_file, 'w') as stream:
+            write_dump(ti, root_path, cli_args.docstring_style, stream)
+        print('Wrote {:s}'.format(cli_args.dump_file))
+    elif cli_args.dump:
+        write_dump(ti, root_path, cli_args.docstring_style)
     # Summary.
     print('TypeInferencer total events: {:d}'.format(ti.eventno))
     print(' TypeInferencer event count:', ti.event_counter)
+    if cli_args.stats:
+        print(' TypeInferencer stats '.center(75, '-'))
+        print(ti.stats_report())
     print(' CPU time = {:8.3f} (S)'.format(time.time() - start_time))
-    print('CPU clock = {:8.3f} (S)'.format(time.clock() - start_clock))
+    print('CPU clock = {:8.3f} (S)'.format(time.process_time() - start_clock))
     print('Bye, bye!')
     print(' FINISH: typin_cli '.center(75, '='))
     return 0
@@ -0,0 +1,138 @@
+'''
+Tests for writing annotations into source code.
+'''
+import asyncio
+import fractions
+import importlib.util
+import typing
+
+import pytest
+
+from typin import annotation_writer
+from typin import type_inferencer
+
+SOURCE = '''"""Docstring."""
+import os
+
+def f(a, b=1, *args, c=None, **kw):
+    return [a]
+
+class K:
+    @staticmethod
+    def g(x,
+          y):  # Comment
+        return None
+
+    def h(self, z):
+        yield z
+
+    async def co(self):
+        return 1
+
+    def annotated(self, p: str) -> str:
+        return p
+'''
+
+EXPECTED = '''"""Docstring."""
+from __future__ import annotations
+import collections.abc
+import os
+
+def f(a: int | str, b: int = 1, *args, c: int | None = None, **kw) -> list[int] | list[str]:
+    return [a]
+
+class K:
+    @staticmethod
+    def g(x: float,
+          y: tuple[int, str]) -> None:  # Comment
+        return None
+
+    def h(self, z: int) -> collections.abc.Generator[int, None, None]:
+        yield z
+
+    async def co(self) -> int:
+        return 1
+
+    def annotated(self, p: str) -> str:
+        return p
+'''
+
+def _trace(path):
+    spec = importlib.util.spec_from_file_location('annotation_example', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    with type_inferencer.TypeInferencer() as ti:
+        module.f(1, c=2)
+        module.f('s')
+        module.K.g(1.0, (1, 'a'))
+        list(module.K().h(3))
+        asyncio.run(module.K().co())
+        module.K().annotated('s')
+    return ti
+
+@pytest.fixture
+def source_path(tmpdir):
+    path = tmpdir.join('annotation_example.py')
+    path.write(SOURCE)
+    return str(path)
+
+def test_annotate_source(source_path):
+    ti = _trace(source_path)
+    result = annotation_writer.annotate_source(SOURCE, ti.function_map[source_path])
+    assert result.text == EXPECTED
+    assert (result.added, result.skipped) == (10, 0)
+
+def test_annotate_source_changed_signature(source_path):
+    ti = _trace(source_path)
+    source = SOURCE.replace('def f(a, b=1,', 'def f(a, b=1, extra=2,')
+    result = annotation_writer.annotate_source(source, ti.function_map[source_path])
+    assert 'def f(a, b=1, extra=2, *args, c=None, **kw):\n' in result.text
+    assert result.skipped == 1
+
+def test_annotate_source_existing_future_import(source_path):
+    ti = _trace(source_path)
+    source = SOURCE.replace('import os\n', 'from __future__ import annotations\nimport collections.abc\n')
+    result = annotation_writer.annotate_source(source, ti.function_map[source_path])
+    assert result.text.count('from __future__ import annotations') == 1
+    assert result.text.count('import collections.abc') == 1
+
+def test_annotate_source_nothing_to_do():
+    assert annotation_writer.annotate_source(SOURCE, {}) == (SOURCE, 0, 0)
+
+def test_annotate_source_syntax_error():
+    with pytest.raises(annotation_writer.AnnotationWriterException):
+        annotation_writer.annotate_source('def f(:\n', {})
+
+USER_CLASS_SOURCE = '''class Foo:
+    pass
+
+def make(a, d):
+    return a
+'''
+
+def test_annotate_source_user_class(tmpdir):
+    path = tmpdir.join('annotation_user.py')
+    path.write(USER_CLASS_SOURCE)
+    spec = importlib.util.spec_from_file_location('pkg.annotation_user', str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    with type_inferencer.TypeInferencer() as ti:
+        module.make(module.Foo(), fractions.Fraction(1))
+    result = annotation_writer.annotate_source(USER_CLASS_SOURCE, ti.function_map[str(path)],
+                                               'pkg.annotation_user')
+    assert 'def make(a: Foo, d: fractions.Fraction) -> Foo:\n' in result.text
+    assert 'import fractions\n' in result.text
+    # The annotations resolve in the module.
+    namespace = {}
+    exec(result.text, namespace)
+    assert typing.get_type_hints(namespace['make']) == {
+        'a' : namespace['Foo'], 'd' : fractions.Fraction, 'return' : namespace['Foo'],
+    }
+
+@pytest.mark.parametrize('annotation, module_name, expected', [
+    ('pkg.m.Foo | decimal.Decimal', 'pkg.m', ('Foo | decimal.Decimal', {'decimal'})),
+    ('collections.abc.Sequence[pkg.m.A.B]', 'pkg.m', ('collections.abc.Sequence[A.B]', {'collections.abc'})),
+    ('int | None', 'pkg.m', ('int | None', set())),
+])
+def test_localise_annotation(annotation, module_name, expected):
+    assert annotation_writer.localise_annotation(annotation, module_name) == expected
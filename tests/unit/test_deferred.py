@@ -0,0 +1,144 @@
+'''
+Tests for recording types on a background thread.
+'''
+import pytest
+
+from typin import deferred
+from typin import type_inferencer
+from typin import types
+
+def test_ring_buffer():
+    buffer = deferred.RingBuffer(2)
+    assert buffer.get() is None
+    assert buffer.put('a')
+    assert buffer.put('b')
+    assert not buffer.put('c')
+    assert len(buffer) == 2
+    assert buffer.get() == 'a'
+    assert buffer.put('c')
+    assert [buffer.get(), buffer.get(), buffer.get()] == ['b', 'c', None]
+    assert len(buffer) == 0
+
+def test_ring_buffer_capacity():
+    with pytest.raises(ValueError):
+        deferred.RingBuffer(0)
+
+def test_deferred_recorder_drain():
+    recorder = deferred.DeferredRecorder(8)
+    fts = types.FunctionTypes()
+    value = [1, 2]
+    assert recorder.submit_call(fts, ['a'], [value], 'file.py', 10)
+    # The value is captured when it is submitted.
+    value.append('x')
+    assert recorder.submit_return(fts, 3, 12)
+    assert recorder.drain() == 2
+    assert recorder.processed == 2
+    assert fts.argument_type_strings == {'a' : {'list([int])'}}
+    assert fts.return_type_strings == {12 : {'int'}}
+    assert len(fts.call_return_rows) == 1
+
+def test_deferred_recorder_drops_calls():
+    recorder = deferred.DeferredRecorder(4)
+    fts = types.FunctionTypes()
+    results = [recorder.submit_call(fts, ['a'], [i], 'file.py', 10) for i in range(4)]
+    assert results == [True, True, False, False]
+    assert recorder.dropped == 2
+    # Room is left for returns.
+    assert recorder.submit_return(fts, 1, 12)
+    assert recorder.submit_return(fts, 1, 12)
+    assert not recorder.submit_return(fts, 1, 12)
+    assert recorder.dropped == 3
+
+def test_deferred_recorder_dropped_return_pairing():
+    recorder = deferred.DeferredRecorder(2)
+    fts = types.FunctionTypes()
+    assert recorder.submit_call(fts, ['a'], [1], 'file.py', 10)
+    recorder.drain()
+    assert recorder.submit_call(fts, ['a'], ['s'], 'file.py', 10)
+    assert recorder.submit_return(fts, 'inner', 12)
+    # Full, the return of the outer call is dropped.
+    assert not recorder.submit_return(fts, 1.0, 12)
+    recorder.drain()
+    assert len(fts._call_stack) == 0
+    assert [str(row[0][0]) for row in fts.call_return_rows] == ['str']
+
+def test_deferred_recorder_drops_yields():
+    recorder = deferred.DeferredRecorder(4)
+    fts = types.FunctionTypes(generator_kind=types.FunctionTypes.KIND_GENERATOR)
+    results = [recorder.submit_yield(fts, i, 10) for i in range(3)] + [recorder.submit_resume(fts, 10)]
+    assert results == [True, True, False, False]
+    # Room is left for returns.
+    assert recorder.submit_return(fts, None, 12)
+    assert recorder.submit_return(fts, None, 12)
+
+def test_deferred_recorder_dropped_return_unknown():
+    recorder = deferred.DeferredRecorder(2)
+    fts = types.FunctionTypes()
+    assert recorder.submit_call(fts, ['a'], [1], 'file.py', 10)
+    assert recorder.submit_return(fts, 1, 12)
+    # Full, this return is dropped.
+    assert not recorder.submit_return(fts, 1, 12)
+    recorder.drain()
+    # The first return was recorded so the type is known.
+    assert fts.returns_dropped == 1
+    assert not fts.return_unknown
+    assert fts.stub_file_str() == '(a: int) -> int: ...'
+    fts = types.FunctionTypes()
+    fts.add_call_types(['a'], [types.Type(1)], 'file.py', 10)
+    fts.drop_return()
+    assert fts.return_unknown
+    assert fts.stub_file_str() == '(a: int) -> Any: ...'
+    assert fts.return_annotation_strings() == ['Any']
+    assert fts.return_annotation_str() == 'typing.Any'
+
+def _traced():
+    def pairs(n):
+        for i in range(n):
+            yield i, str(i)
+
+    def total(values):
+        if not values:
+            raise ValueError('Empty')
+        return sum(values)
+
+    class Acc:
+        def __init__(self):
+            self.items = []
+
+        def add(self, item):
+            self.items.append(item)
+            return len(self.items)
+
+    acc = Acc()
+    for i, s in pairs(5):
+        acc.add(i)
+        acc.add(s)
+    total(list(range(10)))
+    try:
+        total([])
+    except ValueError:
+        pass
+
+def test_deferred_same_result():
+    with type_inferencer.TypeInferencer() as ti:
+        _traced()
+    with type_inferencer.TypeInferencer(deferred=True) as ti_deferred:
+        _traced()
+    assert ti_deferred.pretty_format(__file__) == ti.pretty_format(__file__)
+    assert ti_deferred.stats()['deferred']['dropped'] == 0
+    assert ti_deferred.stats()['deferred']['processed'] > 0
+    assert ti.stats()['deferred'] is None
+    assert not ti_deferred._deferred.running
+
+def test_deferred_drops():
+    with type_inferencer.TypeInferencer(deferred=deferred.DeferredRecorder(2)) as ti:
+        for _i in range(100):
+            _traced()
+    stats = ti.stats()['deferred']
+    assert stats['dropped'] > 0
+    assert 'Deferred observations' in ti.stats_report()
+    # Whatever was recorded is consistent.
+    for namespace in ti.namespaces(__file__):
+        for function_name in ti.function_names(__file__, namespace):
+            fts = ti.function_types(__file__, namespace, function_name)
+            assert len(fts._call_stack) == 0
@@ -0,0 +1,130 @@
+'''
+Tests for logging events and finding the types from the log afterwards.
+'''
+import pytest
+
+from typin import event_log
+from typin import type_inferencer
+
+class Base:
+    def __init__(self, value):
+        self.value = value
+
+class Derived(Base):
+    def scaled(self, factor):
+        return self.value * factor
+
+def checked(value):
+    if value < 0:
+        raise ValueError('Negative')
+    return value
+
+def caught(value):
+    try:
+        return checked(value)
+    except ValueError:
+        return None
+
+def squares(n):
+    for i in range(n):
+        yield i * i
+
+def _traced():
+    for i in range(-3, 4):
+        caught(i)
+        Derived(i).scaled(2.0)
+    try:
+        checked(-1)
+    except ValueError:
+        pass
+    return list(squares(4))
+
+def _sync_and_logged(tmpdir, jobs=1):
+    with type_inferencer.TypeInferencer() as ti:
+        _traced()
+    path = str(tmpdir.join('events.log'))
+    with type_inferencer.TypeInferencer(event_log=path) as ti_log:
+        _traced()
+    assert len(ti_log.function_map) == 0
+    ti_log.process_event_log(jobs)
+    return ti, ti_log
+
+def _call_return_rows(fts):
+    return sorted((tuple(str(t) for t in arg_types), kind, str(t), count)
+                  for (arg_types, kind, t), count in fts.call_return_rows.items())
+
+def _assert_same(ti, ti_log):
+    assert ti_log.pretty_format(__file__) == ti.pretty_format(__file__)
+    assert ti_log.class_bases[__file__] == ti.class_bases[__file__]
+    for namespace in ti.namespaces(__file__):
+        for function_name in ti.function_names(__file__, namespace):
+            fts = ti.function_types(__file__, namespace, function_name)
+            fts_log = ti_log.function_types(__file__, namespace, function_name)
+            assert _call_return_rows(fts_log) == _call_return_rows(fts)
+            assert fts_log.exception_type_strings == fts.exception_type_strings
+            assert fts_log.call_line_numbers == fts.call_line_numbers
+
+def test_event_log_same_result(tmpdir):
+    _assert_same(*_sync_and_logged(tmpdir))
+
+@pytest.mark.parametrize('chunk_records', [1, 3, 7])
+def test_event_log_chunks(tmpdir, monkeypatch, chunk_records):
+    monkeypatch.setattr(event_log, 'MIN_CHUNK_RECORDS', chunk_records)
+    _assert_same(*_sync_and_logged(tmpdir, jobs=4))
+
+def test_event_log_exceptions(tmpdir):
+    _ti, ti_log = _sync_and_logged(tmpdir)
+    # Raised by checked() and propagated by nothing else.
+    assert ti_log.function_types(__file__, '', 'checked').exception_type_strings \
+        == {checked.__code__.co_firstlineno + 2 : {'ValueError'}}
+    assert ti_log.function_types(__file__, '', 'caught').exception_type_strings == {}
+    assert ti_log.function_types(__file__, '', '_traced').exception_type_strings == {}
+
+def test_event_log_records(tmpdir):
+    log = event_log.EventLog(str(tmpdir.join('events.log')), capacity=1)
+    code_id = log.add_code(event_log.CodeEntry('f.py', 'f', (), None, None, ('a',), 1))
+    call_id = log.fingerprint_id((log.snapshot(1),))
+    return_id = log.fingerprint_id(log.snapshot('s'))
+    assert log.fingerprint_id((log.snapshot(2),)) == call_id
+    log.append(event_log.KIND_CALL, code_id, 1, call_id, 99)
+    # Grows the file.
+    log.append(event_log.KIND_RETURN, code_id, 2, return_id, 99)
+    log.close()
+    assert log.closed
+    assert tmpdir.join('events.log').size() == 2 * event_log.RECORD.size
+    assert list(log.records()) == [
+        (event_log.KIND_CALL, code_id, 1, call_id, 99),
+        (event_log.KIND_RETURN, code_id, 2, return_id, 99),
+    ]
+
+def test_event_log_chunk_ranges(tmpdir, monkeypatch):
+    monkeypatch.setattr(event_log, 'MIN_CHUNK_RECORDS', 2)
+    log = event_log.EventLog(str(tmpdir.join('events.log')))
+    for _i in range(5):
+        log.append(event_log.KIND_LINE, 0, 1, event_log.NO_FINGERPRINT, 1)
+    assert log.chunks(2) == [(0, 3), (3, 5)]
+    assert log.chunks(8) == [(0, 2), (2, 4), (4, 5)]
+    log.close()
+
+def test_event_log_closed_after_processing(tmpdir):
+    _ti, ti_log = _sync_and_logged(tmpdir)
+    log = ti_log._event_log
+    assert log.closed
+    assert tmpdir.join('events.log').size() == log.count * event_log.RECORD.size
+
+def test_event_log_activation_ids(tmpdir):
+    # Frames of successive calls usually have the same id(), each activation
+    # has its own activation_id.
+    path = str(tmpdir.join('events.log'))
+    with type_inferencer.TypeInferencer(event_log=path) as ti_log:
+        for i in range(10):
+            checked(i)
+    ti_log.process_event_log(1)
+    code_ids = [code_id for code_id, entry in enumerate(ti_log._event_log.codes)
+                if entry.qualified_name == 'checked']
+    records = [r for r in ti_log._event_log.records() if r[1] in code_ids]
+    calls = [r[4] for r in records if r[0] == event_log.KIND_CALL]
+    returns = [r[4] for r in records if r[0] == event_log.KIND_RETURN]
+    assert len(set(calls)) == 10
+    assert returns == calls
+    assert ti_log._event_log_activations == {}
@@ -0,0 +1,100 @@
+'''
+Tests for the AST based function index.
+'''
+import os
+
+import pytest
+
+from typin import function_index
+
+SOURCE = '''# Line 1
+import functools
+
+@functools.lru_cache()
+@staticmethod
+def decorated(a, # Line 6
+              b='):'):
+    # Comment
+    return a
+
+async def coroutine(a: 'Tuple[int, int]' = (1, 2)) -> 'Dict[str, int]':
+    """Docstring."""
+    return {}
+
+class Outer:
+    class Inner:
+        def method(self, d={'k': 1}):
+            pass
+
+def one_liner(): pass
+x = lambda y: y
+'''
+
+@pytest.fixture
+def index():
+    return function_index.FunctionIndex(SOURCE)
+
+def test_len(index):
+    assert len(index) == 4
+
+@pytest.mark.parametrize('lineno', [4, 6])
+def test_decorated(index, lineno):
+    location = index.function_at(lineno)
+    assert location == function_index.FunctionLocation('decorated', 4, 6, 7, False, '    ', 9)
+
+def test_not_decorator_line(index):
+    assert index.function_at(5) is None
+
+def test_async_with_annotations(index):
+    location = index.function_at(11)
+    assert location == function_index.FunctionLocation('coroutine', 11, 11, 11, True, '    ', 13)
+
+def test_nested_method(index):
+    location = index.function_at(17)
+    assert location.name == 'method'
+    assert location.colon_lineno == 17
+    assert location.indent == ' ' * 12
+
+def test_one_liner(index):
+    assert index.function_at(20).colon_lineno == 0
+
+def test_lambda(index):
+    assert index.function_at(21) is None
+
+@pytest.mark.parametrize('lineno, expected', [
+    (15, True),
+    (16, True),
+    (17, False),
+    (1, False),
+])
+def test_is_class(index, lineno, expected):
+    assert index.is_class(lineno) == expected
+
+def test_from_lines_without_line_endings():
+    index = function_index.FunctionIndex.from_lines(SOURCE.split('\n'))
+    assert index.function_at(6).colon_lineno == 7
+
+def test_syntax_error():
+    with pytest.raises(SyntaxError):
+        function_index.FunctionIndex('def foo():\n')
+
+def test_function_index_cached(tmpdir):
+    path = str(tmpdir.join('example.py'))
+    with open(path, 'w') as f:
+        f.write('def foo():\n    pass\n')
+    index = function_index.function_index(path)
+    assert index.function_at(1).name == 'foo'
+    assert function_index.function_index(path) is index
+    with open(path, 'w') as f:
+        f.write('\ndef bar():\n    pass\n')
+    os.utime(path, ns=(0, 0))
+    new_index = function_index.function_index(path)
+    assert new_index is not index
+    assert new_index.function_at(2).name == 'bar'
+
+def test_function_index_missing_or_invalid(tmpdir):
+    assert function_index.function_index(str(tmpdir.join('missing.py'))) is None
+    path = str(tmpdir.join('invalid.py'))
+    with open(path, 'w') as f:
+        f.write('def foo(:\n')
+    assert function_index.function_index(path) is None
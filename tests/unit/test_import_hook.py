@@ -0,0 +1,84 @@
+'''
+Tests for the import hook that records the functions of chosen packages.
+'''
+import sys
+
+import pytest
+
+from typin import import_hook
+from typin import recording
+from typin import type_inferencer
+
+PACKAGE_INIT = '''
+def api(a):
+    return helper(a)
+
+def helper(a):
+    return [a]
+'''
+
+SUBMODULE = '''
+class Widget:
+    def size(self, scale):
+        return 2 * scale
+'''
+
+OTHER = '''
+def untouched(a):
+    return a
+'''
+
+@pytest.fixture
+def package_dir(tmpdir):
+    package = tmpdir.mkdir('hooked_pkg')
+    package.join('__init__.py').write(PACKAGE_INIT)
+    package.join('sub.py').write(SUBMODULE)
+    tmpdir.join('hooked_other.py').write(OTHER)
+    sys.path.insert(0, str(tmpdir))
+    yield tmpdir
+    sys.path.remove(str(tmpdir))
+    for name in ('hooked_pkg', 'hooked_pkg.sub', 'hooked_other'):
+        sys.modules.pop(name, None)
+
+@pytest.mark.parametrize('fullname, patterns, expected', [
+    ('pkg', ['pkg'], True),
+    ('pkg.sub', ['pkg'], True),
+    ('pkgs', ['pkg'], False),
+    ('other', ['pkg'], False),
+    ('pkg.a.api', ['pkg.*.api'], True),
+    ('pkg.a.impl', ['pkg.*.api'], False),
+])
+def test_matches(fullname, patterns, expected):
+    assert import_hook.matches(fullname, patterns) == expected
+
+def test_instrumented_imports(package_dir):
+    ti = type_inferencer.TypeInferencer()
+    with import_hook.instrumented_imports(['hooked_pkg'], ti) as finder:
+        assert sys.meta_path[0] is finder
+        import hooked_pkg
+        import hooked_pkg.sub
+        import hooked_other
+        # Imports are instrumented without a global trace function.
+        assert sys.gettrace() is None
+    assert finder not in sys.meta_path
+    hooked_pkg.api(1)
+    hooked_pkg.sub.Widget().size(1.5)
+    hooked_other.untouched(1)
+    assert recording.is_recorded(hooked_pkg.api)
+    assert not recording.is_recorded(hooked_other.untouched)
+    init_path = str(package_dir.join('hooked_pkg', '__init__.py'))
+    sub_path = str(package_dir.join('hooked_pkg', 'sub.py'))
+    assert sorted(ti.file_paths()) == sorted([init_path, sub_path])
+    stubs = ti.pretty_format(init_path)
+    assert 'def api(a: int) -> list([int]): ...' in stubs
+    assert 'def helper(a: int) -> list([int]): ...' in stubs
+    assert 'def size(self, scale: float) -> float: ...' in ti.pretty_format(sub_path)
+    # The source is still available through the wrapped loader.
+    assert hooked_pkg.__loader__.get_source('hooked_pkg') == PACKAGE_INIT
+
+def test_install_instruments_imported(package_dir):
+    import hooked_other
+    ti = type_inferencer.TypeInferencer()
+    finder = import_hook.install(['hooked_other'], ti)
+    import_hook.uninstall(finder)
+    assert recording.is_recorded(hooked_other.untouched)
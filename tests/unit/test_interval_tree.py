@@ -0,0 +1,42 @@
+'''
+Tests for the static interval tree.
+'''
+import random
+
+import pytest
+
+from typin import interval_tree
+
+def _brute_force(intervals, begin, end):
+    return sorted(
+        (i for i in intervals if i[0] <= end and i[1] >= begin),
+        key=lambda i: (i[0], i[1])
+    )
+
+def test_empty():
+    tree = interval_tree.IntervalTree([])
+    assert len(tree) == 0
+    assert tree.at(1) == []
+    assert tree.overlapping(1, 10) == []
+
+def test_nested():
+    tree = interval_tree.IntervalTree([(1, 10, 'outer'), (3, 5, 'inner'), (12, 20, 'other')])
+    assert tree.at(4) == [(1, 10, 'outer'), (3, 5, 'inner')]
+    assert tree.at(10) == [(1, 10, 'outer')]
+    assert tree.at(11) == []
+    assert tree.overlapping(5, 12) == [(1, 10, 'outer'), (3, 5, 'inner'), (12, 20, 'other')]
+    assert tree.overlapping(21, 30) == []
+
+@pytest.mark.parametrize('seed', range(8))
+def test_random(seed):
+    rand = random.Random(seed)
+    intervals = []
+    for i in range(200):
+        begin = rand.randint(1, 1000)
+        intervals.append((begin, begin + rand.randint(0, 50), i))
+    tree = interval_tree.IntervalTree(intervals)
+    for _i in range(100):
+        begin = rand.randint(0, 1100)
+        end = begin + rand.randint(0, 20)
+        assert tree.overlapping(begin, end) == _brute_force(intervals, begin, end)
+        assert tree.at(begin) == _brute_force(intervals, begin, begin)
@@ -0,0 +1,187 @@
+'''
+Tests for the columnar store of observations.
+'''
+import inspect
+
+import pytest
+
+from typin import observation_store
+from typin import str_id_cache
+from typin import type_inferencer
+from typin import types
+
+def _store_with_calls():
+    store = observation_store.ObservationStore()
+    function_id = store.add_function('a.py', '', 'f')
+    for value in (1, 2, 'x'):
+        store.add_call(function_id, ['a'], [types.Type(value)], 10)
+        store.add_return(function_id, types.Type(value), 12)
+    return store, function_id
+
+def test_add_function():
+    store = observation_store.ObservationStore()
+    assert store.add_function('a.py', '', 'f') == 0
+    assert store.add_function('a.py', 'A', 'f') == 1
+    assert store.add_function('a.py', '', 'f') == 0
+    assert store.names.name(store.functions[1].namespace_id) == 'A'
+    assert store.function_names('a.py', 'A') == ['f']
+
+def test_shared_names():
+    names = str_id_cache.StringIdCache()
+    store = observation_store.ObservationStore(names=names)
+    function_id = store.add_function('a.py', 'A', 'f')
+    type_id = store.intern_type(types.Type(1))
+    assert store.names is names
+    assert set(names) >= {'a.py', 'A', 'f', 'int'}
+    assert store.functions[function_id].function_name_id == names.get('f')
+    assert store.type_name(type_id) == 'int'
+    with pytest.raises(KeyError):
+        store.type_name(observation_store.NO_TYPE)
+
+def test_observe_counts():
+    store, function_id = _store_with_calls()
+    # One call row, two argument rows and two return rows.
+    assert len(store) == 5
+    columns = store.columns()
+    assert list(columns) == [name for name, _typecode in observation_store.COLUMNS]
+    assert list(columns['slot_kind']) == [
+        observation_store.SLOT_CALL, observation_store.SLOT_ARGUMENT, observation_store.SLOT_RETURN,
+        observation_store.SLOT_ARGUMENT, observation_store.SLOT_RETURN,
+    ]
+    assert list(columns['count']) == [3, 2, 2, 1, 1]
+    assert [str(store.types[type_id]) if type_id else None for type_id in columns['type_id']] \
+        == [None, 'int', 'int', 'str', 'str']
+    assert set(columns['function_id']) == {function_id}
+
+def test_function_types():
+    store, _function_id = _store_with_calls()
+    fts = store.function_types('a.py', '', 'f')
+    assert fts.argument_type_strings == {'a' : {'int', 'str'}}
+    assert fts.return_type_strings == {12 : {'int', 'str'}}
+    assert fts.call_line_numbers == [10]
+    # Cached until the next observation.
+    assert store.function_types('a.py', '', 'f') is fts
+    store.add_exception(0, types.Type(ValueError()), 11)
+    assert store.function_types('a.py', '', 'f').exception_type_strings == {11 : {'ValueError'}}
+    with pytest.raises(KeyError):
+        store.function_types('a.py', '', 'g')
+
+def test_compatibility_names():
+    store, _function_id = _store_with_calls()
+    store.add_function('b.py', 'B', 'g')
+    assert store.file_paths() == ['a.py', 'b.py']
+    assert store.namespaces('b.py') == ['B']
+    assert store.function_names('a.py', '') == ['f']
+
+def test_add_function_types():
+    fts = types.FunctionTypes()
+    arg_info = inspect.ArgInfo(['a', 'b'], None, None, {'a' : 1, 'b' : [1.0]})
+    fts.add_call(arg_info, 'a.py', 5)
+    fts.add_return(None, 7)
+    store = observation_store.ObservationStore()
+    store.add_function_types('a.py', '', 'f', fts)
+    built = store.function_types('a.py', '', 'f')
+    assert built.argument_type_strings == fts.argument_type_strings
+    assert built.return_type_strings == fts.return_type_strings
+    assert built.stub_file_str() == fts.stub_file_str()
+
+def test_to_numpy():
+    numpy = pytest.importorskip('numpy')
+    store, _function_id = _store_with_calls()
+    arrays = store.to_numpy()
+    assert arrays['count'].dtype == numpy.uint64
+    assert list(arrays['count']) == list(store.count)
+
+def _traced(values):
+    def scale(value, factor=2):
+        return value * factor
+
+    def evens(n):
+        for i in range(n):
+            if i % 2 == 0:
+                yield i
+
+    def check(value):
+        if value is None:
+            raise ValueError('None')
+        return value
+
+    ret = [scale(v) for v in values]
+    ret.extend(evens(6))
+    try:
+        check(None)
+    except ValueError:
+        pass
+    return ret
+
+def test_type_inferencer_columnar():
+    with type_inferencer.TypeInferencer() as ti:
+        _traced([1, 2.0, 'a'])
+    with type_inferencer.TypeInferencer(columnar=True) as ti_columnar:
+        _traced([1, 2.0, 'a'])
+    assert ti.store is None
+    assert ti_columnar.pretty_format(__file__) == ti.pretty_format(__file__)
+    fts = ti_columnar.function_types(__file__, '', 'scale')
+    assert isinstance(fts, observation_store.ColumnarFunctionTypes)
+    assert fts.argument_type_strings == ti.function_types(__file__, '', 'scale').argument_type_strings
+    # Repeated observations are counted, not added.
+    rows = len(ti_columnar.store)
+    with ti_columnar:
+        _traced([1, 2.0, 'a'])
+    assert len(ti_columnar.store) == rows
+
+def _overloaded(value):
+    return value
+
+def test_type_inferencer_columnar_overloads():
+    with type_inferencer.TypeInferencer() as ti:
+        _overloaded(1)
+        _overloaded('a')
+    with type_inferencer.TypeInferencer(columnar=True) as ti_columnar:
+        _overloaded(1)
+        _overloaded('a')
+    assert len(ti.function_types(__file__, '', '_overloaded').overloads()) == 2
+    fts = ti_columnar.function_types(__file__, '', '_overloaded')
+    assert fts.call_return_rows == ti.function_types(__file__, '', '_overloaded').call_return_rows
+    assert ti_columnar.pretty_format(__file__, use_overloads=True) \
+        == ti.pretty_format(__file__, use_overloads=True)
+    assert '@overload' in ti_columnar.pretty_format(__file__, use_overloads=True)
+
+def test_add_function_types_rows():
+    fts = types.FunctionTypes()
+    for value in (1, 'a', 'b'):
+        fts.add_call(inspect.ArgInfo(['a'], None, None, {'a' : value}), 'a.py', 5)
+        fts.add_return(value, 7)
+    store = observation_store.ObservationStore()
+    store.add_function_types('a.py', '', 'f', fts)
+    built = store.function_types('a.py', '', 'f')
+    assert built.call_return_rows == fts.call_return_rows
+    assert built.stub_file_strs() == fts.stub_file_strs()
+
+def test_call_return_rows_evicted():
+    store = observation_store.ObservationStore()
+    function_id = store.add_function('a.py', '', 'f')
+    cfts = observation_store.ColumnarFunctionTypes(store, function_id)
+    limit = types.FunctionTypes.MAX_CALL_RETURN_ROWS
+    for i in range(limit * 3):
+        value = type('C{:d}'.format(i), (), {})()
+        cfts.add_call(inspect.ArgInfo(['a'], None, None, {'a' : value}), 'a.py', 5)
+        cfts.add_return(None, 7)
+    slot_kinds = list(store.slot_kind)
+    assert slot_kinds.count(observation_store.SLOT_ROW) == limit
+    assert store.call_return_rows_evicted[function_id] == limit * 2
+    # Argument types of evicted rows are freed and reused.
+    assert len(store.argument_types) == limit
+    fts = store.function_types_of(function_id)
+    assert len(fts.call_return_rows) == limit
+    assert fts.overloads() == []
+
+def test_built_per_function():
+    store, function_id = _store_with_calls()
+    other_id = store.add_function('a.py', '', 'g')
+    store.add_return(other_id, types.Type(1), 20)
+    built = store.function_types_of(function_id)
+    store.add_return(other_id, types.Type(''), 20)
+    assert store.function_types_of(function_id) is built
+    store.add_return(function_id, types.Type(''), 12)
+    assert store.function_types_of(function_id) is not built
@@ -0,0 +1,264 @@
+'''
+Tests for recording the types of chosen functions without tracing.
+'''
+import asyncio
+import sys
+import types as builtin_types
+
+import pytest
+
+import typin
+from typin import recording
+from typin import type_inferencer
+
+def _make_ti():
+    return type_inferencer.TypeInferencer()
+
+def test_record_function():
+    ti = _make_ti()
+
+    @recording.record(ti=ti)
+    def add(a, b=1):
+        return a + b
+
+    assert add(1, 2) == 3
+    assert add(1.5) == 2.5
+    fts = ti.function_types(__file__, '', 'add')
+    assert sorted(str(t) for t in fts.arguments['a']) == ['float', 'int']
+    assert sorted(str(t) for t in fts.arguments['b']) == ['int']
+    assert fts.return_annotation_str() == 'float | int'
+
+def test_record_not_traced():
+    ti = _make_ti()
+
+    @recording.record(ti=ti)
+    def identity(a):
+        return a
+
+    assert sys.gettrace() is None or sys.gettrace() is not ti
+    identity(1)
+    assert ti.eventno == 0
+
+def test_record_exception():
+    ti = _make_ti()
+
+    @recording.record(ti=ti)
+    def raises(a):
+        if a < 0:
+            raise ValueError()
+        return a
+
+    raises(1)
+    with pytest.raises(ValueError):
+        raises(-1)
+    fts = ti.function_types(__file__, '', 'raises')
+    assert fts.exception_type_strings == {raises.__wrapped__.__code__.co_firstlineno + 3 : {'ValueError'}}
+    assert [str(t) for t in fts._all_return_types()] == ['int']
+
+def test_record_bad_arguments():
+    ti = _make_ti()
+
+    @recording.record(ti=ti)
+    def add(a, b=1):
+        return a + b
+
+    # The function's own error, not that of binding to the signature.
+    with pytest.raises(TypeError) as err:
+        add(1, 2, 3)
+    assert 'add()' in str(err.value)
+    assert add(1) == 2
+    fts = ti.function_types(__file__, '', 'add')
+    assert sorted(str(t) for t in fts.arguments['a']) == ['int']
+    assert fts.exception_type_strings == {}
+
+def test_record_failure(monkeypatch):
+    ti = _make_ti()
+
+    @recording.record(ti=ti)
+    def gen(n):
+        yield from range(n)
+
+    @recording.record(ti=ti)
+    def double(a):
+        return 2 * a
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('Type construction')
+    monkeypatch.setattr(type_inferencer.types.FunctionTypes, 'add_call', fail)
+    assert double(2) == 4
+    assert list(gen(3)) == [0, 1, 2]
+
+def test_record_fast_path():
+    ti = _make_ti()
+
+    @recording.record(ti=ti)
+    def identity(a):
+        return a
+
+    for i in range(1000):
+        identity(i)
+    identity('a')
+    fts = ti.function_types(__file__, '', 'identity')
+    assert sorted(str(t) for t in fts.arguments['a']) == ['int', 'str']
+    # Skipped calls are not paired with returns.
+    assert sum(fts.call_return_rows.values()) < 1000 // recording.SAMPLE_INTERVAL + 3
+
+def test_record_generator():
+    ti = _make_ti()
+
+    @recording.record(ti=ti)
+    def gen(n):
+        for i in range(n):
+            received = yield i
+            if received is not None:
+                yield str(received)
+        return 'done'
+
+    g = gen(2)
+    assert next(g) == 0
+    assert g.send(1.5) == '1.5'
+    assert list(g) == [1]
+    fts = ti.function_types(__file__, '', 'gen')
+    assert fts.generator_kind == fts.KIND_GENERATOR
+    assert sorted(fts.yield_type_strings[gen.__wrapped__.__code__.co_firstlineno + 3]) == ['int']
+    assert sorted(str(t) for t in fts.send_types) == ['float']
+    assert [str(t) for t in fts._all_return_types()] == ['str']
+
+def test_record_generator_close():
+    ti = _make_ti()
+
+    @recording.record(ti=ti)
+    def gen():
+        yield 1
+        yield 2
+
+    g = gen()
+    next(g)
+    g.close()
+    fts = ti.function_types(__file__, '', 'gen')
+    assert list(fts._all_return_types()) == []
+
+def test_record_coroutine():
+    ti = _make_ti()
+
+    @recording.record(ti=ti)
+    async def double(a):
+        await asyncio.sleep(0)
+        return a * 2
+
+    assert asyncio.run(double(2)) == 4
+    fts = ti.function_types(__file__, '', 'double')
+    assert fts.generator_kind == fts.KIND_COROUTINE
+    assert fts.return_annotation_str() == 'int'
+
+def test_record_method_bases():
+    ti = _make_ti()
+
+    class Base:
+        pass
+
+    class Derived(Base):
+        @recording.record(ti=ti)
+        def method(self, a):
+            return a
+
+    Derived().method(1)
+    assert ti.class_bases[__file__]['Derived'] == (Base,)
+    assert 'class Derived(Base):' in ti.pretty_format(__file__)
+
+def test_record_twice():
+    def f():
+        pass
+    wrapped = recording.record(f, ti=_make_ti())
+    assert recording.record(wrapped) is wrapped
+
+def test_default_recorder():
+    assert typin.recorder() is recording.recorder()
+    assert typin.record is recording.record
+
+SOURCE = '''
+import os
+
+def function(a):
+    return a
+
+class A:
+    def method(self, b):
+        return b
+
+    @staticmethod
+    def static(c):
+        return c
+
+    @classmethod
+    def klass(cls, d):
+        return d
+
+    @property
+    def prop(self):
+        return 1
+
+    class Inner:
+        def inner(self):
+            return 'x'
+'''
+
+def _make_module(tmpdir):
+    path = tmpdir.join('instrumented.py')
+    path.write(SOURCE)
+    module = builtin_types.ModuleType('instrumented')
+    module.__file__ = str(path)
+    exec(compile(SOURCE, str(path), 'exec'), vars(module))
+    return module, str(path)
+
+def test_instrument_module(tmpdir):
+    ti = _make_ti()
+    module, path = _make_module(tmpdir)
+    assert recording.instrument_module(module, ti) == 6
+    # Already instrumented.
+    assert recording.instrument_module(module, ti) == 0
+    module.function(1)
+    a = module.A()
+    a.method('b')
+    module.A.static(1.5)
+    module.A.klass(b'')
+    assert a.prop == 1
+    module.A.Inner().inner()
+    stubs = ti.pretty_format(path)
+    assert 'def function(a: int) -> int: ...' in stubs
+    assert 'def method(self, b: str) -> str: ...' in stubs
+    assert 'def static(c: float) -> float: ...' in stubs
+    assert 'def klass(cls: type, d: bytes) -> bytes: ...' in stubs
+    assert 'def inner(self) -> str: ...' in stubs
+    # os.path.join is not instrumented.
+    assert not recording.is_recorded(module.os.path.join)
+
+def test_record_not_called():
+    ti = _make_ti()
+
+    @recording.record(ti=ti)
+    def never_called(a):
+        return a
+
+    assert ti.function_map == {}
+
+def test_record_function_at():
+    ti = _make_ti()
+
+    @recording.record(ti=ti)
+    def first(a):
+        return a
+
+    @recording.record(ti=ti)
+    def second(a):
+        return a
+
+    first(1)
+    line_first = first.__wrapped__.__code__.co_firstlineno
+    line_second = second.__wrapped__.__code__.co_firstlineno
+    assert ti.function_at(__file__, line_first + 1) == [('', 'first')]
+    assert ti.function_at(__file__, line_second + 1) == []
+    # No event happens but the function has been added.
+    second(2)
+    assert ti.eventno == 0
+    assert ti.function_at(__file__, line_second + 1) == [('', 'second')]
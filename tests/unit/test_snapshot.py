@@ -0,0 +1,184 @@
+'''
+Tests for snapshots of types and the differences between them.
+'''
+import io
+import json
+import time
+
+import pytest
+
+from typin import snapshot
+from typin import type_inferencer
+
+def first(a):
+    return a
+
+def second(b):
+    if b < 0:
+        raise ValueError()
+    return b
+
+def gen(n):
+    yield n
+
+def _trace(*args):
+    with type_inferencer.TypeInferencer() as ti:
+        for arg in args:
+            first(arg)
+        try:
+            second(-1)
+        except ValueError:
+            pass
+        list(gen(1))
+    return ti
+
+def test_snapshot():
+    snap = snapshot.snapshot(_trace(1, 'a'))
+    functions = snap[__file__]['']
+    assert functions['first']['arguments'] == {'a' : ['int', 'str']}
+    assert functions['first']['returns'] == ['int', 'str']
+    assert functions['second']['exceptions'] == ['ValueError']
+    assert functions['gen']['yields'] == ['int']
+    assert 'yields' not in functions['first']
+
+def test_save_load(tmpdir):
+    path = str(tmpdir.join('snapshot.json'))
+    ti = _trace(1)
+    snapshot.save(ti, path)
+    assert snapshot.load(path) == snapshot.snapshot(ti)
+
+def test_load_not_snapshot(tmpdir):
+    path = tmpdir.join('snapshot.json')
+    path.write(json.dumps({'version' : 0}))
+    with pytest.raises(snapshot.SnapshotException):
+        snapshot.load(str(path))
+
+def test_diff_none():
+    assert list(snapshot.diff(_trace(1), _trace(1))) == []
+
+def test_diff_changed():
+    records = list(snapshot.diff(_trace(1), _trace(1.5, 'a')))
+    key = {'file' : __file__, 'namespace' : '', 'function' : 'first'}
+    assert records == [
+        dict(change='changed', field='arguments', argument='a',
+             added=['float', 'str'], removed=['int'], **key),
+        dict(change='changed', field='returns',
+             added=['float', 'str'], removed=['int'], **key),
+    ]
+
+def _function(**kwargs):
+    ret = {'line' : 1, 'arguments' : {}, 'returns' : ['None'], 'exceptions' : []}
+    ret.update(kwargs)
+    return ret
+
+def test_diff_added_removed():
+    old = {'a.py' : {'' : {'f' : _function(), 'g' : _function()}}, 'b.py' : {'' : {'h' : _function()}}}
+    new = {'a.py' : {'' : {'g' : _function(line=20), 'i' : _function()}, 'K' : {'m' : _function()}}}
+    records = [(r['change'], r['file'], r['namespace'], r['function']) for r in snapshot.diff(old, new)]
+    assert records == [
+        ('removed', 'a.py', '', 'f'),
+        ('added', 'a.py', '', 'i'),
+        ('added', 'a.py', 'K', 'm'),
+        ('removed', 'b.py', '', 'h'),
+    ]
+
+def test_diff_arguments_renamed():
+    old = {'a.py' : {'' : {'f' : _function(arguments={'x' : ['int']})}}}
+    new = {'a.py' : {'' : {'f' : _function(arguments={'y' : ['int']})}}}
+    records = [(r['argument'], r['added'], r['removed']) for r in snapshot.diff(old, new)]
+    assert records == [('x', [], ['int']), ('y', ['int'], [])]
+
+def test_write_diff():
+    old = {'a.py' : {'' : {'f' : _function()}}}
+    stream = io.StringIO()
+    assert snapshot.write_diff(snapshot.diff(old, {}), stream) == 1
+    assert json.loads(stream.getvalue()) == {
+        'change' : 'removed', 'file' : 'a.py', 'namespace' : '', 'function' : 'f',
+    }
+
+def test_diff_large():
+    def _snap(n, changed):
+        return {
+            'file{:d}.py'.format(f) : {
+                '' : {
+                    'func{:d}'.format(i) : _function(returns=[changed if i == 0 else 'int'])
+                    for i in range(1000)
+                }
+            } for f in range(n)
+        }
+    old = _snap(100, 'int')
+    new = _snap(100, 'str')
+    start = time.perf_counter()
+    records = list(snapshot.diff(old, new))
+    assert len(records) == 100
+    assert time.perf_counter() - start < 10.0
+
+def test_function_types():
+    snap = snapshot.snapshot(_trace(1, 'a'))
+    functions = snap[__file__]['']
+    fts = snapshot.function_types(functions['first'])
+    assert fts.settled
+    assert snapshot.function_snapshot(fts) == functions['first']
+    fts = snapshot.function_types(functions['gen'])
+    assert fts.generator_kind == fts.KIND_GENERATOR
+    assert snapshot.function_snapshot(fts) == functions['gen']
+
+def test_baseline_unchanged():
+    baseline = snapshot.snapshot(_trace(1, 'a'))
+    with type_inferencer.TypeInferencer(baseline=baseline) as ti:
+        for _i in range(200):
+            first(1)
+            first('a')
+    assert list(snapshot.diff(baseline, ti)) == []
+    fts = ti.function_types(__file__, '', 'first')
+    assert fts.settled
+    # The first call and return of each class is recorded then only a sample.
+    assert fts.settled_skipped > 700
+    assert fts.signature is not None
+
+def test_baseline_first_call_skipped():
+    baseline = snapshot.snapshot(_trace(1, 'a'))
+    with type_inferencer.TypeInferencer(baseline=baseline) as ti:
+        first(1)
+    fts = ti.function_types(__file__, '', 'first')
+    # The call and its return are known from the baseline.
+    assert fts.settled_skipped == 2
+    assert fts.call_return_rows == {}
+    assert list(snapshot.diff(baseline, ti)) == []
+
+def test_seed_fingerprints():
+    fts = snapshot.function_types(_function(arguments={'a' : ['int', 'no_such_module.Foo']}))
+    fts.seed_fingerprints(['a'])
+    assert fts._call_fingerprints == set()
+    fts = snapshot.function_types(_function(arguments={'a' : ['int', 'list([str])'], 'b' : ['None']},
+                                            returns=['decimal.Decimal']))
+    fts.seed_fingerprints(['a', 'b'])
+    assert fts._call_fingerprints == {(int, type(None)), (list, type(None))}
+    assert fts.skip_known_call((list, type(None)))
+    assert not fts.skip_known_call((str, type(None)))
+
+def test_baseline_new_types():
+    baseline = snapshot.snapshot(_trace(1))
+    with type_inferencer.TypeInferencer(baseline=baseline) as ti:
+        for _i in range(100):
+            first(1)
+        first(b'')
+    records = list(snapshot.diff(baseline, ti))
+    assert [(r['field'], r['added']) for r in records] == [
+        ('arguments', ['bytes']), ('returns', ['bytes'])
+    ]
+
+def test_baseline_exception():
+    baseline = snapshot.snapshot(_trace(1))
+    with type_inferencer.TypeInferencer(baseline=baseline) as ti:
+        for _i in range(100):
+            second(1)
+        try:
+            second(-1)
+        except ValueError:
+            pass
+    # The baseline only saw second() raise.
+    records = list(snapshot.diff(baseline, ti))
+    assert [(r['field'], r['added']) for r in records] == [('returns', ['int'])]
+    fts = ti.function_types(__file__, '', 'second')
+    assert fts.settled_skipped > 0
@@ -0,0 +1,43 @@
+'''
+Tests for applying edits to source code.
+'''
+import ast
+
+import pytest
+
+from typin import source_edits
+
+def test_line_offsets():
+    source = 'a = 1\nbb = 2\nccc = 3'
+    offsets = source_edits.LineOffsets(source)
+    assert len(offsets) == 3
+    assert offsets.line(2) == 'bb = 2\n'
+    assert offsets.line(3) == 'ccc = 3'
+    assert offsets.offset(2, 3) == 9
+    assert source[offsets.offset(3, 0)] == 'c'
+    assert offsets.lineno(0) == 1
+    assert offsets.lineno(6) == 2
+
+def test_node_offsets_non_ascii():
+    source = 's = "éé"; t = 1\n'
+    tree = ast.parse(source)
+    offsets = source_edits.LineOffsets(source)
+    node = tree.body[1].targets[0]
+    assert source[offsets.node_start(node):offsets.node_end(node)] == 't'
+
+def test_apply_edits():
+    source = 'def f(a, b): ...\n'
+    edits = [
+        (7, 7, ': str'),
+        (11, 11, ' -> None'),
+        (6, 7, 'a'),
+    ]
+    # Insertion after the replacement at the same offset.
+    assert source_edits.apply_edits(source, edits) == 'def f(a: str, b) -> None: ...\n'
+
+def test_apply_edits_insertions_in_order():
+    assert source_edits.apply_edits('ab', [(1, 1, 'x'), (1, 1, 'y')]) == 'axyb'
+
+def test_apply_edits_overlap():
+    with pytest.raises(source_edits.SourceEditsException):
+        source_edits.apply_edits('abcdef', [(1, 4, 'x'), (2, 3, 'y')])
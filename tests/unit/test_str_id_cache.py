@@ -42,3 +42,46 @@ def test_str_id_cache_sorted_ids():
     id_cache.id('One')
     id_cache.id('Two')
     assert id_cache.sorted_ids() == [1, 2, 0]
+
+def test_str_id_cache_name_raises_negative():
+    id_cache = str_id_cache.StringIdCache(['Zero'])
+    with pytest.raises(KeyError):
+        id_cache.name(-1)
+
+def test_str_id_cache_get():
+    id_cache = str_id_cache.StringIdCache(['Zero'])
+    assert id_cache.get('Zero') == 0
+    assert id_cache.get('One') is None
+    assert 'One' not in id_cache
+    assert len(id_cache) == 1
+
+def test_str_id_cache_intern_many():
+    id_cache = str_id_cache.StringIdCache()
+    assert id_cache.intern_many(['Zero', 'One', 'Zero', 'Two']) == [0, 1, 0, 2]
+    assert list(id_cache) == ['Zero', 'One', 'Two']
+
+def test_str_id_cache_merge():
+    id_cache = str_id_cache.StringIdCache(['Zero', 'One'])
+    other = str_id_cache.StringIdCache(['Two', 'One'])
+    remap = id_cache.merge(other)
+    assert remap == [2, 1]
+    assert [id_cache.name(remap[i]) for i in range(len(other))] == ['Two', 'One']
+    assert list(id_cache) == ['Zero', 'One', 'Two']
+
+def test_str_id_cache_save_load(tmpdir):
+    path = str(tmpdir.join('ids.json'))
+    id_cache = str_id_cache.StringIdCache(['Zero', 'One', 'Two'])
+    id_cache.save(path)
+    loaded = str_id_cache.StringIdCache.load(path)
+    assert list(loaded) == list(id_cache)
+    assert loaded.id('Two') == 2
+    assert loaded.id('Three') == 3
+
+def test_str_id_cache_load_raises(tmpdir):
+    path = tmpdir.join('ids.json')
+    path.write('[]')
+    with pytest.raises(str_id_cache.StringIdCacheException):
+        str_id_cache.StringIdCache.load(str(path))
+    path.write('{')
+    with pytest.raises(str_id_cache.StringIdCacheException):
+        str_id_cache.StringIdCache.load(str(path))
@@ -0,0 +1,122 @@
+'''
+Tests for merging observed types into existing stub files.
+'''
+import pytest
+
+from typin import stub_merge
+from typin import type_inferencer
+
+def _example(a, b=1):
+    return a
+
+class Example:
+    def method(self, x):
+        return [x]
+
+    def other(self, y):
+        return None
+
+def _file_map():
+    with type_inferencer.TypeInferencer() as ti:
+        _example('s', 2)
+        _example(b'b', 2)
+        obj = Example()
+        obj.method(1)
+        obj.other(1.5)
+    return ti.function_map[__file__]
+
+@pytest.fixture(scope='module')
+def file_map():
+    return _file_map()
+
+def test_add_missing(file_map):
+    stub = '''# Hand written.
+def _example(a, b=...): ...
+'''
+    result = stub_merge.merge_stub(stub, file_map)
+    assert result.text == '''# Hand written.
+def _example(a: Union[bytes, str], b: int = ...) -> Union[bytes, str]: ...
+'''
+    assert (result.added, result.widened) == (3, 0)
+
+def test_keep_complete(file_map):
+    stub = 'def _example(a: Union[str, bytes], b: int = ...) -> Any: ...  # Comment\n'
+    result = stub_merge.merge_stub(stub, file_map)
+    assert result == (stub, 0, 0)
+
+def test_widen_narrower(file_map):
+    stub = 'def _example(a: str, b: Optional[int]=...) -> str | bytes: ...\n'
+    result = stub_merge.merge_stub(stub, file_map)
+    assert result.text == 'def _example(a: Union[str, bytes], b: Optional[int]=...) -> str | bytes: ...\n'
+    assert (result.added, result.widened) == (0, 1)
+
+def test_class_methods(file_map):
+    stub = '''class Example:
+    # Comment kept
+    def other(self, y: int) -> None: ...
+    def method(self, x: int): ...
+    def untraced(self, z): ...
+'''
+    result = stub_merge.merge_stub(stub, file_map)
+    assert result.text == '''class Example:
+    # Comment kept
+    def other(self, y: Union[int, float]) -> None: ...
+    def method(self, x: int) -> list([int]): ...
+    def untraced(self, z): ...
+'''
+    assert (result.added, result.widened) == (1, 1)
+
+def test_overloads_untouched(file_map):
+    stub = '''@overload
+def _example(a: str, b: int = ...) -> str: ...
+@overload
+def _example(a: bytes, b): ...
+'''
+    assert stub_merge.merge_stub(stub, file_map) == (stub, 0, 0)
+
+def test_multi_line_signature(file_map):
+    stub = '''def _example(
+    a,
+    b,
+): ...
+'''
+    result = stub_merge.merge_stub(stub, file_map)
+    assert result.text == '''def _example(
+    a: Union[bytes, str],
+    b: int,
+) -> Union[bytes, str]: ...
+'''
+
+def _numeric(x, values):
+    return {str(x) : [(x, str(x))]}
+
+@pytest.fixture(scope='module')
+def numeric_file_map():
+    with type_inferencer.TypeInferencer() as ti:
+        _numeric(1, [1])
+        _numeric(2.5, (1,))
+    return ti.function_map[__file__]
+
+def test_widen_accepts_subtypes(numeric_file_map):
+    # int is accepted for float, list and tuple are Sequences.
+    stub = 'def _numeric(x: float, values: Sequence[int]) -> Mapping: ...\n'
+    assert stub_merge.merge_stub(stub, numeric_file_map) == (stub, 0, 0)
+    stub = 'def _numeric(x: complex, values: typing.Sequence) -> collections.abc.Mapping[str, list]: ...\n'
+    assert stub_merge.merge_stub(stub, numeric_file_map) == (stub, 0, 0)
+
+def test_widen_typing_expressions(numeric_file_map):
+    stub = 'def _numeric(x: int, values: list[int]) -> str: ...\n'
+    result = stub_merge.merge_stub(stub, numeric_file_map)
+    assert result.text == 'def _numeric(x: Union[int, float], values: Union[list[int], tuple[int]])' \
+        ' -> Union[str, dict[str, list[tuple[float, str]]], dict[str, list[tuple[int, str]]]]: ...\n'
+    assert (result.added, result.widened) == (0, 3)
+
+def test_is_typing_expression():
+    assert stub_merge._is_typing_expression('dict[str, int | None]')
+    assert stub_merge._is_typing_expression('Callable[[int], str]')
+    assert not stub_merge._is_typing_expression('list([int])')
+    assert not stub_merge._is_typing_expression('f.<locals>.A')
+
+def test_syntax_error(file_map):
+    with pytest.raises(stub_merge.StubMergeException):
+        stub_merge.merge_stub('def _example(a: ...\n', file_map)
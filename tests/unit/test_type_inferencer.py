@@ -13,6 +13,7 @@ import collections # To test problematic named tuple
 import base64 # Just used as an example of stdlib usage
 import inspect
 import io
+import logging
 import os
 import pprint
 # import sys
@@ -20,6 +21,7 @@ import pprint
 import pytest
 
 from typin import type_inferencer
+from typin import types
 
 def test_creation():
     t = type_inferencer.TypeInferencer()
@@ -972,11 +974,12 @@ def test_generator_line_number_range():
     assert lines_yielded == [2, 2, 2, 4, 4, 4,]
     fts = ti.function_types(__file__, '', 'function_gen_lineno')
     assert fts.line_range == (line_first_gen, line_last_gen)
-    assert fts.call_line_numbers == [
-                                     line_first_gen,
-                                     line_first_gen + 2,
-                                     line_first_gen + 4,
-                                     ]
+    # Resumption after a yield is not a new entry point.
+    assert fts.call_line_numbers == [line_first_gen,]
+    assert fts.yield_types == {
+        line_first_gen + 2 : {types.Type(0)},
+        line_first_gen + 4 : {types.Type(0)},
+    }
 
 def test_file_filtering():
     """This exercises code in the stdlib, 3rd party libraries and local
@@ -1358,7 +1361,7 @@ def test_generator():
 #     print()
 #     pprint.pprint(ti.function_map)
     expected = [
-        'def gen() -> Union[None, int]: ...',
+        'def gen() -> Generator[int, None, None]: ...',
     ]
     assert ti.pretty_format(__file__) == '\n'.join(expected)
     fts = ti.function_types(__file__, '', 'gen')
@@ -1384,8 +1387,8 @@ def test_generator_in_generator():
 #     pprint.pprint(ti.function_map)
 #     print(ti.pretty_format(__file__))
     expected = [
-        'def gen_inner(num: int) -> Union[None, int]: ...',
-        'def gen_outer() -> Union[None, int]: ...',
+        'def gen_inner(num: int) -> Generator[int, None, None]: ...',
+        'def gen_outer() -> Generator[int, None, None]: ...',
     ]
     assert ti.pretty_format(__file__) == '\n'.join(expected)
     fts = ti.function_types(__file__, '', 'gen_inner')
@@ -1418,8 +1421,8 @@ def test_generator_in_generator_that_raises():
 #     pprint.pprint(ti.function_map)
 #     print(ti.pretty_format(__file__))
     expected = [
-        'def gen_inner(num: int) -> int: ...',
-        'def gen_outer() -> Union[None, int]: ...',
+        'def gen_inner(num: int) -> Generator[int, None, None]: ...',
+        'def gen_outer() -> Generator[int, None, None]: ...',
     ]
     assert ti.pretty_format(__file__) == '\n'.join(expected)
     fts = ti.function_types(__file__, '', 'gen_inner')
@@ -1427,6 +1430,71 @@ def test_generator_in_generator_that_raises():
     fts = ti.function_types(__file__, '', 'gen_outer')
     assert fts.exception_type_strings == {}
 
+def test_function_at_and_functions_in_range():
+    start_lineno = inspect.currentframe().f_lineno + 1
+    def outer(x):
+        def inner(y):
+            return y
+
+        return inner(x)
+
+    def other(x):
+        return x
+
+    with type_inferencer.TypeInferencer() as ti:
+        outer(1)
+        other(2)
+    assert ti.function_at(__file__, start_lineno) == [('', 'outer')]
+    assert ti.function_at(__file__, start_lineno + 2) == [('outer.<locals>', 'inner'), ('', 'outer')]
+    # Blank line within outer() is found from the source.
+    assert ti.function_at(__file__, start_lineno + 3) == [('', 'outer')]
+    assert ti.function_at(__file__, start_lineno + 6) == [('', 'other')]
+    assert ti.function_at(__file__, start_lineno - 1) == []
+    assert ti.functions_in_range(__file__, start_lineno + 2, start_lineno + 7) == [
+        ('', 'outer'), ('outer.<locals>', 'inner'), ('', 'other'),
+    ]
+    with pytest.raises(KeyError):
+        ti.function_at('no_such_file.py', 1)
+
+def test_iter_pretty_format():
+    def func_a(arg):
+        return arg
+
+    def func_b(arg):
+        return arg
+
+    with type_inferencer.TypeInferencer() as ti:
+        func_a(1)
+        func_b('string')
+    result = ti.iter_pretty_format()
+    assert inspect.isgenerator(result)
+    assert '\n'.join(result) == ti.pretty_format()
+    assert list(ti.iter_pretty_format(__file__)) == [
+        'def func_a(arg: int) -> int: ...',
+        'def func_b(arg: str) -> str: ...',
+    ]
+
+def test_write_pretty_format():
+    def func_a(arg):
+        return arg
+
+    with type_inferencer.TypeInferencer() as ti:
+        func_a(1)
+    stream = io.StringIO()
+    assert ti.write_pretty_format(stream) == ti.pretty_format().count('\n') + 1
+    assert stream.getvalue() == ti.pretty_format() + '\n'
+
+def test_iter_dump():
+    def func_a(arg):
+        return arg
+
+    with type_inferencer.TypeInferencer() as ti:
+        func_a(1)
+    stream = io.StringIO()
+    ti.dump(stream)
+    assert ''.join(ti.iter_dump()) == stream.getvalue()
+    assert '    Function: "func_a"' in stream.getvalue()
+
 def test_find_docstring_insertion_line_number_simple():
     src = """# Line 1
 # Line 2
@@ -1497,6 +1565,18 @@ def foo(a, # Line 3
     with pytest.raises(IndexError):
         ti.find_docstring_insertion_line_number('foo', src_lines, 3)
 
+def test_find_docstring_insertion_line_number_annotations():
+    src = """# Line 1
+@foo # Line 2
+async def foo(a: int = bar(1), # Line 3
+              b: str = '):', # Line 4
+              ) -> Dict[str, int]: # Line 5 <---
+    pass
+"""
+    src_lines = src.split('\n')
+    ti = type_inferencer.TypeInferencer()
+    assert ti.find_docstring_insertion_line_number('foo', src_lines, 2) == 5
+
 def test_insert_docstrings_simple_function():
     start_lineno = inspect.currentframe().f_lineno + 1
     def func_single_arg_return_arg(arg):
@@ -1778,6 +1858,42 @@ def test_insert_docstrings_simple_class_multiline_arguments():
     # pprint.pprint(new_src_lines[src_start-2:])
     assert new_src_lines == exp_lines
 
+def test_iter_insert_docstrings():
+    def func_single_arg_return_arg(arg):
+        return arg
+
+    with type_inferencer.TypeInferencer() as ti:
+        func_single_arg_return_arg('string')
+    with open(__file__) as f:
+        src_lines = f.readlines()
+    docstring_map = ti.docstring_map(__file__, style='sphinx')
+    result = ti.iter_insert_docstrings(__file__, src_lines, 'sphinx', docstring_map)
+    assert inspect.isgenerator(result)
+    new_src_lines = list(result)
+    assert new_src_lines == ti.insert_docstrings(__file__, src_lines, style='sphinx')
+    assert len(new_src_lines) == len(src_lines) + 8
+
+def test_iter_insert_docstrings_unparsable(caplog):
+    def first(arg):
+        return arg
+
+    def second(arg):
+        return arg
+
+    with type_inferencer.TypeInferencer() as ti:
+        first('string')
+        second(1)
+    with open(__file__) as f:
+        # Python 2 so it can not be parsed.
+        src_lines = f.readlines() + ["print 'Python 2'\n"]
+    docstring_map = ti.docstring_map(__file__, style='sphinx')
+    assert len(docstring_map) == 2
+    with caplog.at_level(logging.WARNING):
+        new_src_lines = list(ti.iter_insert_docstrings(__file__, src_lines, 'sphinx', docstring_map))
+    assert len(new_src_lines) == len(src_lines) + 16
+    # Parsed once, not once per function.
+    assert sum('Can not parse' in r.getMessage() for r in caplog.records) == 1
+
 
 def test_event_count_on_a_couple_of_functions():
     def func_single_arg_no_return(arg):
@@ -1807,3 +1923,288 @@ def test_event_counter_on_a_couple_of_functions():
     assert ti.event_counter['line'] == 3
     assert ti.event_counter['return'] == 2
 
+
+def test_pretty_format_overloads():
+    def encode(s):
+        return s
+    def twice(v):
+        return v * 2
+    with type_inferencer.TypeInferencer() as ti:
+        encode(b'')
+        encode('')
+        twice(2)
+    expected = [
+        '@overload',
+        'def encode(s: bytes) -> bytes: ...',
+        '@overload',
+        'def encode(s: str) -> str: ...',
+        'def twice(v: int) -> int: ...',
+    ]
+    assert ti.pretty_format(__file__, use_overloads=True) == '\n'.join(expected)
+    expected = [
+        'def encode(s: bytes, str) -> Union[bytes, str]: ...',
+        'def twice(v: int) -> int: ...',
+    ]
+    assert ti.pretty_format(__file__) == '\n'.join(expected)
+
+def test_widen_threshold():
+    def log(value):
+        pass
+    with type_inferencer.TypeInferencer(widen_threshold=3) as ti:
+        for value in (1, 2.0, 3j, 4, True):
+            log(value)
+    assert ti.pretty_format(__file__) == 'def log(value: numbers.Number) -> None: ...'
+    stream = io.StringIO()
+    ti.dump(stream)
+    assert 'Widened arguments: \'value\' -> \'numbers.Number from 4 types\'' in stream.getvalue()
+
+def test_generator_return_value():
+    def gen(num):
+        for i in range(num):
+            yield str(i)
+        return num
+
+    with type_inferencer.TypeInferencer() as ti:
+        g = gen(2)
+        assert list(g) == ['0', '1']
+    expected = [
+        'def gen(num: int) -> Generator[str, None, int]: ...',
+    ]
+    assert ti.pretty_format(__file__) == '\n'.join(expected)
+
+def test_generator_closed():
+    def gen():
+        yield 1
+        yield 2
+
+    with type_inferencer.TypeInferencer() as ti:
+        g = gen()
+        next(g)
+        g.close()
+    expected = [
+        'def gen() -> Generator[int, None, None]: ...',
+    ]
+    assert ti.pretty_format(__file__) == '\n'.join(expected)
+
+def test_generator_sampled():
+    def gen(num):
+        for i in range(num):
+            yield i
+
+    with type_inferencer.TypeInferencer() as ti:
+        for _i in gen(1000):
+            pass
+    fts = ti.function_types(__file__, '', 'gen')
+    assert fts.call_line_numbers == [fts.line_range[0]]
+    assert fts.yield_types == {fts.line_range[0] + 2 : {types.Type(0)}}
+
+def test_coroutine():
+    import asyncio
+
+    async def coro(value):
+        await asyncio.sleep(0)
+        return value * 2
+
+    with type_inferencer.TypeInferencer() as ti:
+        assert asyncio.run(coro(2.0)) == 4.0
+    assert ti.stub_file_str(__file__, '', 'coro') \
+        == 'def coro(value: float) -> Coroutine[Any, Any, float]: ...'
+    fts = ti.function_types(__file__, '', 'coro')
+    assert len(fts.call_line_numbers) == 1
+    assert fts.exception_type_strings == {}
+
+def test_async_generator():
+    import asyncio
+
+    async def agen(num):
+        for i in range(num):
+            await asyncio.sleep(0)
+            yield i
+
+    async def consume():
+        return [v async for v in agen(3)]
+
+    with type_inferencer.TypeInferencer() as ti:
+        assert asyncio.run(consume()) == [0, 1, 2]
+    assert ti.stub_file_str(__file__, '', 'agen') \
+        == 'def agen(num: int) -> AsyncGenerator[int, None]: ...'
+
+def test_asyncio_aware_with_statement():
+    class Manager:
+        def __enter__(self):
+            return self
+        def __exit__(self, exc_type, exc_value, tb):
+            try:
+                raise KeyError()
+            except KeyError:
+                pass
+            return False
+
+    line_raises = inspect.currentframe().f_lineno + 3
+    def func_raises():
+        with Manager():
+            raise ValueError()
+
+    with type_inferencer.TypeInferencer(asyncio_aware=True) as ti:
+        try:
+            func_raises()
+        except ValueError:
+            pass
+    fts = ti.function_types(__file__, '', 'func_raises')
+    assert fts.exception_type_strings == {line_raises : {'ValueError'}}
+    assert fts.return_type_strings == {}
+    fts = ti.function_types(__file__, 'Manager', '__exit__')
+    assert fts.exception_type_strings == {}
+    assert ti.exceptions_in_progress == {}
+
+def test_asyncio_aware_interleaved_tasks():
+    import asyncio
+
+    class Manager:
+        async def __aenter__(self):
+            return self
+        async def __aexit__(self, exc_type, exc_value, tb):
+            # Other tasks run while the exception is in flight.
+            await asyncio.sleep(0)
+            return False
+
+    line_raises = inspect.currentframe().f_lineno + 3
+    async def task_raises(value):
+        async with Manager():
+            raise ValueError(value)
+
+    async def task_catches(value):
+        try:
+            await task_raises(value)
+        except ValueError:
+            pass
+        return value
+
+    async def main():
+        return await asyncio.gather(task_catches(1), task_catches(2), task_catches(3))
+
+    with type_inferencer.TypeInferencer(asyncio_aware=True) as ti:
+        assert asyncio.run(main()) == [1, 2, 3]
+    fts = ti.function_types(__file__, '', 'task_raises')
+    assert fts.exception_type_strings == {line_raises : {'ValueError'}}
+    assert len(fts.call_line_numbers) == 1
+    fts = ti.function_types(__file__, '', 'task_catches')
+    assert fts.exception_type_strings == {}
+    assert ti.stub_file_str(__file__, '', 'task_catches') \
+        == 'def task_catches(value: int) -> Coroutine[Any, Any, int]: ...'
+
+def test_stats():
+    with type_inferencer.TypeInferencer() as ti:
+        for i in range(200):
+            _stats_function(i)
+    stats = ti.stats()
+    assert stats['events'] == ti.eventno
+    assert stats['sampled_events'] > 0
+    assert set(stats['phase_ns']) == set(ti.PHASES)
+    assert sum(stats['phase_ns'].values()) > 0
+    assert stats['file_events'][__file__] >= 400
+    assert stats['function_events'][__file__]['_stats_function'] == 400
+    assert stats['code_resolution']['misses'] >= 1
+    assert stats['code_resolution']['hit_rate'] > 0.9
+
+def test_stats_types_phase():
+    # Type construction is timed where it happens, not repeated.
+    with type_inferencer.TypeInferencer() as ti:
+        for i in range(200):
+            _stats_function(i)
+    phase_ns = ti.stats()['phase_ns']
+    assert phase_ns[ti.PHASE_TYPES] > 0
+    assert phase_ns[ti.PHASE_RECORD] > 0
+    assert not hasattr(ti, '_time_type_construction')
+    fts = ti.function_types(__file__, '', '_stats_function')
+    assert str(fts) == 'type: (value int) -> int'
+
+def test_stats_report():
+    with type_inferencer.TypeInferencer() as ti:
+        _stats_function(1)
+    report = ti.stats_report()
+    assert 'Estimated time by phase:' in report
+    assert '_stats_function' in report
+
+def _stats_function(value):
+    return value + 1
+
+def test_code_bindings():
+    ti = type_inferencer.TypeInferencer()
+    with ti:
+        for i in range(5):
+            _stats_function(i)
+        bindings = dict(ti._code_bindings)
+    binding = bindings[_stats_function.__code__]
+    assert binding.func_types is ti.function_types(__file__, '', '_stats_function')
+    assert binding.file_path == __file__
+    assert binding.namespace == ''
+    assert binding.q_name == '_stats_function'
+    assert not binding.settled
+    # Cleared when tracing stops.
+    assert ti._code_bindings == {}
+    stats = ti.stats()
+    assert stats['code_resolution']['hits'] >= 9
+    # Rebound to the same record.
+    with ti:
+        _stats_function(10)
+    assert ti.function_types(__file__, '', '_stats_function') is binding.func_types
+
+def _verbose_function(value):
+    try:
+        if value < 0:
+            raise ValueError()
+    except ValueError:
+        pass
+    return value
+
+@pytest.mark.parametrize('verbose', [False, True])
+def test_verbose_same_result(verbose):
+    with type_inferencer.TypeInferencer(verbose=verbose) as ti:
+        _verbose_function(1)
+        _verbose_function(-1)
+    assert ti.pretty_format(__file__).endswith('def _verbose_function(value: int) -> int: ...')
+
+def test_verbose_default():
+    assert not type_inferencer.TypeInferencer()._verbose
+    assert type_inferencer.TypeInferencer(trace_frame_event=True)._verbose
+
+def test_trace_frame_event(capsys):
+    with type_inferencer.TypeInferencer(trace_frame_event=True, events_to_trace=['call']):
+        _verbose_function(1)
+    out = capsys.readouterr().out
+    assert '_verbose_function' in out
+    assert 'func_types now:' in out
+
+def test_function_map_file_ids():
+    with type_inferencer.TypeInferencer() as ti:
+        _stats_function(1)
+    assert __file__ in ti.function_map
+    assert list(ti.function_map) == list(ti.file_paths())
+    file_id = ti.names.get(__file__)
+    assert isinstance(file_id, int)
+    assert ti.function_map[__file__]._data is ti._functions[file_id]
+    assert 'no_such_file.py' not in ti.function_map
+    assert 'no_such_file.py' not in ti.names
+
+def test_function_map_name_ids():
+    with type_inferencer.TypeInferencer(columnar=True) as ti:
+        _stats_function(1)
+    assert ti.store.names is ti.names
+    namespaces = ti._functions[ti.names.get(__file__)]
+    functions = namespaces[ti.names.get('')]
+    assert ti.names.get('_stats_function') in functions
+    assert '_stats_function' in ti.function_map[__file__]['']
+    # Qualified names in the event counters and type names in the store are
+    # interned in the same cache.
+    assert (ti.names.get(__file__), ti.names.get('_stats_function')) in ti.function_event_counter
+    assert 'int' in ti.names
+
+def test_function_map_mutable():
+    ti = type_inferencer.TypeInferencer()
+    ti.function_map['a.py'] = {'' : {}}
+    assert dict(ti.function_map) == {'a.py' : {'' : {}}}
+    del ti.function_map['a.py']
+    assert len(ti.function_map) == 0
+    with pytest.raises(KeyError):
+        del ti.function_map['a.py']
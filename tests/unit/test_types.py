@@ -570,3 +570,326 @@ Raises:
     assert fts.docstring(include_returns=False, style='google') == expected
 
 #---- END: docstring tests
+
+def test_FunctionTypes_call_return_rows():
+    fts = types.FunctionTypes()
+    fts.add_call(ArgInfo(['i'], None, None, {'i' : 42}), '/foo/bar/baz.py', 100)
+    fts.add_return(84, 101)
+    fts.add_call(ArgInfo(['i'], None, None, {'i' : 1}), '/foo/bar/baz.py', 100)
+    fts.add_return(2, 101)
+    fts.add_call(ArgInfo(['i'], None, None, {'i' : 'x'}), '/foo/bar/baz.py', 100)
+    fts.add_return('xx', 101)
+    rows = {
+        (tuple(str(t) for t in arg_types), kind, str(t)) : count
+        for (arg_types, kind, t), count in fts.call_return_rows.items()
+    }
+    assert rows == {
+        (('int',), 'return', 'int') : 2,
+        (('str',), 'return', 'str') : 1,
+    }
+
+def test_FunctionTypes_call_return_rows_recursive():
+    fts = types.FunctionTypes()
+    # Simulate f('a') calls f(1) which raises, f('a') then returns None.
+    fts.add_call(ArgInfo(['i'], None, None, {'i' : 'a'}), '/foo/bar/baz.py', 100)
+    fts.add_call(ArgInfo(['i'], None, None, {'i' : 1}), '/foo/bar/baz.py', 100)
+    fts.add_exception(ValueError(), 102)
+    fts.add_return(None, 103)
+    rows = {
+        (tuple(str(t) for t in arg_types), kind, str(t)) : count
+        for (arg_types, kind, t), count in fts.call_return_rows.items()
+    }
+    assert rows == {
+        (('int',), 'exception', 'ValueError') : 1,
+        (('str',), 'return', 'NoneType') : 1,
+    }
+
+def test_FunctionTypes_call_return_rows_interned():
+    fts = types.FunctionTypes()
+    for i in range(4):
+        fts.add_call(ArgInfo(['i'], None, None, {'i' : i}), '/foo/bar/baz.py', 100)
+        fts.add_return(i, 101)
+    ((arg_types, _kind, ret_type),) = fts.call_return_rows.keys()
+    assert arg_types[0] is ret_type
+
+def test_FunctionTypes_interned_types_bounded():
+    # Distinct classes through one argument are widened away and their rows
+    # evicted, the interned types do not grow with them.
+    fts = types.FunctionTypes()
+    for i in range(2000):
+        value = type('C{:d}'.format(i), (), {})()
+        fts.add_call(ArgInfo(['x'], None, None, {'x' : value}), '/foo/bar/baz.py', 100)
+        fts.add_return(None, 101)
+    assert fts.argument_type_strings == {'x' : {'object'}}
+    assert fts.widened_arguments['x'][1] == 2000
+    assert fts.call_return_rows_evicted > 0
+    assert len(fts.call_return_rows) == fts.MAX_CALL_RETURN_ROWS
+    assert len(fts._interned_types) <= max(fts.INTERNED_TYPES_PRUNE_MIN,
+                                           2 * (fts.MAX_CALL_RETURN_ROWS + 2))
+    # Covered types are not interned.
+    fts.add_call(ArgInfo(['x'], None, None, {'x' : type('D', (), {})()}), '/foo/bar/baz.py', 100)
+    assert 'D' not in [str(t).rsplit('.', 1)[-1] for t in fts._interned_types]
+
+def test_FunctionTypes_call_return_rows_evicted():
+    class Small(types.FunctionTypes):
+        MAX_CALL_RETURN_ROWS = 2
+    fts = Small()
+    for value in (1, 1, 1, 'a', 2.0):
+        fts.add_call(ArgInfo(['i'], None, None, {'i' : value}), '/foo/bar/baz.py', 100)
+        fts.add_return(value, 101)
+    assert len(fts.call_return_rows) == 2
+    assert fts.call_return_rows_evicted == 1
+    assert sorted(str(row[2]) for row in fts.call_return_rows) == ['float', 'int']
+    # Incomplete data so no overloads
+    assert fts.overloads() == []
+
+def test_FunctionTypes_stub_file_strs_overloads():
+    fts = types.FunctionTypes()
+    fts.add_call(ArgInfo(['s'], None, None, {'s' : b''}), '/foo/bar/baz.py', 100)
+    fts.add_return(b'', 101)
+    fts.add_call(ArgInfo(['s'], None, None, {'s' : ''}), '/foo/bar/baz.py', 100)
+    fts.add_return('', 101)
+    assert fts.stub_file_str() == '(s: bytes, str) -> Union[bytes, str]: ...'
+    assert fts.stub_file_strs() == [
+        '(s: bytes) -> bytes: ...',
+        '(s: str) -> str: ...',
+    ]
+    assert fts.stub_file_strs(use_overloads=False) == [
+        '(s: bytes, str) -> Union[bytes, str]: ...',
+    ]
+
+def test_FunctionTypes_stub_file_strs_no_overloads_same_return():
+    fts = types.FunctionTypes()
+    fts.add_call(ArgInfo(['s'], None, None, {'s' : b''}), '/foo/bar/baz.py', 100)
+    fts.add_return(None, 101)
+    fts.add_call(ArgInfo(['s'], None, None, {'s' : ''}), '/foo/bar/baz.py', 100)
+    fts.add_return(None, 101)
+    assert fts.overloads() == []
+    assert fts.stub_file_strs() == ['(s: bytes, str) -> None: ...']
+
+def test_FunctionTypes_stub_file_strs_too_many_overloads():
+    fts = types.FunctionTypes()
+    for value in (1, 'a', 2.0, b'', [], None)[:fts.MAX_OVERLOADS + 1]:
+        fts.add_call(ArgInfo(['v'], None, None, {'v' : value}), '/foo/bar/baz.py', 100)
+        fts.add_return(value, 101)
+    assert fts.overloads() == []
+    assert len(fts.stub_file_strs()) == 1
+
+def test_common_base_class():
+    class A: pass
+    class B(A): pass
+    class C(A): pass
+    assert types.common_base_class([B, C]) is A
+    assert types.common_base_class([bool, int]) is int
+    assert types.common_base_class([int, str]) is object
+
+@pytest.mark.parametrize('values, expected', [
+    ((1, 2.0, 3j), 'numbers.Number'),
+    (({}, collections.OrderedDict()), 'dict'),
+    (([], (), ''), 'collections.abc.Sequence'),
+    ((1, ''), 'object'),
+])
+def test_widen(values, expected):
+    assert str(types.widen([types.Type(v) for v in values])) == expected
+
+def test_FunctionTypes_widen_arguments():
+    fts = types.FunctionTypes(widen_threshold=2)
+    for value in (1, 2.0, 3j):
+        fts.add_call(ArgInfo(['v'], None, None, {'v' : value}), '/foo/bar/baz.py', 100)
+        fts.add_return(None, 101)
+    assert fts.argument_type_strings == {'v' : {'numbers.Number'}}
+    assert fts.widened_arguments['v'][1] == 3
+    # Covered by the widened type so not added.
+    fts.add_call(ArgInfo(['v'], None, None, {'v' : True}), '/foo/bar/baz.py', 100)
+    fts.add_return(None, 101)
+    assert fts.argument_type_strings == {'v' : {'numbers.Number'}}
+    assert fts.stub_file_str() == '(v: numbers.Number) -> None: ...'
+    # The covered type is counted.
+    assert 'Widened arguments: \'v\' -> \'numbers.Number from 4 types\'' in repr(fts)
+
+def test_FunctionTypes_widen_twice():
+    fts = types.FunctionTypes(widen_threshold=2)
+    for value in (1, 2.0, 3j, '', b''):
+        fts.add_call(ArgInfo(['v'], None, None, {'v' : value}), '/foo/bar/baz.py', 100)
+    assert fts.argument_type_strings == {'v' : {'object'}}
+    assert fts.widened_arguments['v'][1] == 5
+
+def test_FunctionTypes_widen_returns():
+    fts = types.FunctionTypes(widen_threshold=2)
+    for value in ([], (), ''):
+        fts.add_return(value, 101)
+    assert fts.return_type_strings == {101 : {'collections.abc.Sequence'}}
+    assert list(fts.widened_returns.keys()) == [101]
+
+def test_FunctionTypes_widen_disabled():
+    fts = types.FunctionTypes(widen_threshold=0)
+    for value in (1, 2.0, 3j):
+        fts.add_call(ArgInfo(['v'], None, None, {'v' : value}), '/foo/bar/baz.py', 100)
+    assert fts.argument_type_strings == {'v' : {'complex', 'float', 'int'}}
+    assert fts.widened_arguments == {}
+    assert 'Widened' not in repr(fts)
+
+def test_FunctionTypes_generator():
+    fts = types.FunctionTypes(generator_kind=types.FunctionTypes.KIND_GENERATOR)
+    fts.add_call(ArgInfo(['i'], None, None, {'i' : 42}), '/foo/bar/baz.py', 100)
+    fts.add_yield(1, 101)
+    fts.add_resume(101)
+    fts.add_send('s')
+    fts.add_yield(2.0, 102)
+    fts.add_resume(102)
+    fts.add_return(True, 103)
+    assert fts.stub_file_str() == '(i: int) -> Generator[Union[float, int], str, bool]: ...'
+    assert fts.call_line_numbers == [100]
+    assert fts.line_range == (100, 103)
+    assert fts.call_return_rows == {}
+
+def test_FunctionTypes_generator_yield_sampling():
+    fts = types.FunctionTypes(generator_kind=types.FunctionTypes.KIND_GENERATOR)
+    fts.add_call(ArgInfo([], None, None, {}), '/foo/bar/baz.py', 100)
+    for i in range(fts.YIELD_SAMPLE_FULL + 1):
+        fts.add_yield([i], 101)
+    # Same class so not decomposed.
+    fts.add_yield(['str'], 101)
+    assert fts.stub_file_str() == '() -> Generator[list([int]), None, None]: ...'
+    # New class so decomposed.
+    fts.add_yield('str', 101)
+    assert fts.stub_file_str() == '() -> Generator[Union[list([int]), str], None, None]: ...'
+
+def test_FunctionTypes_async_generator():
+    fts = types.FunctionTypes(generator_kind=types.FunctionTypes.KIND_ASYNC_GENERATOR)
+    fts.add_call(ArgInfo([], None, None, {}), '/foo/bar/baz.py', 100)
+    fts.add_yield(b'', 101)
+    assert fts.stub_file_str() == '() -> AsyncGenerator[bytes, None]: ...'
+
+def test_FunctionTypes_coroutine():
+    fts = types.FunctionTypes(generator_kind=types.FunctionTypes.KIND_COROUTINE)
+    fts.add_call(ArgInfo([], None, None, {}), '/foo/bar/baz.py', 100)
+    fts.add_return(1, 101)
+    assert fts.stub_file_str() == '() -> Coroutine[Any, Any, int]: ...'
+
+def test_Type_array():
+    import array
+    t = types.Type(array.array('d', range(1000)))
+    assert str(t) == "array.array('d')"
+    assert t == types.Type(array.array('d'))
+    assert t != types.Type(array.array('i'))
+
+def test_Type_memoryview():
+    t = types.Type(memoryview(b'abc'))
+    assert str(t) == 'memoryview[B, 1d]'
+    assert str(types.Type(memoryview(b'abcd').cast('I'))) == 'memoryview[I, 1d]'
+
+def test_Type_bytearray():
+    assert str(types.Type(bytearray(b'abc'))) == 'bytearray'
+
+def test_Type_array_in_list():
+    import array
+    t = types.Type([array.array('d'), array.array('i')])
+    assert str(t) == "list([array.array('d'), array.array('i')])"
+
+def test_Type_extractor_not_iterated():
+    class Huge(list):
+        def __iter__(self):
+            raise AssertionError('Must not iterate')
+    types.register_type_extractor(Huge, lambda obj: 'Huge[...]')
+    assert str(types.Type(Huge([1, 2, 3]))) == 'Huge[...]'
+
+def test_Type_lazy_extractor():
+    class Matrix:
+        pass
+    Matrix.__module__ = 'typin_test_lazy_module'
+    types.register_lazy_type_extractor('typin_test_lazy_module', Matrix.__qualname__,
+                                       lambda obj: 'Matrix[2d]')
+    class SubMatrix(Matrix):
+        pass
+    assert str(types.Type(Matrix())) == 'Matrix[2d]'
+    assert str(types.Type(SubMatrix())) == 'Matrix[2d]'
+
+def test_Type_numpy_not_imported():
+    import sys
+    if 'numpy' in sys.modules:
+        pytest.skip('numpy already imported')
+    types.Type(memoryview(b''))
+    types.Type(object())
+    assert 'numpy' not in sys.modules
+
+def test_Type_numpy_ndarray():
+    numpy = pytest.importorskip('numpy')
+    t = types.Type(numpy.zeros((1000, 1000)))
+    assert str(t) == 'numpy.ndarray[float64, 2d]'
+    assert t != types.Type(numpy.zeros((3,), dtype=numpy.int32))
+
+@pytest.mark.parametrize('obj, expected', [
+    (1, 'int'),
+    (None, 'None'),
+    ([], 'list'),
+    ([1, 'a', None], 'list[int | str | None]'),
+    ((), 'tuple[()]'),
+    ((1, 2.0), 'tuple[int, float]'),
+    ({1, 2}, 'set[int]'),
+    ({'a': [1], 'b': None}, 'dict[str, list[int] | None]'),
+    ({}, 'dict'),
+    (memoryview(b''), 'memoryview'),
+])
+def test_Type_annotation_str(obj, expected):
+    assert types.Type(obj).annotation_str() == expected
+
+def test_Type_annotation_str_namedtuple():
+    NT = collections.namedtuple('NT', 'a')
+    assert types.Type(NT(1)).annotation_str() == '{:s}.NT'.format(__name__)
+
+def test_union_annotation_str():
+    assert types.union_annotation_str([]) == 'None'
+    assert types.union_annotation_str([types.Type(None), types.Type(1), types.Type(1.0)]) \
+        == 'float | int | None'
+
+def test_type_from_str():
+    t = types.Type.from_str('int')
+    assert str(t) == 'int'
+    assert t == types.Type(1)
+    assert types.Type(1) == t
+    assert t != types.Type('a')
+    assert len(set([t, types.Type(1)])) == 1
+    assert t.annotation_str() == 'int'
+    assert types.Type.from_str('list([int])') == types.Type([1])
+
+ShallowNT = collections.namedtuple('ShallowNT', 'a b')
+
+@pytest.mark.parametrize('obj', [
+    1,
+    None,
+    (1, 1),
+    {'a': 1, 'b': 1},
+    [1, 'x', 1],
+    {1, 2.0},
+    ShallowNT(1, 'x'),
+    [[1, [2]], {'k': (1,)}],
+    b'bytes',
+    (),
+    {},
+    frozenset([1]),
+])
+def test_Type_from_snapshot(obj):
+    t = types.Type.from_snapshot(types.shallow_snapshot(obj))
+    assert t == types.Type(obj)
+    assert str(t) == str(types.Type(obj))
+
+def test_Type_from_snapshot_recursive():
+    obj = [1]
+    obj.append(obj)
+    assert str(types.Type.from_snapshot(types.shallow_snapshot(obj))) == str(types.Type(obj))
+
+def test_shallow_snapshot_sample_size():
+    snap = types.shallow_snapshot(list(range(100)) + ['x'], sample_size=4)
+    assert len(snap[1]) == 4
+    assert str(types.Type.from_snapshot(snap)) == 'list([int])'
+
+def test_shallow_snapshot_depth():
+    snap = types.shallow_snapshot([[[1]]], depth=2)
+    assert str(types.Type.from_snapshot(snap)) == 'list([list([list])])'
+
+def test_shallow_snapshot_before_mutation():
+    obj = [1]
+    snap = types.shallow_snapshot(obj)
+    obj[0] = 'x'
+    assert str(types.Type.from_snapshot(snap)) == 'list([int])'
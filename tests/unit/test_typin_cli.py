@@ -0,0 +1,173 @@
+'''
+Tests for the command line functions that write out results.
+'''
+import io
+import os
+import sys
+
+import pytest
+
+from typin import type_inferencer
+from typin import typin_cli
+
+def _example(x):
+    return 2 * x
+
+@pytest.fixture(scope='module')
+def ti():
+    with type_inferencer.TypeInferencer() as ti:
+        _example(12)
+    return ti
+
+def _read_stubs(written):
+    result = {}
+    for out_path, _line_count, _written in written:
+        with open(out_path) as f:
+            # Ignore the header with the date.
+            result[out_path] = f.readlines()[1:]
+    return result
+
+def test_write_all_stub_files_serial(ti, tmpdir):
+    written = typin_cli.write_all_stub_files(ti, str(tmpdir), jobs=1)
+    assert written == sorted(written)
+    out_paths = [p for p, _n, _w in written]
+    assert typin_cli._new_file_path(str(tmpdir), __file__) in out_paths
+    stubs = _read_stubs(written)
+    assert 'def _example(x: int) -> int: ...' in ''.join(
+        stubs[typin_cli._new_file_path(str(tmpdir), __file__)])
+    assert all(w for _p, _n, w in written)
+    # No temporary files left behind.
+    for out_path in out_paths:
+        assert sorted(os.listdir(os.path.dirname(out_path))) == sorted(
+            os.path.basename(p) for p in out_paths if os.path.dirname(p) == os.path.dirname(out_path))
+
+def test_write_all_stub_files_parallel(ti, tmpdir):
+    serial = typin_cli.write_all_stub_files(ti, str(tmpdir.mkdir('serial')), jobs=1)
+    parallel_dir = str(tmpdir.mkdir('parallel'))
+    # Small tasks so that more than one worker gets some.
+    stub_files_per_task = typin_cli.STUB_FILES_PER_TASK
+    typin_cli.STUB_FILES_PER_TASK = 1
+    try:
+        parallel = typin_cli.write_all_stub_files(ti, parallel_dir, jobs=2)
+    finally:
+        typin_cli.STUB_FILES_PER_TASK = stub_files_per_task
+    assert parallel == sorted(parallel)
+    assert len(parallel) == len(serial)
+    assert [n for _p, n, _w in parallel] == [n for _p, n, _w in serial]
+    assert list(_read_stubs(parallel).values()) == list(_read_stubs(serial).values())
+
+def test_write_all_stub_files_unchanged(ti, tmpdir):
+    stubs_dir = str(tmpdir.join('stubs'))
+    first = typin_cli.write_all_stub_files(ti, stubs_dir, jobs=1)
+    assert os.path.isfile(typin_cli.stubs_manifest_path(stubs_dir))
+    mtimes = {p : os.stat(p).st_mtime_ns for p, _n, _w in first}
+    second = typin_cli.write_all_stub_files(ti, stubs_dir, jobs=1)
+    assert [(p, n) for p, n, _w in second] == [(p, n) for p, n, _w in first]
+    assert not any(w for _p, _n, w in second)
+    assert {p : os.stat(p).st_mtime_ns for p, _n, _w in second} == mtimes
+
+def test_write_all_stub_files_missing_rewritten(ti, tmpdir):
+    stubs_dir = str(tmpdir.join('stubs'))
+    first = typin_cli.write_all_stub_files(ti, stubs_dir, jobs=1)
+    os.unlink(first[0][0])
+    second = typin_cli.write_all_stub_files(ti, stubs_dir, jobs=1)
+    assert [w for _p, _n, w in second] == [True] + [False] * (len(second) - 1)
+    assert os.path.isfile(first[0][0])
+
+def test_write_all_stub_files_prune_stale(ti, tmpdir):
+    stubs_dir = str(tmpdir.join('stubs'))
+    written = typin_cli.write_all_stub_files(ti, stubs_dir, jobs=1)
+    manifest = typin_cli.read_stubs_manifest(stubs_dir)
+    stale_path = os.path.join(stubs_dir, 'old', 'gone.pyi')
+    os.makedirs(os.path.dirname(stale_path))
+    with open(stale_path, 'w') as f:
+        f.write('def gone() -> None: ...\n')
+    manifest[os.path.relpath(stale_path, stubs_dir)] = '0' * 64
+    typin_cli.write_stubs_manifest(stubs_dir, manifest)
+    # Kept without prune_stale
+    typin_cli.write_all_stub_files(ti, stubs_dir, jobs=1)
+    assert os.path.isfile(stale_path)
+    assert os.path.relpath(stale_path, stubs_dir) in typin_cli.read_stubs_manifest(stubs_dir)
+    typin_cli.write_all_stub_files(ti, stubs_dir, jobs=1, prune_stale=True)
+    assert not os.path.exists(stale_path)
+    assert not os.path.exists(os.path.dirname(stale_path))
+    assert sorted(typin_cli.read_stubs_manifest(stubs_dir)) == sorted(
+        os.path.relpath(p, stubs_dir) for p, _n, _w in written)
+
+def test_insert_docstrings_parallel(ti, tmpdir):
+    serial = typin_cli.insert_docstrings(ti, str(tmpdir.mkdir('serial')), 'sphinx', jobs=1)
+    docstring_files_per_task = typin_cli.DOCSTRING_FILES_PER_TASK
+    typin_cli.DOCSTRING_FILES_PER_TASK = 1
+    try:
+        parallel = typin_cli.insert_docstrings(ti, str(tmpdir.mkdir('parallel')), 'sphinx', jobs=2)
+    finally:
+        typin_cli.DOCSTRING_FILES_PER_TASK = docstring_files_per_task
+    assert [n for _p, n in parallel] == [n for _p, n in serial]
+    out_path = typin_cli._new_file_path(str(tmpdir.join('parallel')), __file__)
+    assert (out_path, 1) in parallel
+    with open(out_path) as f:
+        assert '    :type x: ``int``\n' in f.readlines()
+    for (serial_path, _n), (parallel_path, _m) in zip(serial, parallel):
+        with open(serial_path) as f_serial, open(parallel_path) as f_parallel:
+            assert f_serial.read() == f_parallel.read()
+
+def test_write_dump(ti):
+    stream = io.StringIO()
+    typin_cli.write_dump(ti, os.path.dirname(__file__), 'sphinx', stream)
+    result = stream.getvalue()
+    assert 'def _example(x: int) -> int: ...\n' in result
+    assert ' END: ti.dump() '.center(75, '-') in result
+    assert ' END: dump_docstrings '.center(75, '-') in result
+
+def test_write_all_stub_files_merge(ti, tmpdir, capsys):
+    stubs_dir = str(tmpdir.join('stubs'))
+    out_path = typin_cli._new_file_path(stubs_dir, __file__)
+    os.makedirs(os.path.dirname(out_path))
+    with open(out_path, 'w') as f:
+        f.write('# Hand written\ndef _example(x): ...\ndef untraced(y): ...\n')
+    written = typin_cli.write_all_stub_files(ti, stubs_dir, jobs=1, merge=True)
+    assert (out_path, 3, True) in written
+    with open(out_path) as f:
+        assert f.read() == '# Hand written\ndef _example(x: int) -> int: ...\ndef untraced(y): ...\n'
+    assert 'merged: added 2 widened 0' in capsys.readouterr().out
+    # Merging again changes nothing.
+    written = typin_cli.write_all_stub_files(ti, stubs_dir, jobs=1, merge=True)
+    assert (out_path, 3, False) in written
+
+def test_write_annotations(ti, tmpdir):
+    written = typin_cli.write_annotations(ti, str(tmpdir), jobs=1)
+    out_path = typin_cli._new_file_path(str(tmpdir), __file__)
+    assert (out_path, 2, 0) in written
+    with open(out_path) as f:
+        text = f.read()
+    assert 'def _example(x: int) -> int:\n' in text
+    assert text.count('from __future__ import annotations\n') == 1
+
+def test_write_file_atomically_mode(tmpdir):
+    out_path = str(tmpdir.join('script.py'))
+    typin_cli._write_file_atomically(out_path, ('a = 1\n',))
+    assert os.stat(out_path).st_mode & 0o777 == typin_cli._new_file_mode()
+    os.chmod(out_path, 0o751)
+    typin_cli._write_file_atomically(out_path, ('a = 2\n',))
+    assert os.stat(out_path).st_mode & 0o777 == 0o751
+    with open(out_path) as f:
+        assert f.read() == 'a = 2\n'
+
+@pytest.mark.parametrize('option', [['--deferred'], ['--event-log', 'events.log']])
+def test_main_import_hook_rejects(option, monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', ['typin_cli', '--mode=import-hook', '--instrument=pkg']
+                        + option + ['example.py', ''])
+    with pytest.raises(SystemExit):
+        typin_cli.main()
+    assert 'can not be used with --deferred or --event-log' in capsys.readouterr().err
+
+def test_compile_and_exec_import_hook_cleanup(tmpdir, monkeypatch):
+    program = tmpdir.join('program.py')
+    program.write('x = 1\n')
+    # compile_and_exec() sets sys.argv.
+    monkeypatch.setattr(sys, 'argv', list(sys.argv))
+    calls = []
+    monkeypatch.setattr(type_inferencer.TypeInferencer, '_cleanup', lambda self: calls.append(self))
+    ti = typin_cli.compile_and_exec(str(program), False, [], mode=typin_cli.MODE_IMPORT_HOOK,
+                                    instrument_patterns=['no_such_package'])
+    assert calls == [ti]